@@ -10,6 +10,7 @@ Linux Agent (updated)
 import json
 import logging
 import os
+import signal
 import threading
 import time
 from pathlib import Path
@@ -19,10 +20,16 @@ ROOT = Path(__file__).resolve().parents[3]
 if str(ROOT) not in os.sys.path:
     os.sys.path.insert(0, str(ROOT))
 
-from shared.utils.crypto import decrypt_bytes, encrypt_json, ensure_key
-from shared.transport.sender import SecureSender
+from shared.utils.config_manager import ConfigManager
+from shared.transport.sender import SecureSender, EventQueue
 from shared.transport.command_listener import CommandListener
-from shared.processing.metadata import build_event_for_file, build_event_from_clipboard
+from shared.transport.spool import EventSpool
+from shared.transport.policy_sync import PolicySync
+from shared.processing.metadata import build_event_from_clipboard
+from shared.processing import hash_cache
+from shared.processing.policy_index import PolicyIndex
+from shared.processing.scheduler import EventScheduler
+from shared.processing.pipeline import FilePipeline
 
 from core.event_watcher import start_filesystem_watcher
 from core.usb_monitor import start_usb_monitor
@@ -40,50 +47,34 @@ logger = logging.getLogger("linux-agent")
 CONFIG_DIR = Path("/opt/company-agent/config")
 CONFIG_DIR.mkdir(parents=True, exist_ok=True)
 ENC_CONFIG_FILE = CONFIG_DIR / "agent_config.enc"
+POLICY_CACHE_FILE = CONFIG_DIR / "policy_cache.json"
 LOCAL_PLAIN_CONFIG = Path(__file__).parent / "config" / "agent_config.json"
 
+config_manager = ConfigManager(ENC_CONFIG_FILE, LOCAL_PLAIN_CONFIG)
+
 def load_encrypted_config():
-    if ENC_CONFIG_FILE.exists():
-        try:
-            b = ENC_CONFIG_FILE.read_bytes()
-            return decrypt_bytes(b)
-        except Exception:
-            logger.exception("decrypt failed")
-    if LOCAL_PLAIN_CONFIG.exists():
-        try:
-            return json.loads(LOCAL_PLAIN_CONFIG.read_text())
-        except Exception:
-            pass
-    return {}
+    return config_manager.get()
 
 def save_encrypted_config(cfg):
-    enc = encrypt_json(cfg)
-    ENC_CONFIG_FILE.write_bytes(enc)
-    try:
-        os.chmod(str(ENC_CONFIG_FILE), 0o600)
-    except Exception:
-        pass
+    config_manager.save(cfg)
 
-# event handling
-def handle_file_event(ev):
-    try:
-        cfg = load_encrypted_config()
-        p = Path(ev.get("file_path"))
-        if not p.exists():
-            return
-        event = build_event_for_file(p, device_id=cfg.get("device_id"), user_email=cfg.get("employee_email"), app=ev.get("app","unknown"), destination=ev.get("destination"))
-        event["foreground_process"] = get_foreground_process()
-        logger.info("File event: %s", event.get("file_name"))
-        sender.send_event(event)
-    except Exception:
-        logger.exception("handle_file_event error")
+# compiled policy used for per-event decisions; replaced wholesale on every sync
+policy_index = PolicyIndex()
+
+def load_cached_policy():
+    if POLICY_CACHE_FILE.exists():
+        try:
+            policy_index.swap(json.loads(POLICY_CACHE_FILE.read_text()))
+        except Exception:
+            logger.exception("policy cache load failed")
 
+# event handling
 def handle_clipboard_event(ev):
     try:
         cfg = load_encrypted_config()
         event = build_event_from_clipboard(ev, device_id=cfg.get("device_id"), user_email=cfg.get("employee_email"))
         logger.info("Clipboard event")
-        sender.send_event(event)
+        event_queue.submit(event)
     except Exception:
         logger.exception("handle_clipboard_event error")
 
@@ -99,14 +90,15 @@ def run_onboarding_if_needed():
 
 # policy sync thread
 def sync_policy_periodically(server_url, interval=3600):
-    import requests
+    # conditional GET: unchanged policy -> 304, changed -> patch or full body
+    sync = PolicySync(server_url, POLICY_CACHE_FILE) if server_url else None
     while True:
         try:
-            if server_url:
-                resp = requests.get(f"{server_url}/api/v1/policy", timeout=10)
-                if resp.status_code == 200:
-                    cfg_path = CONFIG_DIR / "policy_cache.json"
-                    cfg_path.write_text(json.dumps(resp.json(), indent=2))
+            if sync:
+                policy = sync.fetch()
+                if policy is not None:
+                    policy_index.swap(policy, sync.staged_version)
+                    sync.commit()
         except Exception:
             logger.exception("policy sync error")
         time.sleep(interval)
@@ -143,20 +135,35 @@ def update_poller(device_id, server_url, poll_interval=3600):
 
 # main runner
 def run_agent():
-    global sender, command_listener
+    global sender, command_listener, event_queue, scheduler, pipeline
+    # SIGHUP forces a config re-read even if the file's mtime did not change
+    signal.signal(signal.SIGHUP, lambda signum, frame: config_manager.invalidate(reload_key=True))
     cfg = run_onboarding_if_needed()
     if not cfg:
         logger.error("No config after onboarding, aborting.")
         return
 
     server = cfg.get("server_url")
+    hash_cache.configure(CONFIG_DIR / "hash_cache.db", max_entries=cfg.get("hash_cache_entries", 200000))
+    load_cached_policy()
     sender = SecureSender(base_url=server, client_cert=(cfg.get("client_cert"), cfg.get("client_key")) if cfg.get("client_cert") else None, jwt_token=cfg.get("jwt_token"), ca_bundle=cfg.get("ca_bundle"))
+    spool = EventSpool(CONFIG_DIR / "spool", max_bytes=cfg.get("spool_max_mb", 256) * 1024 * 1024)
+    event_queue = EventQueue(sender, max_size=cfg.get("send_queue_size", 10000), max_batch=cfg.get("send_batch_size", 200), max_age=cfg.get("send_max_age_seconds", 2.0), spool=spool)
+    event_queue.start()
     command_listener = CommandListener(sender, device_id=cfg.get("device_id"), poll_interval=cfg.get("poll_interval_seconds", 10))
     command_listener.start()
+    # hashing/scanning runs on prioritized lanes under a CPU (and optional disk IO) budget
+    io_budget = cfg.get("io_budget_mb_per_sec")
+    scheduler = EventScheduler(workers=cfg.get("scheduler_workers", 4), cpu_share=cfg.get("cpu_share", 0.25), io_bytes_per_sec=io_budget * 1024 * 1024 if io_budget else None)
+    scheduler.start()
+    # watchers -> coalescer -> lanes; mass copies to a USB volume become one incremental manifest scan
+    pipeline = FilePipeline(cfg, load_encrypted_config, policy_index, scheduler, event_queue, sender, CONFIG_DIR / "usb_manifests", CONFIG_DIR / "thumbnails", foreground=get_foreground_process)
+    pipeline.start()
 
     # Start policy sync and update poller
     threading.Thread(target=sync_policy_periodically, args=(server, 3600), daemon=True).start()
     threading.Thread(target=update_poller, args=(cfg.get("device_id"), server, 3600), daemon=True).start()
+    threading.Thread(target=pipeline.log_stats, daemon=True).start()
 
     # Watch common user folders
     home = Path.home()
@@ -164,10 +171,10 @@ def run_agent():
     for p in watch_paths:
         p.mkdir(parents=True, exist_ok=True)
 
-    observer = start_filesystem_watcher(watch_paths, handle_file_event)
-    threading.Thread(target=start_screenshot_monitor, args=(handle_file_event,), daemon=True).start()
-    threading.Thread(target=start_clipboard_monitor, args=(handle_clipboard_event,), daemon=True).start()
-    threading.Thread(target=start_usb_monitor, args=(handle_file_event,), daemon=True).start()
+    observer = start_filesystem_watcher(watch_paths, pipeline.tagged("files"))
+    threading.Thread(target=start_screenshot_monitor, args=(pipeline.tagged("screenshot"),), daemon=True).start()
+    threading.Thread(target=start_clipboard_monitor, args=(lambda ev: scheduler.submit("interactive", handle_clipboard_event, ev),), daemon=True).start()
+    threading.Thread(target=start_usb_monitor, args=(pipeline.tagged("usb"),), daemon=True).start()
 
     logger.info("Agent started. Watching: %s", ", ".join(str(x) for x in watch_paths))
     try:
@@ -178,6 +185,9 @@ def run_agent():
         observer.stop()
         observer.join()
         command_listener.stop()
+        pipeline.stop()
+        scheduler.stop(drain=True)
+        event_queue.stop()
 
 if __name__ == "__main__":
     run_agent()
@@ -1,29 +1,75 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from .auth import admin_required
-from . import devices
+from . import devices, db
+from .hash_index import phash_index
 router = APIRouter(prefix="/admin")
+MAX_EVENT_PAGE = 1000
+MAX_PHASH_DISTANCE = 12
 
 @router.get("/devices")
-def list_devices(user=Depends(admin_required)):
-    return devices.load_devices()
+async def list_devices(owner: str = None, activated: bool = None, bound: bool = None, after: str = None, limit: int = 100,
+                       user=Depends(admin_required), session: AsyncSession = Depends(db.get_session)):
+    # keyset pagination: pass the returned "next" back as ?after=
+    return await devices.list_devices(session, owner=owner, activated=activated, bound=bound, after=after, limit=limit)
 
 @router.get("/devices/{device_id}")
-def get_device(device_id: str, user=Depends(admin_required)):
-    devs = devices.load_devices()
-    if device_id not in devs:
+async def get_device(device_id: str, user=Depends(admin_required), session: AsyncSession = Depends(db.get_session)):
+    dev = await devices.get_device(session, device_id)
+    if dev is None:
         raise HTTPException(404, "not found")
-    return devs[device_id]
+    return dev
 
 @router.post("/devices/{device_id}/activate")
-def activate_device(device_id: str, user=Depends(admin_required)):
-    ok = devices.activate_device(device_id)
+async def activate_device(device_id: str, user=Depends(admin_required), session: AsyncSession = Depends(db.get_session)):
+    ok = await devices.activate_device(session, device_id)
     if not ok:
         raise HTTPException(404, "device not found")
     return {"status":"ok"}
 
 @router.post("/devices/{device_id}/bind")
-def bind_device(device_id: str, info: dict, user=Depends(admin_required)):
-    ok = devices.bind_device(device_id, mac=info.get("mac"), serial=info.get("serial"))
+async def bind_device(device_id: str, info: dict, user=Depends(admin_required), session: AsyncSession = Depends(db.get_session)):
+    ok = await devices.bind_device(session, device_id, mac=info.get("mac"), serial=info.get("serial"))
     if not ok:
         raise HTTPException(404, "device not found")
     return {"status":"ok"}
+
+@router.get("/events")
+async def list_events(device_id: str = None, event_type: str = None, user_email: str = None, sha256: str = None,
+                      file_name: str = None, destination: str = None, since: float = None, until: float = None,
+                      after: str = None, limit: int = 100, include_payload: bool = False,
+                      user=Depends(admin_required), session: AsyncSession = Depends(db.get_session)):
+    # newest first; since/until are epoch seconds, pass the returned "next" back as ?after=
+    filters = {"device_id": device_id, "event_type": event_type, "user_email": user_email, "sha256": sha256 and sha256.lower(),
+               "file_name": file_name, "destination": destination}
+    try:
+        return await db.query_events(session, filters, since=since, until=until, after=after,
+                                     limit=max(1, min(limit, MAX_EVENT_PAGE)), include_payload=include_payload)
+    except ValueError:
+        raise HTTPException(400, "bad cursor")
+
+@router.get("/hashes/similar")
+async def similar_images(phash: str, max_distance: int = 8, limit: int = 100,
+                         user=Depends(admin_required), session: AsyncSession = Depends(db.get_session)):
+    """Events whose image phash is within max_distance bits of phash, nearest first
+    (newest first within one distance)."""
+    matches = phash_index.similar(phash, max(0, min(max_distance, MAX_PHASH_DISTANCE)))
+    by_distance = {}
+    for d, p in matches:
+        by_distance.setdefault(d, []).append(p)
+    limit = max(1, min(limit, MAX_EVENT_PAGE))
+    events = []
+    # one query per distance, nearest first, until the page is full
+    for d in sorted(by_distance):
+        for ev in await db.events_with_phashes(session, by_distance[d], limit=limit - len(events)):
+            ev["distance"] = d
+            events.append(ev)
+        if len(events) >= limit:
+            break
+    return {"phash": phash, "matches": len(matches), "events": events}
+
+@router.get("/hashes/{sha256}")
+async def file_sightings(sha256: str, user=Depends(admin_required), session: AsyncSession = Depends(db.get_session)):
+    """Devices on which a file with this sha256 has appeared."""
+    devices_seen = await db.sha256_sightings(session, sha256.lower())
+    return {"sha256": sha256.lower(), "devices": devices_seen, "events": sum(d["events"] for d in devices_seen)}
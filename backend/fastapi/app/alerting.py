@@ -1,55 +1,286 @@
+"""
+Admin alert emails.
+alert_admin() only does a cached config lookup and a queue put; the AlertDispatcher
+worker thread groups alerts per recipient over ALERT_DIGEST_WINDOW seconds and sends
+one digest (at most ALERT_DIGEST_MAX alerts) per recipient over a persistent SMTP
+connection, so ingest latency never depends on the mail server. A digest that fails is
+retried after ALERT_RETRY_SECONDS, still capped at ALERT_DIGEST_MAX.
+"""
+
 import json
-from pathlib import Path
+import logging
+import os
+import queue
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
+from pathlib import Path
 from . import config as backend_config
 
+logger = logging.getLogger("uvicorn")
+
 CONFIG_PATH = Path(__file__).parent / "alert_config.json"
+ALERT_DIGEST_WINDOW = float(os.getenv("ALERT_DIGEST_WINDOW", "60"))
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "10000"))
+ALERT_DIGEST_MAX = int(os.getenv("ALERT_DIGEST_MAX", "200"))
+# a digest that failed to send is retried after this long, merged with newer alerts
+ALERT_RETRY_SECONDS = float(os.getenv("ALERT_RETRY_SECONDS", "60"))
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "120"))
+
+_EMPTY_CONFIG = {"global_admins": [], "per_device_admins": {}, "alert_rules": {}}
+_cfg_lock = threading.Lock()
+_cfg_cache = {"sig": None, "cfg": _EMPTY_CONFIG}
 
 def load_alert_config():
-    if CONFIG_PATH.exists():
-        return json.loads(CONFIG_PATH.read_text())
-    return {"global_admins": [], "per_device_admins": {}, "alert_rules": {}}
+    """Parsed alert_config.json, re-read only when the file changes."""
+    try:
+        st = CONFIG_PATH.stat()
+    except FileNotFoundError:
+        _cfg_cache.update(sig=None, cfg=_EMPTY_CONFIG)
+        return _EMPTY_CONFIG
+    sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+    if sig != _cfg_cache["sig"]:
+        with _cfg_lock:
+            if sig != _cfg_cache["sig"]:
+                _cfg_cache.update(sig=sig, cfg=json.loads(CONFIG_PATH.read_text()))
+    return _cfg_cache["cfg"]
 
-def should_alert(event_type: str) -> bool:
-    cfg = load_alert_config()
+def should_alert(event_type: str, cfg: dict = None) -> bool:
+    cfg = cfg or load_alert_config()
     rules = cfg.get("alert_rules", {})
     return rules.get(event_type, False)
 
-def get_recipients(device_id: str):
-    cfg = load_alert_config()
+def get_recipients(device_id: str, cfg: dict = None):
+    cfg = cfg or load_alert_config()
     recipients = set(cfg.get("global_admins", []))
     device_specific = cfg.get("per_device_admins", {}).get(device_id, [])
     recipients.update(device_specific)
     return list(recipients)
 
-def send_email(to_list, subject, body, sender=None):
-    if not to_list:
-        return
-    if sender is None:
-        sender = backend_config.SMTP_CONFIG.get("sender")
+def _message(to_list, subject, body, sender):
     msg = MIMEText(body)
     msg["Subject"] = subject
     msg["From"] = sender
     msg["To"] = ", ".join(to_list)
-    try:
-        s = smtplib.SMTP(backend_config.SMTP_CONFIG["host"], backend_config.SMTP_CONFIG.get("port", 587), timeout=10)
-        if backend_config.SMTP_CONFIG.get("use_tls", True):
+    return msg
+
+class SMTPMailer:
+    """One logged-in SMTP connection, reused across sends and dropped after SMTP_IDLE_SECONDS idle."""
+    def __init__(self, smtp_cfg: dict, idle_seconds: float = SMTP_IDLE_SECONDS):
+        self.smtp_cfg = smtp_cfg
+        self.idle_seconds = idle_seconds
+        self._conn = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"sent": 0, "failed": 0, "connects": 0}
+
+    def _connect(self):
+        cfg = self.smtp_cfg
+        s = smtplib.SMTP(cfg["host"], cfg.get("port", 587), timeout=10)
+        if cfg.get("use_tls", True):
             s.starttls()
-        s.login(backend_config.SMTP_CONFIG["user"], backend_config.SMTP_CONFIG["password"])
-        s.sendmail(sender, to_list, msg.as_string())
-        s.quit()
-    except Exception as e:
-        print("send_email failed", e)
-
-def alert_admin(event: dict):
-    event_type = event.get("event_type")
-    device_id = event.get("device_id")
-    if not should_alert(event_type):
-        return
-    recipients = get_recipients(device_id)
-    if not recipients:
+        if cfg.get("user"):
+            s.login(cfg["user"], cfg["password"])
+        self.stats["connects"] += 1
+        return s
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except Exception:
+                # quit() only closes the socket after the server answered
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+            self._conn = None
+
+    def close_if_idle(self):
+        with self._lock:
+            if self._conn is not None and time.monotonic() - self._last_used > self.idle_seconds:
+                self._close()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def send(self, to_list, msg, sender=None) -> bool:
+        sender = sender or msg["From"]
+        with self._lock:
+            # one retry on a fresh connection: the server may have dropped the idle one
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = self._connect()
+                    self._conn.sendmail(sender, to_list, msg.as_string())
+                    self._last_used = time.monotonic()
+                    self.stats["sent"] += 1
+                    return True
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, OSError) as e:
+                    self._close()
+                    if attempt:
+                        logger.warning("smtp send failed: %s", e)
+                except Exception:
+                    logger.exception("smtp send failed")
+                    self._close()
+                    break
+            self.stats["failed"] += 1
+            return False
+
+def send_email(to_list, subject, body, sender=None):
+    """Synchronous one-off send; alerts should go through alert_admin() instead."""
+    if not to_list:
         return
-    subj = f"[ALERT] {event_type} on {device_id}"
-    body = json.dumps(event, indent=2)
-    send_email(recipients, subj, body)
+    if sender is None:
+        sender = backend_config.SMTP_CONFIG.get("sender")
+    mailer = SMTPMailer(backend_config.SMTP_CONFIG)
+    try:
+        mailer.send(to_list, _message(to_list, subject, body, sender), sender)
+    finally:
+        mailer.close()
+
+def _format_digest(alerts):
+    if len(alerts) == 1:
+        event = alerts[0]
+        return f"[ALERT] {event.get('event_type')} on {event.get('device_id')}", json.dumps(event, indent=2)
+    counts = {}
+    for event in alerts:
+        key = (event.get("event_type"), event.get("device_id"))
+        counts[key] = counts.get(key, 0) + 1
+    devices = {d for _, d in counts}
+    subj = f"[ALERT] {len(alerts)} alerts on {len(devices)} device(s)"
+    summary = "\n".join(f"{n:5d}  {et} on {dev}" for (et, dev), n in sorted(counts.items(), key=lambda kv: -kv[1]))
+    body = summary + "\n\n" + "\n\n".join(json.dumps(e, indent=2) for e in alerts)
+    return subj, body
+
+class AlertDispatcher:
+    """Queue of alerts drained by one worker thread into per-recipient digests.
+
+    The first alert for a recipient opens a window of `window` seconds; everything
+    that arrives for that recipient before it closes goes into the same email.
+    window=0 sends every alert on its own (still off the request path).
+    """
+    def __init__(self, mailer: SMTPMailer, window: float = ALERT_DIGEST_WINDOW,
+                 max_queue: int = ALERT_QUEUE_SIZE, max_digest: int = ALERT_DIGEST_MAX):
+        self.mailer = mailer
+        self.window = window
+        self.max_digest = max_digest
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}  # recipient -> (deadline, [events])
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {"submitted": 0, "dropped": 0, "digests": 0, "failed": 0}
+
+    def submit(self, event: dict) -> bool:
+        """Non-blocking; returns False if the event needs no alert or the queue is full."""
+        cfg = load_alert_config()
+        if not should_alert(event.get("event_type"), cfg):
+            return False
+        recipients = get_recipients(event.get("device_id"), cfg)
+        if not recipients:
+            return False
+        try:
+            self._queue.put_nowait((recipients, event))
+        except queue.Full:
+            self.stats["dropped"] += 1
+            logger.warning("alert queue full, dropping alert for %s", event.get("device_id"))
+            return False
+        self.stats["submitted"] += 1
+        return True
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the worker, sending whatever digests are still open."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.mailer.close()
+
+    def _add(self, recipients, event):
+        now = time.monotonic()
+        for r in recipients:
+            deadline, events = self._pending.setdefault(r, (now + self.window, []))
+            events.append(event)
+
+    def _requeue(self, recipient, events):
+        """Put a digest that failed to send back in front of the recipient's newer alerts,
+        keeping at most max_digest of them (the newest) until the retry."""
+        _, pending = self._pending.pop(recipient, (None, []))
+        events = events + pending
+        if len(events) > self.max_digest:
+            self.stats["dropped"] += len(events) - self.max_digest
+            logger.warning("alert digest for %s still failing, dropping %d oldest alerts", recipient, len(events) - self.max_digest)
+            events = events[-self.max_digest:]
+        self._pending[recipient] = (time.monotonic() + ALERT_RETRY_SECONDS, events)
+
+    def _flush(self, force=False):
+        now = time.monotonic()
+        due = [r for r, (deadline, events) in self._pending.items()
+               if force or deadline <= now or len(events) >= self.max_digest]
+        # recipients with identical digests share one message
+        groups = {}
+        for r in due:
+            deadline, events = self._pending.pop(r)
+            # a burst drained in one go can exceed max_digest; the rest goes out in the next message
+            if len(events) > self.max_digest:
+                self._pending[r] = (deadline, events[self.max_digest:])
+                events = events[:self.max_digest]
+            groups.setdefault(tuple(id(e) for e in events), (events, []))[1].append(r)
+        sender = self.mailer.smtp_cfg.get("sender")
+        for events, to_list in groups.values():
+            subj, body = _format_digest(events)
+            if self.mailer.send(to_list, _message(to_list, subj, body, sender), sender):
+                self.stats["digests"] += 1
+                continue
+            self.stats["failed"] += 1
+            # on shutdown there is no later retry
+            if not force:
+                for r in to_list:
+                    self._requeue(r, events)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._pending:
+                timeout = max(0.0, min(d for d, _ in self._pending.values()) - time.monotonic())
+            else:
+                timeout = 1.0
+            try:
+                recipients, event = self._queue.get(timeout=timeout)
+                self._add(recipients, event)
+                # take whatever else is already queued without waiting
+                while True:
+                    recipients, event = self._queue.get_nowait()
+                    self._add(recipients, event)
+            except queue.Empty:
+                pass
+            try:
+                self._flush()
+                if not self._pending:
+                    self.mailer.close_if_idle()
+            except Exception:
+                logger.exception("alert dispatch failed")
+        try:
+            while True:
+                recipients, event = self._queue.get_nowait()
+                self._add(recipients, event)
+        except queue.Empty:
+            pass
+        try:
+            while self._pending:
+                self._flush(force=True)
+        except Exception:
+            logger.exception("alert dispatch failed")
+
+dispatcher = AlertDispatcher(SMTPMailer(backend_config.SMTP_CONFIG))
+
+def alert_admin(event: dict) -> bool:
+    return dispatcher.submit(event)
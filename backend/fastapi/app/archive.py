@@ -0,0 +1,144 @@
+"""
+Columnar archive of event segments for analytics.
+archive_segments() turns closed segments (see storage.EventSegmentWriter) into Parquet files
+partitioned Hive-style by day, one file per day per run:
+
+    <archive>/day=2024-05-01/part-20240502T010000-3f9c1a2b.parquet
+
+Only events with a committed row pointing into the segment are archived (see
+db.segment_event_ids): the collector writes a frame before the insert, so a batch that
+failed with 503 and is resent by the agent would otherwise be archived as well.
+
+merge_partitions() then rewrites every past day that holds more than one file as a single
+file sorted by (device_id, timestamp), dropping duplicate event_ids (a retried batch lands in
+a segment twice), so row-group statistics still prune device filters.
+
+Hot fields get their own columns, the full event stays in `payload` as JSON, as received:
+a full sha256 filled in later (db.complete_event_hash) is only in the events table. Once the events
+table points at the archive day (db.mark_events_archived) the segment is deleted; every step
+is safe to repeat, so a crash in between only means the segment is archived again next run.
+Requires pyarrow; without it the job logs once and does nothing.
+"""
+
+import json, logging, os, time, uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from . import db, storage
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+logger = logging.getLogger("uvicorn")
+
+FIELDS = ("event_id", "device_id", "event_type", "user_email", "file_name", "sha256", "destination")
+_SCHEMA = None
+_warned = False
+
+def _schema():
+    global _SCHEMA
+    if _SCHEMA is None:
+        _SCHEMA = pa.schema([(f, pa.string()) for f in FIELDS] + [("timestamp", pa.float64()), ("payload", pa.string())])
+    return _SCHEMA
+
+def available() -> bool:
+    global _warned
+    if pq is None and not _warned:
+        logger.warning("pyarrow not installed, event archive compaction disabled")
+        _warned = True
+    return pq is not None
+
+def _write(table, out: Path):
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + ".tmp")
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, out)
+
+def pending_segments(segment_dir: Path, skip=(), min_age: float = 0) -> list:
+    """Segments on disk except those in skip (still being written) or modified less than
+    min_age seconds ago; archived segments are deleted, so everything else is pending."""
+    now = time.time()
+    return [seg for seg in sorted(Path(segment_dir).glob("*.jsonl.*"))
+            if seg.name not in skip and now - seg.stat().st_mtime >= min_age]
+
+def archive_segments(segments, archive_dir: Path, committed: dict = None) -> dict:
+    """Write the events of segments as one new Parquet file per day. With committed
+    ({segment name: {event_id}}), events not in their segment's set are skipped.
+    Returns {"segments", "events", "skipped", "days": {day: [event_id, ...]}}."""
+    archive_dir = Path(archive_dir)
+    parts = {}  # day -> {event_id: row}
+    skipped = 0
+    for seg in segments:
+        default_ts = seg.stat().st_mtime
+        keep = None if committed is None else committed.get(seg.name, set())
+        for ev in storage.iter_segment(seg):
+            if keep is not None and ev.get("event_id") not in keep:
+                skipped += 1
+                continue
+            ts = db.event_timestamp(ev, default_ts)
+            day = datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+            row = {f: None if ev.get(f) is None else str(ev[f]) for f in FIELDS}
+            row["timestamp"] = ts
+            row["payload"] = json.dumps(ev)
+            parts.setdefault(day, {}).setdefault(row["event_id"], row)
+    name = f"part-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}.parquet"
+    for day, rows in parts.items():
+        _write(pa.Table.from_pylist(list(rows.values()), schema=_schema()), archive_dir / f"day={day}" / name)
+    return {"segments": len(segments), "events": sum(len(rows) for rows in parts.values()), "skipped": skipped,
+            "days": {day: list(rows) for day, rows in parts.items()}}
+
+def drop_segments(segments):
+    for seg in segments:
+        try:
+            seg.unlink()
+        except FileNotFoundError:
+            pass
+
+def merge_partitions(archive_dir: Path, keep_open: int = 1) -> int:
+    """Merge the files of each day partition into one, except the newest keep_open days
+    (still receiving files). Returns the number of partitions merged."""
+    days = sorted(Path(archive_dir).glob("day=*"))
+    merged = 0
+    for day_dir in days[:max(0, len(days) - keep_open)]:
+        files = sorted(day_dir.glob("*.parquet"))
+        if len(files) < 2:
+            continue
+        table = pa.concat_tables([pq.read_table(f, schema=_schema()) for f in files])
+        table = table.sort_by([("device_id", "ascending"), ("timestamp", "ascending"), ("event_id", "ascending")])
+        ids = table.column("event_id")
+        # sorted, so a duplicate event_id follows its first copy directly
+        if len(ids) > 1:
+            dup = pc.equal(ids.slice(1), ids.slice(0, len(ids) - 1)).fill_null(False)
+            table = table.filter(pa.concat_arrays([pa.array([True])] + [pc.invert(c) for c in dup.chunks]))
+        _write(table, day_dir / f"merged-{uuid.uuid4().hex[:12]}.parquet")
+        drop_segments(files)
+        merged += 1
+    return merged
+
+def read_archived_events(archive_dir: Path, day: str, event_ids) -> dict:
+    """{event_id: payload} for the given events of one archived day."""
+    day_dir = Path(archive_dir) / f"day={day}"
+    files = sorted(day_dir.glob("*.parquet"))
+    if pq is None or not files:
+        return {}
+    out = {}
+    for f in files:
+        table = pq.read_table(f, columns=["event_id", "payload"], filters=[("event_id", "in", list(event_ids))])
+        for eid, payload in zip(table.column("event_id").to_pylist(), table.column("payload").to_pylist()):
+            out.setdefault(eid, json.loads(payload))
+    return out
+
+def compact_segments(segment_dir: Path, archive_dir: Path, skip=(), min_age: float = 0) -> dict:
+    """Archive and delete every pending segment, without recording anything in the events
+    table (the collector runs the steps itself, see main._archive_loop). Returns {"segments", "events"}."""
+    if not available():
+        return {"segments": 0, "events": 0}
+    segments = pending_segments(segment_dir, skip, min_age)
+    if not segments:
+        return {"segments": 0, "events": 0}
+    res = archive_segments(segments, archive_dir)
+    drop_segments(segments)
+    merge_partitions(archive_dir)
+    return {"segments": res["segments"], "events": res["events"]}
@@ -1,77 +1,471 @@
-import os, json
-from sqlalchemy import create_engine, Table, Column, Integer, String, MetaData, Text
-from sqlalchemy.orm import sessionmaker
+import os, json, logging, time
+from sqlalchemy import event, inspect, text, Table, Column, Integer, String, MetaData, Text, Float, Boolean, Index, select, func, and_, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.concurrency import run_in_threadpool
 from pathlib import Path
+from datetime import datetime, timezone
+from . import storage
+
+logger = logging.getLogger("uvicorn")
+
+# command queue states: pending -> inflight (leased to an agent) -> acked
+CMD_PENDING, CMD_INFLIGHT, CMD_ACKED = "pending", "inflight", "acked"
+COMMAND_LEASE_SECONDS = float(os.getenv("COMMAND_LEASE_SECONDS", "60"))
+COMMAND_MAX_ATTEMPTS = int(os.getenv("COMMAND_MAX_ATTEMPTS", "5"))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
 
 engine = None
 SessionLocal = None
 metadata = None
 events_table = None
 commands_table = None
+devices_table = None
+otp_table = None
+thumbnails_table = None
 
-def init_db(database_url: str):
-    global engine, SessionLocal, metadata, events_table, commands_table
-    opts = {}
-    if database_url.startswith("sqlite"):
-        opts = {"connect_args": {"check_same_thread": False}}
-    engine = create_engine(database_url, **opts)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def async_url(database_url: str) -> str:
+    """Map the sync DATABASE_URL forms to their async drivers (aiosqlite / asyncpg)."""
+    if database_url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + database_url[len("sqlite:"):]
+    for prefix in ("postgresql://", "postgres://", "postgresql+psycopg2://"):
+        if database_url.startswith(prefix):
+            return "postgresql+asyncpg://" + database_url[len(prefix):]
+    return database_url
+
+async def init_db(database_url: str):
+    global engine, SessionLocal, metadata, events_table, commands_table, devices_table, otp_table, thumbnails_table
+    url = async_url(database_url)
+    if url.startswith("sqlite"):
+        # concurrent writers wait for the lock instead of failing with "database is locked"
+        opts = {"connect_args": {"timeout": DB_POOL_TIMEOUT}}
+    else:
+        opts = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT, "pool_recycle": DB_POOL_RECYCLE, "pool_pre_ping": True}
+    engine = create_async_engine(url, **opts)
+    if url.startswith("sqlite"):
+        @event.listens_for(engine.sync_engine, "connect")
+        def _sqlite_pragmas(dbapi_conn, _):
+            cur = dbapi_conn.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.close()
+    SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
     metadata = MetaData()
     events_table = Table(
         "events", metadata,
         Column("id", String, primary_key=True),
-        Column("device_id", String, index=True),
+        Column("device_id", String),
         Column("payload", Text),
-        Column("json_path", String, nullable=True)
+        Column("json_path", String, nullable=True),
+        # EVENT_STORAGE_MODE=segment: compressed frame holding this event (see storage.EventSegmentWriter)
+        Column("segment", String, nullable=True),
+        Column("segment_offset", Integer, nullable=True),
+        Column("segment_length", Integer, nullable=True),
+        # set (and the segment columns cleared) once the segment is compacted into the Parquet archive
+        Column("archive_day", String, nullable=True),
+        # hot fields copied out of the payload at ingest (see EVENT_COLUMNS)
+        Column("event_type", String, nullable=True),
+        Column("ts", Float, nullable=True),
+        Column("user_email", String, nullable=True),
+        Column("sha256", String, nullable=True),
+        Column("file_name", String, nullable=True),
+        Column("destination", String, nullable=True),
+        Column("thumbnail_path", String, nullable=True),
+        Column("phash", String, nullable=True),
+        # set while the agent still owes the full sha256 of a very large file (PATCH /api/v1/events/{id})
+        Column("sampled_fingerprint", String, nullable=True),
+        # every listing is "newest first within a filter": (filter, ts, id) serves it
+        # as an index range scan, and (ts, id) is the keyset cursor
+        Index("ix_events_ts_id", "ts", "id"),
+        Index("ix_events_device_ts_id", "device_id", "ts", "id"),
+        Index("ix_events_type_ts_id", "event_type", "ts", "id"),
+        Index("ix_events_user_ts_id", "user_email", "ts", "id"),
+        Index("ix_events_sha256", "sha256"),
+        Index("ix_events_file_name", "file_name"),
+        Index("ix_events_phash", "phash"),
+    )
+    # content-addressed thumbnail store: one file per distinct thumbnail, shared by events
+    thumbnails_table = Table(
+        "thumbnails", metadata,
+        Column("sha256", String, primary_key=True),
+        Column("path", String, nullable=False),
+        Column("size", Integer, nullable=False),
+        Column("created_at", Float, nullable=False),
     )
+    # replaces the old "commands" table (delivered flag, no ack)
     commands_table = Table(
-        "commands", metadata,
+        "command_queue", metadata,
         Column("id", String, primary_key=True),
-        Column("device_id", String, index=True),
+        Column("device_id", String, nullable=False),
         Column("type", String),
         Column("payload", Text),
-        Column("delivered", Integer, default=0)
+        Column("state", String, nullable=False, default=CMD_PENDING),
+        Column("created_at", Float, nullable=False),
+        Column("lease_until", Float, nullable=True),
+        Column("attempts", Integer, nullable=False, default=0),
+        Column("acked_at", Float, nullable=True),
+        Index("ix_command_queue_device_state_created", "device_id", "state", "created_at"),
+        Index("ix_command_queue_state_acked", "state", "acked_at"),
+    )
+    # device registry (was devices.json); see devices.py
+    devices_table = Table(
+        "devices", metadata,
+        Column("device_id", String, primary_key=True),
+        Column("owner", String, nullable=False),
+        Column("metadata", Text),
+        Column("bound", Boolean, nullable=False, default=False),
+        Column("bound_mac", String, nullable=True),
+        Column("bound_serial", String, nullable=True),
+        Column("activated", Boolean, nullable=False, default=False),
+        Column("activation_time", String, nullable=True),
+        Column("last_seen", String, nullable=True),
+        Column("created_at", String, nullable=False),
+        # admin listing filters on these and pages by device_id
+        Index("ix_devices_owner_id", "owner", "device_id"),
+        Index("ix_devices_activated_id", "activated", "device_id"),
     )
-    metadata.create_all(engine)
+    # one pending code per device (was otp_store.json); see otp.py
+    otp_table = Table(
+        "otp_codes", metadata,
+        Column("device_id", String, primary_key=True),
+        Column("email", String, nullable=False),
+        Column("code_hash", String, nullable=False),
+        Column("expires_at", Float, nullable=False),
+        Column("attempts", Integer, nullable=False, default=0),
+        Index("ix_otp_codes_expires", "expires_at"),
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+        await conn.run_sync(_upgrade_schema)
+
+def _upgrade_schema(conn):
+    """create_all() never alters existing tables; add nullable columns and indexes introduced since."""
+    insp = inspect(conn)
+    for table in metadata.sorted_tables:
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in have and col.nullable:
+                logger.info("adding column %s.%s", table.name, col.name)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(conn.dialect)}'))
+        indexes = {ix["name"] for ix in insp.get_indexes(table.name)}
+        for ix in table.indexes:
+            if ix.name not in indexes:
+                logger.info("creating index %s", ix.name)
+                ix.create(conn)
+    if insp.has_table("commands"):
+        _migrate_legacy_commands(conn)
+
+def _migrate_legacy_commands(conn):
+    """Move undelivered rows of the pre-queue "commands" table into command_queue as pending,
+    then rename it to commands_legacy so this runs once."""
+    res = conn.execute(text(
+        "INSERT INTO command_queue (id, device_id, type, payload, state, created_at, attempts) "
+        "SELECT id, device_id, type, payload, :pending, :now, 0 FROM commands "
+        "WHERE delivered = 0 AND id NOT IN (SELECT id FROM command_queue)"
+    ), {"pending": CMD_PENDING, "now": time.time()})
+    conn.execute(text("ALTER TABLE commands RENAME TO commands_legacy"))
+    logger.info("migrated %d undelivered commands to command_queue", res.rowcount)
 
-def get_sync_session():
+async def close_db():
+    if engine is not None:
+        await engine.dispose()
+
+async def get_session():
+    """FastAPI dependency: one AsyncSession per request, closed when the request ends."""
     if SessionLocal is None:
         raise RuntimeError("DB not initialized")
-    return SessionLocal()
-
-def create_event(db_session, event_id: str, payload: dict, json_path: str = None):
-    ins = events_table.insert().values(id=event_id, device_id=payload.get("device_id"), payload=json.dumps(payload), json_path=json_path)
-    db_session.execute(ins)
-    db_session.commit()
-
-def attach_thumbnail(db_session, event_id: str, thumbnail_path: str):
-    sel = events_table.select().where(events_table.c.id == event_id)
-    r = db_session.execute(sel).fetchone()
-    if not r:
-        return False
-    payload = json.loads(r.payload)
-    payload["thumbnail_path"] = thumbnail_path
-    upd = events_table.update().where(events_table.c.id == event_id).values(payload=json.dumps(payload))
-    db_session.execute(upd)
-    db_session.commit()
-    return True
-
-def fetch_and_mark_delivered(db_session, device_id: str):
-    rows = db_session.execute(commands_table.select().where(commands_table.c.device_id == device_id).where(commands_table.c.delivered == 0)).fetchall()
-    result = []
-    ids = []
-    for r in rows:
-        result.append({"id": r.id, "type": r.type, "payload": json.loads(r.payload)})
-        ids.append(r.id)
+    async with SessionLocal() as session:
+        yield session
+
+EVENT_COLUMNS = ("event_type", "user_email", "sha256", "file_name", "destination", "phash")
+
+def event_timestamp(payload: dict, default: float = None):
+    """Epoch seconds from payload["timestamp"] (epoch number or ISO 8601), else default."""
+    ts = payload.get("timestamp")
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    if isinstance(ts, str):
+        try:
+            dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+            return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+        except ValueError:
+            pass
+    return default
+
+def _event_cols(payload: dict, received: float = None):
+    cols = {c: (None if payload.get(c) is None else str(payload[c])) for c in EVENT_COLUMNS}
+    for c in ("sha256", "phash"):
+        if cols[c] is not None:
+            cols[c] = cols[c].lower()
+    # events without a usable timestamp sort by arrival time
+    cols["ts"] = event_timestamp(payload, received if received is not None else time.time())
+    cols["thumbnail_path"] = payload.get("thumbnail_path")
+    cols["sampled_fingerprint"] = payload.get("sampled_fingerprint") if payload.get("sha256_pending") else None
+    return cols
+
+def _segment_cols(segment):
+    name, offset, length = segment or (None, None, None)
+    return {"segment": name, "segment_offset": offset, "segment_length": length}
+
+def _stored_payload(payload: dict, segment):
+    # the segment frame is the copy of record; the row keeps only the pointer
+    return None if segment else json.dumps(payload)
+
+async def create_event(db_session, event_id: str, payload: dict, json_path: str = None, segment: tuple = None):
+    ins = events_table.insert().values(id=event_id, device_id=payload.get("device_id"), payload=_stored_payload(payload, segment), json_path=json_path, **_segment_cols(segment), **_event_cols(payload))
+    await db_session.execute(ins)
+    await db_session.commit()
+
+async def create_events_bulk(db_session, events, segment: tuple = None):
+    """Insert many events in one transaction.
+
+    events: list of (event_id, payload, json_path); segment is the (name, offset, length)
+    frame the whole batch was written to, if any. Returns a list of statuses in
+    input order: "ok", "duplicate" (id already stored or repeated in the batch) or "error".
+    """
+    statuses = []
+    rows = []
+    now = time.time()
+    ids = [eid for eid, _, _ in events]
+    seen = set()
     if ids:
-        db_session.execute(commands_table.update().where(commands_table.c.id.in_(ids)).values(delivered=1))
-        db_session.commit()
-    return result
+        seen = {r.id for r in (await db_session.execute(events_table.select().with_only_columns(events_table.c.id).where(events_table.c.id.in_(ids))))}
+    for event_id, payload, json_path in events:
+        if event_id in seen:
+            statuses.append("duplicate")
+            continue
+        seen.add(event_id)
+        statuses.append("ok")
+        rows.append({"id": event_id, "device_id": payload.get("device_id"), "payload": _stored_payload(payload, segment), "json_path": json_path, **_segment_cols(segment), **_event_cols(payload, now)})
+    if rows:
+        try:
+            # list of parameter dicts -> executemany
+            await db_session.execute(events_table.insert(), rows)
+            await db_session.commit()
+        except Exception:
+            logger.exception("bulk event insert failed")
+            await db_session.rollback()
+            statuses = ["error" if st == "ok" else st for st in statuses]
+    return statuses
+
+async def attach_thumbnail(db_session, event_id: str, thumbnail_path: str):
+    res = await db_session.execute(events_table.update().where(events_table.c.id == event_id).values(thumbnail_path=thumbnail_path))
+    await db_session.commit()
+    return res.rowcount > 0
+
+async def complete_event_hash(db_session, event_id: str, sha256: str, sampled_fingerprint: str):
+    """Fill in the full sha256 of an event that was sent with only a sampled fingerprint.
+
+    Returns "ok", "unknown" (no such event yet) or "mismatch": the event is not waiting
+    for a full hash, or its stored fingerprint is not the one the hash was computed for
+    (the file changed in between). The stored payload is not rewritten; _event_row
+    overlays the hash when the event is read. That includes events already compacted
+    to Parquet, whose archived payload keeps sha256_pending: the sha256 column here is
+    authoritative, the archive is not patched.
+    """
+    c = events_table.c
+    res = await db_session.execute(events_table.update()
+                                   .where(c.id == event_id, c.sampled_fingerprint == sampled_fingerprint, c.sha256.is_(None))
+                                   .values(sha256=sha256.lower(), sampled_fingerprint=None))
+    await db_session.commit()
+    if res.rowcount:
+        return "ok"
+    exists = (await db_session.execute(select(c.id).where(c.id == event_id))).first()
+    return "mismatch" if exists else "unknown"
+
+async def segment_event_ids(db_session, segments) -> dict:
+    """{segment name: {event_id}} of the committed rows that point into the given segments.
+    A frame is appended before its insert commits, so a failed insert leaves events in the
+    segment that no row points at."""
+    c = events_table.c
+    out = {}
+    for r in (await db_session.execute(select(c.id, c.segment).where(c.segment.in_(list(segments))))).fetchall():
+        out.setdefault(r.segment, set()).add(r.id)
+    return out
+
+async def mark_events_archived(db_session, days: dict, chunk: int = 500):
+    """Point events at their archive day ({day: [event_id]}) and drop their segment pointer."""
+    c = events_table.c
+    for day, ids in days.items():
+        for i in range(0, len(ids), chunk):
+            await db_session.execute(events_table.update().where(c.id.in_(ids[i:i + chunk]))
+                                     .values(archive_day=day, segment=None, segment_offset=None, segment_length=None))
+    await db_session.commit()
+
+def _load_payloads(rows) -> dict:
+    """{id: payload} for rows stored as a segment pointer or archived; one read per frame / day."""
+    from . import archive
+    out, frames, days = {}, {}, {}
+    for r in rows:
+        if r.payload:
+            continue
+        if r.segment:
+            frames.setdefault((r.segment, r.segment_offset, r.segment_length), set()).add(r.id)
+        elif r.archive_day:
+            days.setdefault(r.archive_day, set()).add(r.id)
+    for (segment, offset, length), ids in frames.items():
+        try:
+            for ev in storage.read_segment_frame(storage.EVENT_SEGMENT_PATH, segment, offset, length):
+                if ev.get("event_id") in ids:
+                    out.setdefault(ev["event_id"], ev)
+        except FileNotFoundError:
+            # archived and dropped since the rows were read; the next read finds it in the archive
+            pass
+        except Exception:
+            logger.exception("reading segment %s failed", segment)
+    for day, ids in days.items():
+        try:
+            out.update(archive.read_archived_events(storage.EVENT_ARCHIVE_PATH, day, ids))
+        except Exception:
+            logger.exception("reading archive day %s failed", day)
+    return out
+
+def _event_row(r, include_payload: bool = False, loaded: dict = None):
+    ev = {"id": r.id, "device_id": r.device_id, "ts": r.ts, **{c: getattr(r, c) for c in EVENT_COLUMNS}, "thumbnail_path": r.thumbnail_path}
+    if include_payload:
+        ev["payload"] = json.loads(r.payload) if r.payload else (loaded or {}).get(r.id)
+        if ev["payload"] and ev["payload"].get("sha256_pending") and r.sha256:
+            ev["payload"]["sha256"] = r.sha256
+            ev["payload"].pop("sha256_pending")
+    return ev
+
+def encode_cursor(ts: float, event_id: str) -> str:
+    return f"{ts!r},{event_id}"
+
+def decode_cursor(cursor: str):
+    ts, _, event_id = cursor.partition(",")
+    return float(ts), event_id
+
+async def query_events(db_session, filters: dict = None, since: float = None, until: float = None,
+                       after: str = None, limit: int = 100, include_payload: bool = False):
+    """Newest-first page of events. filters: equality on device_id and EVENT_COLUMNS;
+    since/until bound ts (inclusive/exclusive); after is the "next" cursor of the previous page.
+
+    Keyset pagination on (ts, id), so every page is an index range scan on the
+    (filter, ts, id) index no matter how deep into the result it is.
+    """
+    c = events_table.c
+    conds = [c.ts.isnot(None)]
+    for name, value in (filters or {}).items():
+        if value is not None:
+            conds.append(c[name] == value)
+    if since is not None:
+        conds.append(c.ts >= since)
+    if until is not None:
+        conds.append(c.ts < until)
+    if after:
+        conds.append(tuple_(c.ts, c.id) < tuple_(*decode_cursor(after)))
+    cols = [c.id, c.device_id, c.ts, c.thumbnail_path] + [c[n] for n in EVENT_COLUMNS]
+    if include_payload:
+        cols += [c.payload, c.segment, c.segment_offset, c.segment_length, c.archive_day]
+    stmt = select(*cols).where(and_(*conds)).order_by(c.ts.desc(), c.id.desc()).limit(limit + 1)
+    rows = (await db_session.execute(stmt)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    loaded = await run_in_threadpool(_load_payloads, rows) if include_payload else None
+    return {"events": [_event_row(r, include_payload, loaded) for r in rows],
+            "next": encode_cursor(rows[-1].ts, rows[-1].id) if more else None}
+
+async def sha256_sightings(db_session, sha256: str, limit: int = 100):
+    """Where a file has appeared: per-device count and first/last ts, via ix_events_sha256."""
+    c = events_table.c
+    stmt = (select(c.device_id, func.count().label("events"), func.min(c.ts).label("first_seen"), func.max(c.ts).label("last_seen"))
+            .where(c.sha256 == sha256).group_by(c.device_id).order_by(func.max(c.ts).desc()).limit(limit))
+    return [dict(r._mapping) for r in (await db_session.execute(stmt)).fetchall()]
+
+async def events_with_phashes(db_session, phashes, limit: int = 100):
+    """Newest events carrying any of the given phash values, via ix_events_phash."""
+    if not phashes:
+        return []
+    c = events_table.c
+    cols = [c.id, c.device_id, c.ts, c.thumbnail_path] + [c[n] for n in EVENT_COLUMNS]
+    stmt = select(*cols).where(c.phash.in_(list(phashes))).order_by(c.ts.desc()).limit(limit)
+    return [_event_row(r) for r in (await db_session.execute(stmt)).fetchall()]
+
+async def get_thumbnail(db_session, sha256: str):
+    r = (await db_session.execute(select(thumbnails_table).where(thumbnails_table.c.sha256 == sha256))).fetchone()
+    return dict(r._mapping) if r else None
+
+async def put_thumbnail(db_session, sha256: str, path: str, size: int):
+    insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+    await db_session.execute(insert(thumbnails_table).values(sha256=sha256, path=path, size=size, created_at=time.time()).on_conflict_do_nothing())
+    await db_session.commit()
+
+async def backfill_event_columns(db_session, batch: int = 1000) -> int:
+    """Fill the promoted columns of rows stored before they existed; one batch per call."""
+    c = events_table.c
+    rows = (await db_session.execute(select(c.id, c.payload).where(c.ts.is_(None)).limit(batch))).fetchall()
+    now = time.time()
+    for r in rows:
+        payload = json.loads(r.payload) if r.payload else {}
+        await db_session.execute(events_table.update().where(c.id == r.id).values(**_event_cols(payload, now)))
+    await db_session.commit()
+    return len(rows)
+
+async def claim_commands(db_session, device_id: str, limit: int = 100, lease_seconds: float = None):
+    """Lease due commands for a device in one UPDATE ... RETURNING.
+
+    Due means pending, or inflight with an expired lease (agent never acked).
+    The subquery walks ix_command_queue_device_state_created, so cost depends
+    on the device's pending/inflight rows only, not on how many acked rows exist.
+    """
+    now = time.time()
+    c = commands_table.c
+    due = (
+        select(c.id)
+        .where(c.device_id == device_id)
+        .where(c.state.in_([CMD_PENDING, CMD_INFLIGHT]))
+        .where(or_(c.state == CMD_PENDING, c.lease_until < now))
+        .where(c.attempts < COMMAND_MAX_ATTEMPTS)
+        .order_by(c.created_at)
+        .limit(limit)
+    )
+    if engine.dialect.name == "postgresql":
+        # concurrent polls for the same device skip each other's rows instead of double-delivering
+        due = due.with_for_update(skip_locked=True)
+    stmt = (
+        commands_table.update()
+        .where(c.id.in_(due.scalar_subquery()))
+        .values(state=CMD_INFLIGHT, lease_until=now + (lease_seconds or COMMAND_LEASE_SECONDS), attempts=c.attempts + 1)
+        .returning(c.id, c.type, c.payload, c.created_at)
+    )
+    rows = (await db_session.execute(stmt)).fetchall()
+    await db_session.commit()
+    rows.sort(key=lambda r: r.created_at)
+    return [{"id": r.id, "type": r.type, "payload": json.loads(r.payload)} for r in rows]
+
+async def ack_commands(db_session, device_id: str, ids):
+    c = commands_table.c
+    res = await db_session.execute(
+        commands_table.update()
+        .where(and_(c.device_id == device_id, c.id.in_(list(ids)), c.state == CMD_INFLIGHT))
+        .values(state=CMD_ACKED, acked_at=time.time(), lease_until=None)
+    )
+    await db_session.commit()
+    return res.rowcount
+
+async def compact_commands(db_session, older_than_seconds: float = 86400):
+    """Delete acked commands, and commands that ran out of attempts, older than the cutoff."""
+    cutoff = time.time() - older_than_seconds
+    c = commands_table.c
+    res = await db_session.execute(
+        commands_table.delete().where(or_(
+            and_(c.state == CMD_ACKED, c.acked_at < cutoff),
+            and_(c.state == CMD_INFLIGHT, c.attempts >= COMMAND_MAX_ATTEMPTS, c.lease_until < cutoff),
+        ))
+    )
+    await db_session.commit()
+    return res.rowcount
 
-def enqueue_command(db_session, device_id: str, cmd_type: str, payload: dict):
+async def enqueue_command(db_session, device_id: str, cmd_type: str, payload: dict):
     import uuid
     cmd_id = f"cmd-{uuid.uuid4().hex[:12]}"
-    ins = commands_table.insert().values(id=cmd_id, device_id=device_id, type=cmd_type, payload=json.dumps(payload), delivered=0)
-    db_session.execute(ins)
-    db_session.commit()
+    ins = commands_table.insert().values(id=cmd_id, device_id=device_id, type=cmd_type, payload=json.dumps(payload), state=CMD_PENDING, created_at=time.time(), attempts=0)
+    await db_session.execute(ins)
+    await db_session.commit()
     return cmd_id
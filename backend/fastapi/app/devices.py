@@ -1,49 +1,120 @@
-import uuid, json
+import uuid, json, os, logging
 from pathlib import Path
 from datetime import datetime
+from sqlalchemy import select, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import db
 
+logger = logging.getLogger("uvicorn")
+
+# legacy registry, imported into the devices table once at startup
 DEVICES_PATH = Path(__file__).parent / "devices.json"
-DEVICES_PATH.parent.mkdir(parents=True, exist_ok=True)
+MAX_PAGE_SIZE = 1000
+IMPORT_CHUNK = 1000
+
+def _now():
+    return datetime.utcnow().isoformat() + "Z"
 
-def load_devices():
-    if not DEVICES_PATH.exists():
-        return {}
-    return json.loads(DEVICES_PATH.read_text())
+def _row_to_dict(r):
+    return {
+        "device_id": r.device_id,
+        "owner": r.owner,
+        "metadata": json.loads(r.metadata) if r.metadata else {},
+        "bound": bool(r.bound),
+        "bound_info": {"mac": r.bound_mac, "serial": r.bound_serial} if r.bound else {},
+        "activated": bool(r.activated),
+        "activation_time": r.activation_time,
+        "last_seen": r.last_seen,
+        "created_at": r.created_at,
+    }
 
-def save_devices(d):
-    DEVICES_PATH.write_text(json.dumps(d, indent=2))
+def _upsert(rows):
+    """INSERT ... ON CONFLICT (device_id) DO UPDATE, for sqlite and postgres."""
+    insert = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(db.devices_table).values(rows)
+    cols = {c: stmt.excluded[c] for c in rows[0] if c != "device_id"}
+    return stmt.on_conflict_do_update(index_elements=["device_id"], set_=cols)
 
-def register_device(email: str, requested_device_id: str = None, metadata: dict = None):
-    d = load_devices()
+async def register_device(session, email: str, requested_device_id: str = None, metadata: dict = None):
     device_id = requested_device_id or f"dev-{uuid.uuid4().hex[:12]}"
-    d[device_id] = {
+    # re-registering an id resets it, as the JSON registry did
+    await session.execute(_upsert([{
         "device_id": device_id,
         "owner": email,
-        "metadata": metadata or {},
+        "metadata": json.dumps(metadata or {}),
         "bound": False,
-        "bound_info": {},
+        "bound_mac": None,
+        "bound_serial": None,
         "activated": False,
         "activation_time": None,
         "last_seen": None,
-        "created_at": datetime.utcnow().isoformat() + "Z"
-    }
-    save_devices(d)
+        "created_at": _now(),
+    }]))
+    await session.commit()
     return device_id
 
-def bind_device(device_id: str, mac: str = None, serial: str = None):
-    d = load_devices()
-    if device_id not in d:
-        return False
-    d[device_id]["bound"] = True
-    d[device_id]["bound_info"] = {"mac": mac, "serial": serial}
-    save_devices(d)
-    return True
-
-def activate_device(device_id: str):
-    d = load_devices()
-    if device_id not in d:
-        return False
-    d[device_id]["activated"] = True
-    d[device_id]["activation_time"] = datetime.utcnow().isoformat() + "Z"
-    save_devices(d)
-    return True
+async def get_device(session, device_id: str):
+    r = (await session.execute(select(db.devices_table).where(db.devices_table.c.device_id == device_id))).fetchone()
+    return _row_to_dict(r) if r else None
+
+async def _update(session, device_id: str, **values):
+    t = db.devices_table
+    res = await session.execute(t.update().where(t.c.device_id == device_id).values(**values))
+    await session.commit()
+    return res.rowcount > 0
+
+async def bind_device(session, device_id: str, mac: str = None, serial: str = None):
+    return await _update(session, device_id, bound=True, bound_mac=mac, bound_serial=serial)
+
+async def activate_device(session, device_id: str):
+    return await _update(session, device_id, activated=True, activation_time=_now())
+
+async def list_devices(session, owner: str = None, activated: bool = None, bound: bool = None,
+                       after: str = None, limit: int = 100):
+    """One page ordered by device_id; pass the returned "next" as `after` for the following page."""
+    t = db.devices_table
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    conds = []
+    if owner is not None:
+        conds.append(t.c.owner == owner)
+    if activated is not None:
+        conds.append(t.c.activated == activated)
+    if bound is not None:
+        conds.append(t.c.bound == bound)
+    if after is not None:
+        conds.append(t.c.device_id > after)
+    stmt = select(t).order_by(t.c.device_id).limit(limit + 1)
+    if conds:
+        stmt = stmt.where(and_(*conds))
+    rows = (await session.execute(stmt)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {"devices": [_row_to_dict(r) for r in rows], "next": rows[-1].device_id if more else None}
+
+async def import_legacy_json(session, path: Path = DEVICES_PATH):
+    """Move devices.json into the table once; the file is renamed so it is not imported again."""
+    if not path.exists():
+        return 0
+    legacy = json.loads(path.read_text() or "{}")
+    rows = []
+    for device_id, d in legacy.items():
+        info = d.get("bound_info") or {}
+        rows.append({
+            "device_id": device_id,
+            "owner": d.get("owner") or "",
+            "metadata": json.dumps(d.get("metadata") or {}),
+            "bound": bool(d.get("bound")),
+            "bound_mac": info.get("mac"),
+            "bound_serial": info.get("serial"),
+            "activated": bool(d.get("activated")),
+            "activation_time": d.get("activation_time"),
+            "last_seen": d.get("last_seen"),
+            "created_at": d.get("created_at") or _now(),
+        })
+    for i in range(0, len(rows), IMPORT_CHUNK):
+        await session.execute(_upsert(rows[i:i + IMPORT_CHUNK]))
+    await session.commit()
+    os.replace(path, path.with_name(path.name + ".imported"))
+    logger.info("imported %d devices from %s", len(rows), path)
+    return len(rows)
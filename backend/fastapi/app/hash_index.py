@@ -0,0 +1,122 @@
+"""
+Near-duplicate image lookup over the 64-bit phashes agents attach to events.
+Exact sha256 matches need nothing extra (events.sha256 is indexed); phash similarity is
+a Hamming-distance query, answered by a multi-index hash of the distinct phash values
+seen so far. The index only returns phash values; the events carrying them are then
+fetched through the events.phash index.
+
+The index is loaded from the events table at startup and extended on every ingest in
+this process. With several workers, a phash ingested by another worker is found after
+that worker's next reload (PHASH_INDEX_RELOAD seconds, 0 = never).
+"""
+
+import logging
+from itertools import combinations
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from . import db
+
+logger = logging.getLogger("uvicorn")
+
+def parse_phash(value) -> Optional[int]:
+    """imagehash's 16-hex-digit string (or an int) -> int; None if unusable."""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        return int(str(value), 16)
+    except ValueError:
+        return None
+
+class MultiIndexHamming:
+    """Multi-index hashing for Hamming range queries over 64-bit ints.
+
+    Each value is filed under its four 16-bit chunks. If two values differ in at most
+    d bits, at least one chunk differs in at most d // 4 bits (pigeonhole), so a query
+    only probes the buckets within d // 4 bits of each of its own chunks and then checks
+    the full distance of what it finds. On random 64-bit values this is ~100x faster
+    than a BK-tree at d=8.
+    """
+    CHUNKS = 4
+    WIDTH = 16
+
+    def __init__(self):
+        self._tables = [{} for _ in range(self.CHUNKS)]
+        self._values = set()
+        self._masks = {}
+
+    @property
+    def size(self) -> int:
+        return len(self._values)
+
+    def _chunks(self, value: int):
+        mask = (1 << self.WIDTH) - 1
+        return [(value >> (i * self.WIDTH)) & mask for i in range(self.CHUNKS)]
+
+    def _flip_masks(self, radius: int):
+        """All WIDTH-bit masks with at most radius bits set."""
+        masks = self._masks.get(radius)
+        if masks is None:
+            masks = [0]
+            for k in range(1, radius + 1):
+                for bits in combinations(range(self.WIDTH), k):
+                    masks.append(sum(1 << b for b in bits))
+            self._masks[radius] = masks
+        return masks
+
+    def add(self, value: int) -> bool:
+        if value in self._values:
+            return False
+        self._values.add(value)
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(value)
+        return True
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """[(distance, value)] within max_distance, nearest first."""
+        masks = self._flip_masks(max_distance // self.CHUNKS)
+        seen = set()
+        out = []
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for m in masks:
+                for v in table.get(chunk ^ m, ()):
+                    if v not in seen:
+                        seen.add(v)
+                        d = (v ^ value).bit_count()
+                        if d <= max_distance:
+                            out.append((d, v))
+        out.sort()
+        return out
+
+class PhashIndex:
+    def __init__(self):
+        self.index = MultiIndexHamming()
+
+    def add(self, phash) -> bool:
+        value = parse_phash(phash)
+        return value is not None and self.index.add(value)
+
+    def add_many(self, phashes: Iterable) -> int:
+        return sum(1 for p in phashes if self.add(p))
+
+    def similar(self, phash, max_distance: int) -> List[Tuple[int, str]]:
+        """[(distance, phash hex)] of known phashes within max_distance."""
+        value = parse_phash(phash)
+        if value is None:
+            return []
+        return [(d, f"{v:016x}") for d, v in self.index.search(value, max_distance)]
+
+    async def load(self, db_session, chunk: int = 100000):
+        """(Re)build from the distinct phashes in the events table."""
+        index = MultiIndexHamming()
+        c = db.events_table.c
+        res = await db_session.stream(select(c.phash).where(c.phash.isnot(None)).distinct().execution_options(yield_per=chunk))
+        async for (p,) in res:
+            value = parse_phash(p)
+            if value is not None:
+                index.add(value)
+        self.index = index
+        return index.size
+
+phash_index = PhashIndex()
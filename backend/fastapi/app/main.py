@@ -1,28 +1,151 @@
 #!/usr/bin/env python3
-from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Depends
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Request, Depends, Header
+from fastapi.responses import JSONResponse, FileResponse, Response
 from pathlib import Path
-import uuid, os, json, logging
-from . import db, storage, schemas, auth, alerting, devices as devices_mod, otp, policy, update, config
+import uuid, os, json, logging, asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from . import db, storage, schemas, auth, alerting, archive, devices as devices_mod, otp, policy, update, config
+from .notify import CommandNotifier
+from .hash_index import phash_index
 
 logger = logging.getLogger("uvicorn")
 app = FastAPI(title="Company DLP Collector")
 
 STORAGE = Path(os.getenv("STORAGE_PATH", "./data/uploads"))
 STORAGE.mkdir(parents=True, exist_ok=True)
+THUMBNAILS = STORAGE / "thumbnails"
+THUMBNAILS.mkdir(parents=True, exist_ok=True)
+MAX_BATCH_EVENTS = int(os.getenv("MAX_BATCH_EVENTS", "1000"))
+MAX_THUMBNAIL_BYTES = int(os.getenv("MAX_THUMBNAIL_BYTES", str(10 * 1024 * 1024)))
+# multipart boundaries and part headers on top of the thumbnail itself
+MULTIPART_OVERHEAD = 64 * 1024
+LONG_POLL_MAX_SECONDS = float(os.getenv("LONG_POLL_MAX_SECONDS", "30"))
+# notifier wakeups only reach waiters in the same worker; a waiting long-poll re-checks the DB this often
+LONG_POLL_RECHECK_SECONDS = float(os.getenv("LONG_POLL_RECHECK_SECONDS", "5"))
+COMMAND_COMPACT_INTERVAL = float(os.getenv("COMMAND_COMPACT_INTERVAL", "3600"))
+COMMAND_RETENTION_SECONDS = float(os.getenv("COMMAND_RETENTION_SECONDS", "86400"))
+OTP_SWEEP_INTERVAL = float(os.getenv("OTP_SWEEP_INTERVAL", "60"))
+# "segment": rolling compressed JSONL segments; "json": legacy file per event / per batch
+EVENT_STORAGE_MODE = os.getenv("EVENT_STORAGE_MODE", "segment")
+EVENT_ARCHIVE_INTERVAL = float(os.getenv("EVENT_ARCHIVE_INTERVAL", "3600"))
+PHASH_INDEX_RELOAD = float(os.getenv("PHASH_INDEX_RELOAD", "0"))
+notifier = CommandNotifier()
+segment_writer = storage.EventSegmentWriter(storage.EVENT_SEGMENT_PATH) if EVENT_STORAGE_MODE == "segment" else None
 
 @app.on_event("startup")
-def startup():
-    db.init_db(os.getenv("DATABASE_URL", "sqlite:///./data/collector.db"))
+async def startup():
+    await db.init_db(os.getenv("DATABASE_URL", "sqlite:///./data/collector.db"))
+    async with db.SessionLocal() as session:
+        await devices_mod.import_legacy_json(session)
+        logger.info("phash index: %d distinct values", await phash_index.load(session))
     storage.ensure_storage_dir(STORAGE)
+    alerting.dispatcher.start()
+
+async def _otp_sweep_loop():
+    while True:
+        await asyncio.sleep(OTP_SWEEP_INTERVAL)
+        try:
+            async with db.SessionLocal() as session:
+                await otp.sweep_expired(session)
+        except Exception:
+            logger.exception("otp sweep failed")
+
+async def _backfill_event_columns():
+    # rows stored before the promoted event columns existed; a no-op on new databases
+    try:
+        total = 0
+        while True:
+            async with db.SessionLocal() as session:
+                n = await db.backfill_event_columns(session)
+            total += n
+            if not n:
+                break
+            await asyncio.sleep(0)
+        if total:
+            logger.info("backfilled event columns for %d rows", total)
+    except Exception:
+        logger.exception("event column backfill failed")
+
+async def _phash_reload_loop():
+    while True:
+        await asyncio.sleep(PHASH_INDEX_RELOAD)
+        try:
+            async with db.SessionLocal() as session:
+                await phash_index.load(session)
+        except Exception:
+            logger.exception("phash index reload failed")
+
+async def _archive_loop():
+    while True:
+        await asyncio.sleep(EVENT_ARCHIVE_INTERVAL)
+        try:
+            if not archive.available():
+                continue
+            # segments untouched for a full max age will never be appended to again
+            segments = await run_in_threadpool(archive.pending_segments, storage.EVENT_SEGMENT_PATH,
+                                               {segment_writer.current()}, segment_writer.max_age)
+            if segments:
+                # frames are written before their insert commits; archive only what the events table holds
+                async with db.SessionLocal() as session:
+                    committed = await db.segment_event_ids(session, [seg.name for seg in segments])
+                res = await run_in_threadpool(archive.archive_segments, segments, storage.EVENT_ARCHIVE_PATH, committed)
+                # repoint the rows at the archive before their segments go away
+                async with db.SessionLocal() as session:
+                    await db.mark_events_archived(session, res["days"])
+                await run_in_threadpool(archive.drop_segments, segments)
+                logger.info("archived %d segments (%d events, %d without a committed row skipped)", res["segments"], res["events"], res["skipped"])
+            await run_in_threadpool(archive.merge_partitions, storage.EVENT_ARCHIVE_PATH)
+        except Exception:
+            logger.exception("event archive failed")
+
+async def _compaction_loop():
+    while True:
+        await asyncio.sleep(COMMAND_COMPACT_INTERVAL)
+        try:
+            async with db.SessionLocal() as session:
+                removed = await db.compact_commands(session, COMMAND_RETENTION_SECONDS)
+            if removed:
+                logger.info("compacted %d commands", removed)
+        except Exception:
+            logger.exception("command compaction failed")
+
+@app.on_event("startup")
+async def start_background_jobs():
+    app.state.compaction_task = asyncio.create_task(_compaction_loop())
+    app.state.otp_sweep_task = asyncio.create_task(_otp_sweep_loop())
+    app.state.backfill_task = asyncio.create_task(_backfill_event_columns())
+    app.state.phash_task = asyncio.create_task(_phash_reload_loop()) if PHASH_INDEX_RELOAD > 0 else None
+    app.state.archive_task = asyncio.create_task(_archive_loop()) if segment_writer is not None else None
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    app.state.compaction_task.cancel()
+    app.state.otp_sweep_task.cancel()
+    app.state.backfill_task.cancel()
+    if app.state.phash_task is not None:
+        app.state.phash_task.cancel()
+    if app.state.archive_task is not None:
+        app.state.archive_task.cancel()
+        segment_writer.close()
+    await run_in_threadpool(alerting.dispatcher.stop)
+    await db.close_db()
 
 @app.post("/api/v1/events")
-async def receive_event(payload: dict, request: Request):
+async def receive_event(payload: dict, request: Request, session: AsyncSession = Depends(db.get_session)):
     try:
         event_id = payload.get("event_id") or f"evt-{uuid.uuid4().hex[:12]}"
-        storage_path = storage.event_json_save(STORAGE, event_id, payload)
-        db.create_event(db.get_sync_session(), event_id, payload, str(storage_path))
-        # alert if needed
+        if segment_writer is not None:
+            payload["event_id"] = event_id
+            segment = await run_in_threadpool(segment_writer.append, [payload])
+            await db.create_event(session, event_id, payload, segment=segment)
+        else:
+            storage_path = await run_in_threadpool(storage.event_json_save, STORAGE, event_id, payload)
+            await db.create_event(session, event_id, payload, str(storage_path))
+        phash_index.add(payload.get("phash"))
+        # queued for the alert dispatcher, never sent from the request
         try:
             alerting.alert_admin(payload)
         except Exception:
@@ -32,31 +155,176 @@ async def receive_event(payload: dict, request: Request):
         logger.exception("receive_event failed")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/v1/events:batch")
+async def receive_events_batch(batch: schemas.EventBatch, session: AsyncSession = Depends(db.get_session)):
+    if len(batch.events) > MAX_BATCH_EVENTS:
+        raise HTTPException(status_code=413, detail=f"max {MAX_BATCH_EVENTS} events per batch")
+    try:
+        batch_id = f"batch-{uuid.uuid4().hex[:12]}"
+        events = []
+        for payload in batch.events:
+            event_id = payload.get("event_id") or f"evt-{uuid.uuid4().hex[:12]}"
+            payload["event_id"] = event_id
+            events.append((event_id, payload))
+        storage_path = segment = None
+        if events and segment_writer is not None:
+            segment = await run_in_threadpool(segment_writer.append, batch.events)
+        elif events:
+            storage_path = str(await run_in_threadpool(storage.event_batch_save, STORAGE, batch_id, batch.events))
+        statuses = await db.create_events_bulk(session, [(eid, p, storage_path) for eid, p in events], segment=segment)
+        if "error" in statuses:
+            # the insert was rolled back: nothing in this batch is stored, the agent must resend it
+            raise HTTPException(status_code=503, detail="event insert failed, retry the batch")
+        results = []
+        for (event_id, payload), status in zip(events, statuses):
+            results.append({"id": event_id, "status": status})
+            if status == "ok":
+                phash_index.add(payload.get("phash"))
+                try:
+                    alerting.alert_admin(payload)
+                except Exception:
+                    logger.exception("alerting failed")
+        return {"status":"ok", "batch_id": batch_id, "results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("receive_events_batch failed")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/v1/events/{event_id}/thumbnail")
-async def receive_thumbnail(event_id: str, thumbnail: UploadFile = File(...)):
+async def receive_thumbnail(event_id: str, request: Request, content_sha256: str = Header(None, alias="X-Content-SHA256"), session: AsyncSession = Depends(db.get_session)):
+    # the body is parsed here, not by a File() parameter: that would spool the whole
+    # multipart upload to disk before any size check could run
+    limit = MAX_THUMBNAIL_BYTES + MULTIPART_OVERHEAD
+    parser = form = None
     try:
-        ext = Path(thumbnail.filename).suffix or ".png"
-        out_path = STORAGE / f"{event_id}_thumb{ext}"
-        await storage.save_upload_async(thumbnail, out_path)
-        db.attach_thumbnail(db.get_sync_session(), event_id, str(out_path))
-        return {"status":"ok", "id": event_id}
+        if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+            raise HTTPException(status_code=400, detail="multipart/form-data body required")
+        if int(request.headers.get("content-length") or 0) > limit:
+            raise storage.UploadTooLarge(f"request body exceeds {limit} bytes")
+        parser = MultiPartParser(request.headers, storage.capped_stream(request.stream(), limit), max_files=1, max_fields=1)
+        try:
+            form = await parser.parse()
+        except (MultiPartException, ValueError) as e:
+            # ValueError: python-multipart's own parse errors, which starlette passes through
+            raise HTTPException(status_code=400, detail=f"malformed multipart body: {e}")
+        thumbnail = form.get("thumbnail")
+        if not isinstance(thumbnail, UploadFile):
+            raise HTTPException(status_code=422, detail="thumbnail file required")
+        ext = Path(thumbnail.filename or "").suffix or ".png"
+        tmp_path = THUMBNAILS / f"upload-{uuid.uuid4().hex}{ext}"
+        info = await storage.save_upload_async(thumbnail, tmp_path, max_bytes=MAX_THUMBNAIL_BYTES, expected_sha256=content_sha256)
+        # content-addressed: identical thumbnails from any device share one file
+        out_path = THUMBNAILS / f"{info['sha256']}{ext}"
+        known = await db.get_thumbnail(session, info["sha256"])
+        if known is None:
+            os.replace(tmp_path, out_path)
+            await db.put_thumbnail(session, info["sha256"], str(out_path), info["size"])
+        else:
+            os.unlink(tmp_path)
+            out_path = known["path"]
+        if not await db.attach_thumbnail(session, event_id, str(out_path)):
+            raise HTTPException(status_code=404, detail="unknown event")
+        return {"status":"ok", "id": event_id, "sha256": info["sha256"]}
+    except HTTPException:
+        raise
+    except storage.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except storage.UploadDigestMismatch as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.exception("thumbnail upload failed")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if form is not None:
+            await form.close()
+        elif parser is not None:
+            # parse() only cleans up its spooled files on MultiPartException
+            for f in parser._files_to_close_on_error:
+                f.close()
+
+@app.head("/api/v1/thumbnails/{sha256}")
+async def thumbnail_known(sha256: str, session: AsyncSession = Depends(db.get_session)):
+    # agents ask before uploading; 200 means attach by reference instead
+    known = await db.get_thumbnail(session, sha256.lower())
+    return Response(status_code=200 if known else 404)
+
+@app.post("/api/v1/events/{event_id}/thumbnail_ref")
+async def attach_thumbnail_ref(event_id: str, ref: schemas.ThumbnailRef, session: AsyncSession = Depends(db.get_session)):
+    known = await db.get_thumbnail(session, ref.sha256.lower())
+    if known is None:
+        raise HTTPException(status_code=404, detail="unknown thumbnail")
+    if not await db.attach_thumbnail(session, event_id, known["path"]):
+        raise HTTPException(status_code=404, detail="unknown event")
+    return {"status":"ok", "id": event_id, "sha256": known["sha256"]}
+
+@app.patch("/api/v1/events/{event_id}")
+async def complete_event_hash(event_id: str, hash_update: schemas.EventHashUpdate, session: AsyncSession = Depends(db.get_session)):
+    # agents send very large files with a sampled fingerprint and the full sha256 later
+    sha256 = hash_update.sha256.lower()
+    if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+        raise HTTPException(status_code=422, detail="sha256 must be 64 hex digits")
+    status = await db.complete_event_hash(session, event_id, sha256, hash_update.sampled_fingerprint)
+    if status == "unknown":
+        raise HTTPException(status_code=404, detail="unknown event")
+    if status == "mismatch":
+        raise HTTPException(status_code=409, detail="fingerprint mismatch")
+    return {"status":"ok", "id": event_id, "sha256": sha256}
 
 # commands endpoints for agents
+async def _fetch_commands(device_id: str):
+    # own short-lived session: a long-poll must not hold a pooled connection while it waits
+    async with db.SessionLocal() as session:
+        return await db.claim_commands(session, device_id)
+
 @app.get("/api/v1/agents/{device_id}/commands")
-def poll_commands(device_id: str):
+async def poll_commands(device_id: str):
     try:
-        return db.fetch_and_mark_delivered(db.get_sync_session(), device_id)
+        return await _fetch_commands(device_id)
     except Exception:
         logger.exception("poll commands failed")
         raise HTTPException(status_code=500, detail="poll error")
 
+@app.get("/api/v1/agents/{device_id}/commands/wait")
+async def wait_commands(device_id: str, timeout: float = 25):
+    """Long-poll: returns as soon as a command is queued for this device, or [] after timeout.
+    A command queued through this worker wakes the request at once; one queued through another
+    worker is found by the re-check every LONG_POLL_RECHECK_SECONDS."""
+    timeout = min(max(timeout, 0), LONG_POLL_MAX_SECONDS)
+    deadline = asyncio.get_running_loop().time() + timeout
+    # register before checking the DB so an enqueue in between is not missed
+    fut = notifier.register(device_id)
+    try:
+        cmds = await _fetch_commands(device_id)
+        while not cmds:
+            left = deadline - asyncio.get_running_loop().time()
+            if left <= 0:
+                break
+            if await notifier.wait(fut, min(left, LONG_POLL_RECHECK_SECONDS)):
+                # a woken future is spent; wait on a fresh one if another poll claimed the commands first
+                notifier.unregister(device_id, fut)
+                fut = notifier.register(device_id)
+            cmds = await _fetch_commands(device_id)
+        return cmds
+    except Exception:
+        logger.exception("wait commands failed")
+        raise HTTPException(status_code=500, detail="poll error")
+    finally:
+        notifier.unregister(device_id, fut)
+
+@app.post("/api/v1/agents/{device_id}/commands/ack")
+async def ack_commands(device_id: str, ack: schemas.CommandAck, session: AsyncSession = Depends(db.get_session)):
+    try:
+        return {"status":"ok", "acked": await db.ack_commands(session, device_id, ack.ids)}
+    except Exception:
+        logger.exception("ack commands failed")
+        raise HTTPException(status_code=500, detail="ack error")
+
 @app.post("/api/v1/agents/{device_id}/commands")
-def create_command(device_id: str, cmd: schemas.CommandCreate, user=Depends(auth.admin_required)):
+async def create_command(device_id: str, cmd: schemas.CommandCreate, user=Depends(auth.admin_required), session: AsyncSession = Depends(db.get_session)):
     try:
-        cmd_id = db.enqueue_command(db.get_sync_session(), device_id, cmd.type, cmd.payload or {})
+        cmd_id = await db.enqueue_command(session, device_id, cmd.type, cmd.payload or {})
+        notifier.notify(device_id)
         return {"status":"ok", "id": cmd_id}
     except Exception:
         logger.exception("create command failed")
@@ -64,39 +332,53 @@ def create_command(device_id: str, cmd: schemas.CommandCreate, user=Depends(auth
 
 # OTP & onboarding endpoints
 @app.post("/api/v1/register_device")
-def register_device(payload: dict):
+async def register_device(payload: dict, session: AsyncSession = Depends(db.get_session)):
     email = payload.get("employee_email")
     requested_id = payload.get("device_id")
     meta = payload.get("metadata", {})
     if not email:
         raise HTTPException(status_code=400, detail="email required")
-    device_id = devices_mod.register_device(email, requested_device_id=requested_id, metadata=meta)
+    device_id = await devices_mod.register_device(session, email, requested_device_id=requested_id, metadata=meta)
     return {"device_id": device_id}
 
 @app.post("/api/v1/request_otp")
-def request_otp(payload: dict):
+async def request_otp(payload: dict, session: AsyncSession = Depends(db.get_session)):
     email = payload.get("email")
     device_id = payload.get("device_id")
     if not email or not device_id:
         raise HTTPException(status_code=400, detail="missing fields")
-    sent = otp.request_otp(email, device_id, config.SMTP_CONFIG)
+    retry_after = otp.check_rate(email, device_id)
+    if retry_after:
+        raise HTTPException(status_code=429, detail="too many OTP requests", headers={"Retry-After": str(int(retry_after) + 1)})
+    code = await otp.request_otp(session, email, device_id)
+    sent = await run_in_threadpool(otp.send_otp_email, email, code, config.SMTP_CONFIG)
     return {"sent": bool(sent)}
 
 @app.post("/api/v1/verify_otp")
-def verify_otp(payload: dict):
+async def verify_otp(payload: dict, session: AsyncSession = Depends(db.get_session)):
     device_id = payload.get("device_id")
     code = payload.get("code")
     if not device_id or code is None:
         raise HTTPException(status_code=400, detail="missing")
-    ok = otp.verify_otp(device_id, code)
+    ok = await otp.verify_otp(session, device_id, code)
     if ok:
-        devices_mod.activate_device(device_id)
+        await devices_mod.activate_device(session, device_id)
     return {"ok": ok}
 
 # Policy and update endpoints
 @app.get("/api/v1/policy")
-def get_policy():
-    return policy.load_policy()
+def get_policy(request: Request, since: int = None):
+    version, etag, current = policy.current()
+    headers = {"ETag": f'"{etag}"', "X-Policy-Version": str(version), "Cache-Control": "no-cache"}
+    inm = request.headers.get("if-none-match")
+    if inm and etag in [t.strip().removeprefix("W/").strip('"') for t in inm.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if since is not None and since != version:
+        patch = policy.delta(since)
+        if patch is not None:
+            headers["X-Policy-Base-Version"] = str(since)
+            return JSONResponse(patch, headers=headers, media_type="application/json-patch+json")
+    return JSONResponse(current, headers=headers)
 
 # include admin router
 from . import admin
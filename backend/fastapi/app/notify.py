@@ -0,0 +1,47 @@
+import asyncio
+
+class CommandNotifier:
+    """Per-device wakeups for long-polling agents.
+
+    Waiters are plain futures on the event loop, so an idle connection costs one
+    dict entry. notify() is safe to call from sync endpoints running in the
+    threadpool. Only waiters in this process are woken; with several workers the
+    others find the command on their next DB re-check (main.LONG_POLL_RECHECK_SECONDS).
+    """
+    def __init__(self):
+        self._waiters = {}
+        self._loop = None
+
+    def register(self, device_id: str) -> asyncio.Future:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        fut = self._loop.create_future()
+        self._waiters.setdefault(device_id, set()).add(fut)
+        return fut
+
+    def unregister(self, device_id: str, fut: asyncio.Future):
+        waiters = self._waiters.get(device_id)
+        if waiters is not None:
+            waiters.discard(fut)
+            if not waiters:
+                del self._waiters[device_id]
+
+    async def wait(self, fut: asyncio.Future, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _wake(self, device_id: str):
+        for fut in self._waiters.pop(device_id, ()):
+            if not fut.done():
+                fut.set_result(True)
+
+    def notify(self, device_id: str):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._wake, device_id)
+
+    def waiting(self) -> int:
+        return sum(len(w) for w in self._waiters.values())
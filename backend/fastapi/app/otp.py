@@ -1,52 +1,117 @@
-import random, string, time, json
-from pathlib import Path
+"""
+Activation codes.
+Codes live in the otp_codes table (one row per device, indexed on expires_at) and are
+stored only as a sha256. verify_otp() consumes a code with a single DELETE ... WHERE,
+so two concurrent verifies can never both succeed; expired rows are removed by
+sweep_expired() from the collector's background loop. Requests are rate limited per
+device and per email with in-process token buckets (one dict lookup each).
+"""
+
+import hashlib, os, secrets, threading, time
 from email.mime.text import MIMEText
-import smtplib
+from sqlalchemy import and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import db, alerting
+
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "300"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+# token buckets: burst size, and one token back every *_REFILL_SECONDS
+OTP_DEVICE_BURST = int(os.getenv("OTP_DEVICE_BURST", "3"))
+OTP_DEVICE_REFILL_SECONDS = float(os.getenv("OTP_DEVICE_REFILL_SECONDS", "60"))
+OTP_EMAIL_BURST = int(os.getenv("OTP_EMAIL_BURST", "5"))
+OTP_EMAIL_REFILL_SECONDS = float(os.getenv("OTP_EMAIL_REFILL_SECONDS", "60"))
+
+class RateLimiter:
+    """Token bucket per key. Only limits within this process; each worker keeps its own buckets."""
+    def __init__(self, burst: int, refill_seconds: float):
+        self.burst = burst
+        self.refill_seconds = refill_seconds
+        self._buckets = {}  # key -> (tokens, last refill time)
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> float:
+        """Take a token for key. Returns 0 if allowed, else seconds until the next token."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - ts) / self.refill_seconds)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) * self.refill_seconds
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
 
-OTP_STORE = Path(__file__).parent / "otp_store.json"
+    def sweep(self):
+        """Forget buckets that have refilled completely; they behave exactly like new ones."""
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, (tokens, ts) in self._buckets.items() if (self.burst - tokens) * self.refill_seconds <= now - ts]:
+                del self._buckets[key]
 
-def _load():
-    if OTP_STORE.exists():
-        return json.loads(OTP_STORE.read_text())
-    return {}
+device_limiter = RateLimiter(OTP_DEVICE_BURST, OTP_DEVICE_REFILL_SECONDS)
+email_limiter = RateLimiter(OTP_EMAIL_BURST, OTP_EMAIL_REFILL_SECONDS)
+_mailer = None
 
-def _save(d):
-    OTP_STORE.write_text(json.dumps(d, indent=2))
+def _hash(device_id: str, code: str) -> str:
+    return hashlib.sha256(f"{device_id}:{code}".encode("utf-8")).hexdigest()
 
-def generate_otp(length=6, ttl_seconds=300):
-    return ''.join(random.choices(string.digits, k=length)), int(time.time()) + ttl_seconds
+def generate_otp(length=6, ttl_seconds=OTP_TTL_SECONDS):
+    return "".join(secrets.choice("0123456789") for _ in range(length)), time.time() + ttl_seconds
 
 def send_otp_email(to_email: str, otp: str, smtp_cfg: dict):
+    """Blocking; call from a worker thread. Reuses one SMTP connection across requests."""
+    global _mailer
+    if _mailer is None or _mailer.smtp_cfg is not smtp_cfg:
+        _mailer = alerting.SMTPMailer(smtp_cfg)
     body = f"Your Company DLP activation code is: {otp}\nValid for a few minutes."
     msg = MIMEText(body)
     msg["Subject"] = "Company DLP OTP"
     msg["From"] = smtp_cfg.get("sender", smtp_cfg.get("user"))
     msg["To"] = to_email
-    try:
-        s = smtplib.SMTP(smtp_cfg["host"], smtp_cfg.get("port", 587), timeout=10)
-        if smtp_cfg.get("use_tls", True):
-            s.starttls()
-        s.login(smtp_cfg["user"], smtp_cfg["password"])
-        s.sendmail(msg["From"], [to_email], msg.as_string())
-        s.quit()
+    return _mailer.send([to_email], msg)
+
+def check_rate(email: str, device_id: str) -> float:
+    """0 if this request may proceed, else the Retry-After in seconds."""
+    return device_limiter.allow(device_id) or email_limiter.allow(email.lower())
+
+async def request_otp(session, email, device_id):
+    """Store a fresh code for device_id (replacing any pending one) and return it."""
+    code, expiry = generate_otp()
+    insert = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(db.otp_table).values(device_id=device_id, email=email, code_hash=_hash(device_id, code), expires_at=expiry, attempts=0)
+    stmt = stmt.on_conflict_do_update(index_elements=["device_id"], set_={
+        "email": stmt.excluded.email, "code_hash": stmt.excluded.code_hash,
+        "expires_at": stmt.excluded.expires_at, "attempts": 0,
+    })
+    await session.execute(stmt)
+    await session.commit()
+    return code
+
+async def verify_otp(session, device_id, code):
+    t = db.otp_table
+    now = time.time()
+    # consume: only one concurrent verify can delete the row
+    res = await session.execute(t.delete().where(and_(
+        t.c.device_id == device_id,
+        t.c.code_hash == _hash(device_id, str(code)),
+        t.c.expires_at >= now,
+        t.c.attempts < OTP_MAX_ATTEMPTS,
+    )))
+    if res.rowcount:
+        await session.commit()
         return True
-    except Exception:
-        return False
-
-def request_otp(email, device_id, smtp_cfg):
-    otp, expiry = generate_otp()
-    store = _load()
-    store[device_id] = {"email": email, "otp": otp, "expiry": expiry}
-    _save(store)
-    return send_otp_email(email, otp, smtp_cfg)
-
-def verify_otp(device_id, code):
-    store = _load()
-    rec = store.get(device_id)
-    if not rec:
-        return False
-    if int(time.time()) > rec["expiry"]:
-        del store[device_id]; _save(store); return False
-    if str(code) == str(rec["otp"]):
-        del store[device_id]; _save(store); return True
+    # wrong code: count it, and drop the code once it has been guessed at too often
+    await session.execute(t.update().where(t.c.device_id == device_id).values(attempts=t.c.attempts + 1))
+    await session.execute(t.delete().where(and_(t.c.device_id == device_id, t.c.attempts >= OTP_MAX_ATTEMPTS)))
+    await session.commit()
     return False
+
+async def sweep_expired(session):
+    """Delete expired codes (range scan on ix_otp_codes_expires) and idle rate-limit buckets."""
+    t = db.otp_table
+    res = await session.execute(t.delete().where(t.c.expires_at < time.time()))
+    await session.commit()
+    device_limiter.sweep()
+    email_limiter.sweep()
+    return res.rowcount
@@ -1,12 +1,102 @@
-import json
+import json, os, hashlib, logging, re, threading
+from collections import OrderedDict
 from pathlib import Path
 POLICY_FILE = Path(__file__).parent / "policy_master.json"
+# monotonic version + etag of the last policy seen, survives restarts
+POLICY_STATE_FILE = Path(__file__).parent / "policy_state.json"
+HISTORY_LIMIT = 16
+# sensitive_patterns starting with this are regexes, everything else is literal text;
+# must match shared/processing/scanner.REGEX_PREFIX
+REGEX_PREFIX = "re:"
+logger = logging.getLogger("uvicorn")
 if not POLICY_FILE.exists():
-    POLICY_FILE.write_text(json.dumps({"allowed_extensions":[".txt",".pdf"], "blocked_extensions":[".exe"], "sensitive_patterns":["CONFIDENTIAL"]}, indent=2))
+    POLICY_FILE.write_text(json.dumps({"allowed_extensions":[".txt",".pdf"], "blocked_extensions":[".exe"], "sensitive_patterns":["CONFIDENTIAL"], "scan_options":{"ignore_case":False, "stop_on_first_match":True, "max_bytes":33554432, "max_bytes_by_extension":{".txt":67108864, ".csv":67108864}}}, indent=2))
+
+_lock = threading.Lock()
+_cache = {"sig": None, "policy": None, "etag": None, "version": 0}
+_history = OrderedDict()  # version -> policy, for deltas
+
+def policy_etag(policy: dict) -> str:
+    # must match shared/transport/policy_sync.policy_etag
+    return hashlib.sha256(json.dumps(policy, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def invalid_patterns(policy: dict) -> list:
+    """[(pattern, error)] for sensitive_patterns regexes the agents cannot compile."""
+    bad = []
+    for p in policy.get("sensitive_patterns", []):
+        if isinstance(p, str) and p.startswith(REGEX_PREFIX):
+            try:
+                re.compile(p[len(REGEX_PREFIX):])
+            except re.error as e:
+                bad.append((p, str(e)))
+    return bad
+
+def _write_atomic(path: Path, text: str):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+def _refresh():
+    st = POLICY_FILE.stat()
+    sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+    if sig == _cache["sig"]:
+        return
+    with _lock:
+        if sig == _cache["sig"]:
+            return
+        policy = json.loads(POLICY_FILE.read_text())
+        for p, err in invalid_patterns(policy):
+            # hand-edited file: still served, but agents will skip these patterns
+            logger.error("policy sensitive pattern %r is invalid and will not be applied: %s", p, err)
+        etag = policy_etag(policy)
+        state = json.loads(POLICY_STATE_FILE.read_text()) if POLICY_STATE_FILE.exists() else {"version": 0, "etag": None}
+        if state.get("etag") != etag:
+            state = {"version": state.get("version", 0) + 1, "etag": etag}
+            _write_atomic(POLICY_STATE_FILE, json.dumps(state))
+        _cache.update(sig=sig, policy=policy, etag=etag, version=state["version"])
+        _history[state["version"]] = policy
+        while len(_history) > HISTORY_LIMIT:
+            _history.popitem(last=False)
 
 def load_policy():
-    return json.loads(POLICY_FILE.read_text())
+    _refresh()
+    return _cache["policy"]
+
+def current():
+    """(version, etag, policy) of the policy file, re-parsed only when the file changes."""
+    _refresh()
+    return _cache["version"], _cache["etag"], _cache["policy"]
+
+def _pointer(path):
+    return "".join("/" + str(p).replace("~", "~0").replace("/", "~1") for p in path)
+
+def _diff(old, new, path, ops):
+    if isinstance(old, dict) and isinstance(new, dict):
+        for k in old:
+            if k not in new:
+                ops.append({"op": "remove", "path": _pointer(path + [k])})
+        for k, v in new.items():
+            if k not in old:
+                ops.append({"op": "add", "path": _pointer(path + [k]), "value": v})
+            elif old[k] != v:
+                _diff(old[k], v, path + [k], ops)
+    elif old != new:
+        # lists and scalars are replaced whole
+        ops.append({"op": "replace", "path": _pointer(path), "value": new})
+    return ops
+
+def delta(since_version: int):
+    """RFC 6902 patch from since_version to the current policy, or None if that version is unknown."""
+    _refresh()
+    base = _history.get(since_version)
+    if base is None:
+        return None
+    return _diff(base, _cache["policy"], [], [])
 
 def update_policy(new_policy: dict):
-    POLICY_FILE.write_text(json.dumps(new_policy, indent=2))
+    bad = invalid_patterns(new_policy)
+    if bad:
+        raise ValueError("invalid sensitive patterns: " + "; ".join(f"{p!r}: {e}" for p, e in bad))
+    _write_atomic(POLICY_FILE, json.dumps(new_policy, indent=2))
+    _refresh()
     return True
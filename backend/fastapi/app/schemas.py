@@ -1,6 +1,19 @@
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 class CommandCreate(BaseModel):
     type: str
     payload: Optional[Dict] = None
+
+class EventBatch(BaseModel):
+    events: List[Dict]
+
+class CommandAck(BaseModel):
+    ids: List[str]
+
+class ThumbnailRef(BaseModel):
+    sha256: str
+
+class EventHashUpdate(BaseModel):
+    sha256: str
+    sampled_fingerprint: str
@@ -1,6 +1,17 @@
-import json
+import json, os, hashlib, gzip, io, threading, time
 from pathlib import Path
 import aiofiles
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+EVENT_SEGMENT_PATH = Path(os.getenv("EVENT_SEGMENT_PATH", "./data/segments"))
+EVENT_ARCHIVE_PATH = Path(os.getenv("EVENT_ARCHIVE_PATH", "./data/archive"))
+EVENT_SEGMENT_MAX_BYTES = int(os.getenv("EVENT_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+EVENT_SEGMENT_MAX_AGE = float(os.getenv("EVENT_SEGMENT_MAX_AGE", "3600"))
+EVENT_SEGMENT_ZSTD_LEVEL = int(os.getenv("EVENT_SEGMENT_ZSTD_LEVEL", "3"))
 
 def ensure_storage_dir(path: Path):
     path.mkdir(parents=True, exist_ok=True)
@@ -11,7 +22,143 @@ def event_json_save(storage_dir: Path, event_id: str, payload: dict):
         json.dump(payload, f)
     return out
 
-async def save_upload_async(upload_file, out_path: Path):
-    async with aiofiles.open(out_path, "wb") as f:
-        content = await upload_file.read()
-        await f.write(content)
+def event_batch_save(storage_dir: Path, batch_id: str, events):
+    # one JSONL file per batch instead of one file per event
+    out = storage_dir / f"{batch_id}.jsonl"
+    with out.open("w", encoding="utf-8") as f:
+        for payload in events:
+            f.write(json.dumps(payload))
+            f.write("\n")
+    return out
+
+def _compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=EVENT_SEGMENT_ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def _decompress(name: str, data: bytes) -> bytes:
+    if name.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {name}")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+class EventSegmentWriter:
+    """Appends events to rolling compressed JSONL segments (zstd, or gzip without zstandard).
+
+    Every append() is written as one independent zstd frame / gzip member, so a segment
+    is a valid .zst/.gz stream as a whole and any single append can be read back from
+    its (segment, offset, length) alone. Segments roll at EVENT_SEGMENT_MAX_BYTES or
+    EVENT_SEGMENT_MAX_AGE; names carry the pid so several workers never share a file.
+    """
+    def __init__(self, directory: Path, max_bytes: int = EVENT_SEGMENT_MAX_BYTES, max_age: float = EVENT_SEGMENT_MAX_AGE):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.ext = ".jsonl.zst" if zstandard is not None else ".jsonl.gz"
+        self._lock = threading.Lock()
+        self._f = None
+        self._name = None
+        self._opened = 0.0
+        self._seq = 0
+
+    def _roll(self):
+        if self._f is not None:
+            self._f.close()
+        self._seq += 1
+        self._name = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{os.getpid()}-{self._seq:04d}{self.ext}"
+        self._f = open(self.directory / self._name, "ab")
+        self._opened = time.monotonic()
+
+    def current(self):
+        """Name of the segment being appended to (not yet safe to compact)."""
+        return self._name
+
+    def append(self, events) -> tuple:
+        """Write events as one frame; returns (segment name, offset, length)."""
+        data = _compress("".join(json.dumps(e) + "\n" for e in events).encode("utf-8"))
+        with self._lock:
+            if self._f is None or self._f.tell() >= self.max_bytes or time.monotonic() - self._opened >= self.max_age:
+                self._roll()
+            offset = self._f.tell()
+            self._f.write(data)
+            self._f.flush()
+            return self._name, offset, len(data)
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+def read_segment_frame(directory: Path, segment: str, offset: int, length: int):
+    """The events written by one EventSegmentWriter.append()."""
+    with open(Path(directory) / segment, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return [json.loads(line) for line in _decompress(segment, data).splitlines() if line]
+
+def iter_segment(path: Path):
+    """All events in a segment file, in write order."""
+    path = Path(path)
+    if path.name.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path.name}")
+        with open(path, "rb") as f:
+            reader = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True), encoding="utf-8")
+            for line in reader:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+class UploadTooLarge(Exception):
+    pass
+
+class UploadDigestMismatch(Exception):
+    pass
+
+async def capped_stream(stream, max_bytes: int):
+    """Pass a request body through, raising UploadTooLarge as soon as more than max_bytes arrived."""
+    size = 0
+    async for chunk in stream:
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(f"request body exceeds {max_bytes} bytes")
+        yield chunk
+
+async def save_upload_async(upload_file, out_path: Path, max_bytes: int = None, expected_sha256: str = None, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """Stream an upload to disk chunk by chunk.
+
+    Writes to <out_path>.part while hashing, enforces max_bytes, checks
+    expected_sha256 if given, then renames into place. Returns {"size", "sha256"}.
+    """
+    tmp = out_path.with_name(out_path.name + ".part")
+    h = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp, "wb") as f:
+            while True:
+                chunk = await upload_file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+                h.update(chunk)
+                await f.write(chunk)
+        digest = h.hexdigest()
+        if expected_sha256 and digest != expected_sha256.lower():
+            raise UploadDigestMismatch(f"sha256 mismatch: got {digest}")
+        os.replace(tmp, out_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    return {"size": size, "sha256": digest}
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Watcher noise vs handler calls with the EventCoalescer in front of handle_file_event.
+Replays typical save patterns (editor tmp + rename, browser .crdownload, Office ~$ lock,
+chunked writes) for N files and counts how often the handler, i.e. hashing, phash,
+thumbnail and send, would run.
+
+    python benchmarks/bench_coalescer.py --files 2000 --writes 5
+"""
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from shared.processing.coalescer import EventCoalescer
+
+def noise(i, writes):
+    d = "/home/u/Documents"
+    kind = i % 4
+    if kind == 0:  # editor: write temp file, rename over target
+        yield {"event": "created", "file_path": f"{d}/.f{i}.txt.swp"}
+        for _ in range(writes):
+            yield {"event": "modified", "file_path": f"{d}/.f{i}.txt.swp"}
+        yield {"event": "moved", "src_path": f"{d}/.f{i}.txt.swp", "dest_path": f"{d}/f{i}.txt"}
+    elif kind == 1:  # browser download
+        yield {"event": "created", "file_path": f"{d}/f{i}.zip.crdownload"}
+        for _ in range(writes):
+            yield {"event": "modified", "file_path": f"{d}/f{i}.zip.crdownload"}
+        yield {"event": "moved", "src_path": f"{d}/f{i}.zip.crdownload", "dest_path": f"{d}/f{i}.zip"}
+    elif kind == 2:  # office: lock file plus in-place saves
+        yield {"event": "created", "file_path": f"{d}/~$f{i}.docx"}
+        for _ in range(writes):
+            yield {"event": "modified", "file_path": f"{d}/f{i}.docx"}
+        yield {"event": "deleted", "file_path": f"{d}/~$f{i}.docx"}
+    else:  # plain copy: create + chunked writes
+        yield {"event": "created", "file_path": f"{d}/f{i}.pdf"}
+        for _ in range(writes):
+            yield {"event": "modified", "file_path": f"{d}/f{i}.pdf"}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=2000)
+    ap.add_argument("--writes", type=int, default=5)
+    ap.add_argument("--quiet", type=float, default=0.3)
+    args = ap.parse_args()
+    calls = []
+    lock = threading.Lock()
+    def handler(ev):
+        with lock:
+            calls.append(ev["file_path"])
+    c = EventCoalescer(handler, quiet=args.quiet)
+    c.start()
+    raw = 0
+    t0 = time.perf_counter()
+    for i in range(args.files):
+        for ev in noise(i, args.writes):
+            c.submit(ev)
+            raw += 1
+    submit_us = (time.perf_counter() - t0) / raw * 1e6
+    time.sleep(args.quiet * 2 + 0.5)
+    c.stop()
+    print(f"watcher callbacks: {raw}  ({submit_us:.1f} us per submit)")
+    print(f"handler calls:     {len(calls)}  (real file changes: {args.files}, distinct paths: {len(set(calls))})")
+    print(f"work reduction:    {raw / max(len(calls), 1):.1f}x   stats: {c.stats}")
+
+if __name__ == "__main__":
+    main()
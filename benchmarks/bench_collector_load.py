@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Load test against a running collector: N concurrent agents each POST events to
+/api/v1/events and long/short-poll commands. Prints throughput and latency percentiles.
+Run it against a build before and after a change, with the same arguments.
+
+    uvicorn app.main:app --port 8443            # in backend/fastapi
+    python benchmarks/bench_collector_load.py --url http://127.0.0.1:8443 --agents 200 --events 50
+
+Each endpoint is checked against --p99-target-ms (default 500 ms). The target is meant for a
+collector on Postgres (DATABASE_URL=postgresql://...). SQLite takes one writer at a time, so
+every per-event POST queues behind the others; at 100 agents its p99 is seconds and it is not
+expected to meet the target.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def agent(client, idx, n_events, latencies, errors):
+    device_id = f"load-dev-{idx}"
+    for i in range(n_events):
+        ev = {"event_id": f"evt-{uuid.uuid4().hex[:12]}", "device_id": device_id, "event_type": "file_created", "file_name": f"f{i}.txt"}
+        t0 = time.perf_counter()
+        try:
+            r = await client.post("/api/v1/events", json=ev)
+            r.raise_for_status()
+            latencies["events"].append(time.perf_counter() - t0)
+        except Exception:
+            errors["events"] += 1
+        t0 = time.perf_counter()
+        try:
+            r = await client.get(f"/api/v1/agents/{device_id}/commands")
+            r.raise_for_status()
+            latencies["commands"].append(time.perf_counter() - t0)
+        except Exception:
+            errors["commands"] += 1
+
+async def run(args):
+    latencies = {"events": [], "commands": []}
+    errors = {"events": 0, "commands": 0}
+    limits = httpx.Limits(max_connections=args.agents, max_keepalive_connections=args.agents)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(agent(client, i, args.events, latencies, errors) for i in range(args.agents)))
+        elapsed = time.perf_counter() - t0
+    total = sum(len(v) for v in latencies.values())
+    print(f"{args.agents} agents, {total} requests in {elapsed:.1f}s ({total / elapsed:.0f} req/s)")
+    for name, values in latencies.items():
+        p99 = pct(values, 99) * 1000
+        verdict = "PASS" if values and not errors[name] and p99 <= args.p99_target_ms else "FAIL"
+        print(f"  {name:9} p50={pct(values, 50) * 1000:7.1f}ms p95={pct(values, 95) * 1000:7.1f}ms p99={p99:7.1f}ms errors={errors[name]}  {verdict} (p99 target {args.p99_target_ms:.0f}ms)")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8443")
+    ap.add_argument("--agents", type=int, default=100)
+    ap.add_argument("--events", type=int, default=20)
+    ap.add_argument("--p99-target-ms", type=float, default=500)
+    asyncio.run(run(ap.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Device registry benchmark: lookup, activate and admin page latency as the registry grows.
+Seeds N devices into a temporary SQLite database and times each operation at every size,
+so per-call cost should stay flat as N increases.
+
+    python benchmarks/bench_device_registry.py --sizes 1000 10000 100000 --ops 500
+"""
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend" / "fastapi"))
+
+from app import db, devices
+
+def seed_rows(start, stop):
+    return [{
+        "device_id": f"dev-{i:08d}",
+        "owner": f"user{i % 5000}@company.com",
+        "metadata": "{}",
+        "bound": False,
+        "bound_mac": None,
+        "bound_serial": None,
+        "activated": i % 3 == 0,
+        "activation_time": None,
+        "last_seen": None,
+        "created_at": "2024-01-01T00:00:00Z",
+    } for i in range(start, stop)]
+
+async def timed(n, fn):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+async def run(args, tmp):
+    await db.init_db(f"sqlite:///{tmp / 'bench.db'}")
+    have = 0
+    print(f"{'devices':>9} {'get us':>9} {'activate us':>12} {'page us':>9} {'owner page us':>14}")
+    for size in sorted(args.sizes):
+        async with db.SessionLocal() as session:
+            for i in range(have, size, devices.IMPORT_CHUNK):
+                await session.execute(devices._upsert(seed_rows(i, min(i + devices.IMPORT_CHUNK, size))))
+            await session.commit()
+        have = size
+        rnd = random.Random(size)
+        pick = lambda: f"dev-{rnd.randrange(size):08d}"
+        async with db.SessionLocal() as session:
+            get_us = await timed(args.ops, lambda: devices.get_device(session, pick()))
+            act_us = await timed(args.ops, lambda: devices.activate_device(session, pick()))
+            page_us = await timed(args.ops // 10 or 1, lambda: devices.list_devices(session, activated=True, after=pick(), limit=100))
+            owner_us = await timed(args.ops // 10 or 1, lambda: devices.list_devices(session, owner=f"user{rnd.randrange(5000)}@company.com"))
+        print(f"{size:9d} {get_us:9.0f} {act_us:12.0f} {page_us:9.0f} {owner_us:14.0f}")
+    await db.close_db()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--ops", type=int, default=500)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, Path(tmp)))
+
+if __name__ == "__main__":
+    main()
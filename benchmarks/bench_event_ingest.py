@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Collector ingest benchmark: per-event path vs batch path.
+Measures the work one collector worker does per event (JSON file or segment frame write
++ DB insert), without HTTP overhead, against a temporary SQLite database.
+
+    python benchmarks/bench_event_ingest.py --events 5000 --batch-size 500 --storage segment
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend" / "fastapi"))
+
+from app import db, storage
+
+def make_event(i):
+    return {
+        "event_id": f"evt-{uuid.uuid4().hex[:12]}",
+        "device_id": f"dev-{i % 50}",
+        "event_type": "file_created",
+        "file_name": f"file_{i}.pdf",
+        "sha256": uuid.uuid4().hex * 2,
+    }
+
+async def bench_single(storage_dir, events, mode):
+    writer = storage.EventSegmentWriter(storage_dir) if mode == "segment" else None
+    t0 = time.perf_counter()
+    for ev in events:
+        async with db.SessionLocal() as session:
+            if writer is not None:
+                await db.create_event(session, ev["event_id"], ev, segment=writer.append([ev]))
+            else:
+                path = storage.event_json_save(storage_dir, ev["event_id"], ev)
+                await db.create_event(session, ev["event_id"], ev, str(path))
+    elapsed = time.perf_counter() - t0
+    if writer is not None:
+        writer.close()
+    return elapsed
+
+async def bench_batch(storage_dir, events, batch_size, mode):
+    writer = storage.EventSegmentWriter(storage_dir) if mode == "segment" else None
+    t0 = time.perf_counter()
+    for i in range(0, len(events), batch_size):
+        chunk = events[i:i + batch_size]
+        path = segment = None
+        if writer is not None:
+            segment = writer.append(chunk)
+        else:
+            path = str(storage.event_batch_save(storage_dir, f"batch-{i}", chunk))
+        async with db.SessionLocal() as session:
+            await db.create_events_bulk(session, [(ev["event_id"], ev, path) for ev in chunk], segment=segment)
+    elapsed = time.perf_counter() - t0
+    if writer is not None:
+        writer.close()
+    return elapsed
+
+async def run(args, tmp):
+    await db.init_db(f"sqlite:///{tmp / 'bench.db'}")
+    single_dir = tmp / "single"; batch_dir = tmp / "batch"
+    single_dir.mkdir(); batch_dir.mkdir()
+    t_single = await bench_single(single_dir, [make_event(i) for i in range(args.events)], args.storage)
+    t_batch = await bench_batch(batch_dir, [make_event(i) for i in range(args.events)], args.batch_size, args.storage)
+    await db.close_db()
+    return t_single, t_batch
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=5000)
+    ap.add_argument("--batch-size", type=int, default=500)
+    ap.add_argument("--storage", choices=("json", "segment"), default="segment", help="collector EVENT_STORAGE_MODE")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        t_single, t_batch = asyncio.run(run(args, Path(tmp)))
+    print(f"storage: {args.storage}")
+    print(f"single: {args.events / t_single:10.0f} events/s")
+    print(f"batch:  {args.events / t_batch:10.0f} events/s (batch size {args.batch_size})")
+    print(f"speedup: {t_single / t_batch:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+/admin/events query cost vs table size and page depth.
+Seeds N events into a temporary SQLite database, then times the first page and a page
+reached after walking --depth pages with the keyset cursor, unfiltered and per filter.
+Page latency should not grow with N or with depth.
+
+    python benchmarks/bench_event_query.py --rows 1000000 --depth 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend" / "fastapi"))
+
+from app import db
+
+TYPES = ["file_created", "usb_copy", "clipboard", "browser_upload_attempt", "print"]
+
+def seed_rows(start, stop):
+    rows = []
+    for i in range(start, stop):
+        payload = {"event_type": TYPES[i % len(TYPES)], "device_id": f"dev-{i % 5000}",
+                   "user_email": f"user{i % 5000}@company.com", "timestamp": 1700000000 + i,
+                   "file_name": f"file_{i}.pdf", "sha256": f"{i:064x}", "destination": "usb"}
+        rows.append({"id": f"evt-{i:012d}", "device_id": payload["device_id"], "payload": json.dumps(payload),
+                     "json_path": None, "segment": None, "segment_offset": None, "segment_length": None,
+                     **db._event_cols(payload)})
+    return rows
+
+async def page_ms(session, filters, depth, limit):
+    after = None
+    for _ in range(depth):
+        after = (await db.query_events(session, filters, after=after, limit=limit))["next"]
+    t0 = time.perf_counter()
+    await db.query_events(session, filters, after=after, limit=limit)
+    return (time.perf_counter() - t0) * 1e3
+
+async def run(args, tmp):
+    await db.init_db(f"sqlite:///{tmp / 'bench.db'}")
+    t0 = time.perf_counter()
+    async with db.SessionLocal() as session:
+        for i in range(0, args.rows, 5000):
+            await session.execute(db.events_table.insert(), seed_rows(i, min(i + 5000, args.rows)))
+            await session.commit()
+    print(f"seeded {args.rows} rows in {time.perf_counter() - t0:.0f}s")
+    rnd = random.Random(1)
+    cases = {
+        "all": {},
+        "device": {"device_id": f"dev-{rnd.randrange(5000)}"},
+        "event_type": {"event_type": "usb_copy"},
+        "user": {"user_email": f"user{rnd.randrange(5000)}@company.com"},
+    }
+    async with db.SessionLocal() as session:
+        for name, filters in cases.items():
+            first = await page_ms(session, filters, 0, args.limit)
+            deep = await page_ms(session, filters, args.depth, args.limit)
+            print(f"{name:12s} first page {first:7.2f} ms   page {args.depth + 1:4d} {deep:7.2f} ms")
+        t0 = time.perf_counter()
+        await db.query_events(session, {"sha256": f"{rnd.randrange(args.rows):064x}"})
+        print(f"{'sha256':12s} lookup     {(time.perf_counter() - t0) * 1e3:7.2f} ms")
+    await db.close_db()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000000)
+    ap.add_argument("--depth", type=int, default=50)
+    ap.add_argument("--limit", type=int, default=100)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, Path(tmp)))
+
+if __name__ == "__main__":
+    main()
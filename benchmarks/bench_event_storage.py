@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Event storage footprint: file per event (EVENT_STORAGE_MODE=json) vs rolling compressed
+segments (segment), plus the Parquet archive built from the segments.
+Reports files created, apparent bytes and allocated bytes (du), write throughput, and the
+size of the events table in SQLite for each mode (json rows carry the payload, segment
+rows only the frame pointer).
+
+    python benchmarks/bench_event_storage.py --events 20000 --batch-size 1
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend" / "fastapi"))
+
+from app import archive, db, storage
+
+def make_event(i):
+    return {
+        "event_id": f"evt-{uuid.uuid4().hex[:12]}",
+        "device_id": f"dev-{i % 50}",
+        "event_type": "file_created",
+        "timestamp": 1714521600 + i * 7,
+        "user_email": f"user{i % 50}@company.com",
+        "file_name": f"report_{i}.pdf",
+        "file_path": f"/home/user{i % 50}/Documents/report_{i}.pdf",
+        "sha256": uuid.uuid4().hex * 2,
+        "destination": "usb" if i % 3 else "cloud",
+        "policy_decision": {"decision": "monitor", "reason": "default"},
+    }
+
+def footprint(directory: Path):
+    files = apparent = allocated = 0
+    for dirpath, _, names in os.walk(directory):
+        for n in names:
+            st = os.stat(os.path.join(dirpath, n))
+            files += 1
+            apparent += st.st_size
+            allocated += st.st_blocks * 512
+    return files, apparent, allocated
+
+def report(label, directory, seconds, n):
+    files, apparent, allocated = footprint(directory)
+    rate = f"{n / seconds:10.0f} events/s" if seconds else ""
+    print(f"{label:10s} files={files:8d} bytes={apparent / 1e6:9.2f}MB on-disk={allocated / 1e6:9.2f}MB {rate}")
+    return allocated
+
+async def db_size(path: Path, rows_for_batch) -> int:
+    """Bytes of a fresh SQLite database after inserting every batch through create_events_bulk."""
+    await db.init_db(f"sqlite:///{path}")
+    for rows, segment in rows_for_batch:
+        async with db.SessionLocal() as session:
+            await db.create_events_bulk(session, rows, segment=segment)
+    async with db.engine.begin() as conn:
+        await conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        await conn.exec_driver_sql("VACUUM")
+    await db.close_db()
+    return sum(p.stat().st_size for p in path.parent.glob(path.name + "*"))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=20000)
+    ap.add_argument("--batch-size", type=int, default=1, help="events per request (1 = single-event POSTs)")
+    args = ap.parse_args()
+    events = [make_event(i) for i in range(args.events)]
+    batches = [events[i:i + args.batch_size] for i in range(0, len(events), args.batch_size)]
+    print(f"codec: {'zstd' if storage.zstandard is not None else 'gzip'}, batch size {args.batch_size}")
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        json_dir, seg_dir, arc_dir = tmp / "json", tmp / "segments", tmp / "archive"
+        json_dir.mkdir()
+        t0 = time.perf_counter()
+        for i, batch in enumerate(batches):
+            if args.batch_size == 1:
+                storage.event_json_save(json_dir, batch[0]["event_id"], batch[0])
+            else:
+                storage.event_batch_save(json_dir, f"batch-{i}", batch)
+        t_json = time.perf_counter() - t0
+        writer = storage.EventSegmentWriter(seg_dir)
+        t0 = time.perf_counter()
+        frames = [writer.append(batch) for batch in batches]
+        t_seg = time.perf_counter() - t0
+        writer.close()
+        a_json = report("json", json_dir, t_json, args.events)
+        a_seg = report("segment", seg_dir, t_seg, args.events)
+        json_rows = [([(ev["event_id"], ev, str(json_dir / f"batch-{i}.jsonl")) for ev in batch], None) for i, batch in enumerate(batches)]
+        seg_rows = [([(ev["event_id"], ev, None) for ev in batch], frame) for batch, frame in zip(batches, frames)]
+        db_json = asyncio.run(db_size(tmp / "json.db", json_rows))
+        db_seg = asyncio.run(db_size(tmp / "segment.db", seg_rows))
+        print(f"events table: json {db_json / 1e6:.2f}MB, segment {db_seg / 1e6:.2f}MB ({db_json / max(db_seg, 1):.1f}x smaller)")
+        t0 = time.perf_counter()
+        res = archive.compact_segments(seg_dir, arc_dir)
+        if res["segments"]:
+            report("parquet", arc_dir, None, args.events)
+            print(f"archive: {res['events']} events in {time.perf_counter() - t0:.2f}s")
+        print(f"on-disk reduction json -> segment: {a_json / max(a_seg, 1):.1f}x, files + DB: {(a_json + db_json) / max(a_seg + db_seg, 1):.1f}x")
+
+if __name__ == "__main__":
+    main()
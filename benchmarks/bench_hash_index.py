@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate phash lookup: multi-index hash (backend hash_index) vs a linear scan.
+Random 64-bit values are the worst case for the index (no clustering), so real
+phash distributions only do better.
+
+    python benchmarks/bench_hash_index.py --sizes 100000 1000000 --distances 4 8 12
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend" / "fastapi"))
+
+from app.hash_index import MultiIndexHamming
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    ap.add_argument("--distances", type=int, nargs="+", default=[4, 8, 12])
+    ap.add_argument("--queries", type=int, default=50)
+    args = ap.parse_args()
+    for size in args.sizes:
+        rnd = random.Random(size)
+        values = [rnd.getrandbits(64) for _ in range(size)]
+        index = MultiIndexHamming()
+        t0 = time.perf_counter()
+        for v in values:
+            index.add(v)
+        print(f"{size} values: build {time.perf_counter() - t0:.2f}s")
+        # queries are near-copies of stored values, as a re-shared image would be
+        queries = [values[rnd.randrange(size)] ^ (1 << rnd.randrange(64)) ^ (1 << rnd.randrange(64)) for _ in range(args.queries)]
+        t0 = time.perf_counter()
+        for q in queries[:5]:
+            [v for v in values if (v ^ q).bit_count() <= 8]
+        scan_ms = (time.perf_counter() - t0) / 5 * 1e3
+        for d in args.distances:
+            t0 = time.perf_counter()
+            for q in queries:
+                index.search(q, d)
+            ms = (time.perf_counter() - t0) / len(queries) * 1e3
+            print(f"  d={d:2d}: index {ms:8.2f} ms/query   linear scan {scan_ms:8.1f} ms/query")
+
+if __name__ == "__main__":
+    main()
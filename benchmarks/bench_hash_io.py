@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Hashing I/O variants: read() (new bytes per chunk), readinto() on a reused buffer, mmap.
+For each variant times one large file and a set of medium files hashed with hash_files()
+(1 and --workers threads), on a warm page cache and, on Linux, a cold one (the files are
+evicted with posix_fadvise(DONTNEED) first). Also reports the peak Python allocation
+while hashing the large file.
+
+    python benchmarks/bench_hash_io.py --large-mb 1024 --files 256 --file-mb 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from shared.processing.hasher import HASH_METHODS, hash_files, sha256_of_file
+
+def write_file(path: Path, size: int):
+    block = os.urandom(4 * 1024 * 1024)
+    with path.open("wb") as f:
+        left = size
+        while left > 0:
+            f.write(block[:min(left, len(block))])
+            left -= len(block)
+
+def evict(paths):
+    for p in paths:
+        with p.open("rb") as f:
+            os.fsync(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def warm(paths):
+    for p in paths:
+        with p.open("rb") as f:
+            while f.read(16 * 1024 * 1024):
+                pass
+
+def timed(fn, paths, cold):
+    evict(paths) if cold else warm(paths)
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--large-mb", type=int, default=1024)
+    ap.add_argument("--files", type=int, default=256)
+    ap.add_argument("--file-mb", type=int, default=4)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--dir", default=None, help="directory for the test files (default: system temp)")
+    args = ap.parse_args()
+    caches = ["warm"] + (["cold"] if hasattr(os, "posix_fadvise") else [])
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        large = Path(tmp) / "large.bin"
+        write_file(large, args.large_mb * 1024 * 1024)
+        medium = [Path(tmp) / f"m{i:05d}.bin" for i in range(args.files)]
+        for p in medium:
+            write_file(p, args.file_mb * 1024 * 1024)
+        medium_mb = args.files * args.file_mb
+
+        print(f"{'variant':9s} {'cache':5s} {'large MB/s':>11s} {'files x1 MB/s':>14s} {'files x%d MB/s' % args.workers:>14s}")
+        for method in HASH_METHODS:
+            for cache in caches:
+                cold = cache == "cold"
+                t_large = timed(lambda: sha256_of_file(large, method=method), [large], cold)
+                t_one = timed(lambda: hash_files(medium, workers=1, method=method), medium, cold)
+                t_many = timed(lambda: hash_files(medium, workers=args.workers, method=method), medium, cold)
+                print(f"{method:9s} {cache:5s} {args.large_mb / t_large:11.0f} {medium_mb / t_one:14.0f} {medium_mb / t_many:14.0f}")
+
+        for method in HASH_METHODS:
+            tracemalloc.start()
+            sha256_of_file(large, method=method)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{method:9s} peak python allocation {peak / 1024:8.0f} KB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Full SHA-256 vs sampled fingerprint across file sizes.
+Writes one random file per size, then times sha256_of_file and sampled_fingerprint on it
+(no hash cache, page cache warm from the write unless --drop-cache is given on Linux).
+The fingerprint should stay at a few ms while the full hash grows linearly with size.
+
+    python benchmarks/bench_hasher_tiers.py --sizes-mb 1 64 512 2048
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from shared.processing.hasher import sha256_of_file, sampled_fingerprint
+
+def write_file(path: Path, size: int):
+    block = os.urandom(4 * 1024 * 1024)
+    with path.open("wb") as f:
+        left = size
+        while left > 0:
+            f.write(block[:min(left, len(block))])
+            left -= len(block)
+
+def drop_cache(path: Path):
+    if hasattr(os, "posix_fadvise"):
+        with path.open("rb") as f:
+            os.fsync(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def timed(fn, path, drop):
+    if drop:
+        drop_cache(path)
+    t0 = time.perf_counter()
+    fn(path)
+    return time.perf_counter() - t0
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 64, 512, 2048])
+    ap.add_argument("--drop-cache", action="store_true", help="evict the file from the page cache before each run")
+    ap.add_argument("--dir", default=None, help="directory for the test files (default: system temp)")
+    args = ap.parse_args()
+    print(f"{'size':>8s} {'full sha256':>12s} {'MB/s':>7s} {'fingerprint':>12s} {'speedup':>8s}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for mb in args.sizes_mb:
+            path = Path(tmp) / f"file_{mb}mb.bin"
+            write_file(path, mb * 1024 * 1024)
+            full = timed(sha256_of_file, path, args.drop_cache)
+            fp = timed(sampled_fingerprint, path, args.drop_cache)
+            print(f"{mb:6d}MB {full * 1e3:10.1f}ms {mb / full:7.0f} {fp * 1e3:10.2f}ms {full / fp:7.0f}x")
+            path.unlink()
+
+if __name__ == "__main__":
+    main()
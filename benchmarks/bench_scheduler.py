@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+EventScheduler under a bulk backlog.
+Queues slow USB tasks and CPU-bound file tasks, then submits interactive tasks at a steady
+rate. Interactive wait should stay near zero and the process CPU use near --cpu-cores.
+
+    python benchmarks/bench_scheduler.py --files 200 --cpu-cores 0.5
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from shared.processing.scheduler import EventScheduler
+
+BLOCK = b"x" * 65536
+
+def burn(seconds):
+    t = time.process_time()
+    while time.process_time() - t < seconds:
+        hashlib.sha256(BLOCK).digest()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=200)
+    ap.add_argument("--file-cpu", type=float, default=0.05, help="CPU seconds per file task")
+    ap.add_argument("--usb", type=int, default=4)
+    ap.add_argument("--usb-seconds", type=float, default=2.0, help="blocking seconds per usb task")
+    ap.add_argument("--interactive", type=int, default=50)
+    ap.add_argument("--cpu-cores", type=float, default=0.5)
+    ap.add_argument("--workers", type=int, default=4)
+    args = ap.parse_args()
+
+    s = EventScheduler(workers=args.workers, cpu_share=args.cpu_cores / (os.cpu_count() or 1))
+    s.start()
+    t0, cpu0 = time.monotonic(), time.process_time()
+    for _ in range(args.usb):
+        s.submit("usb", time.sleep, args.usb_seconds)
+    for _ in range(args.files):
+        s.submit("files", burn, args.file_cpu)
+    for _ in range(args.interactive):
+        s.submit("interactive", lambda: None)
+        time.sleep(0.05)
+    s.stop(drain=True, timeout=600)
+    wall, cpu = time.monotonic() - t0, time.process_time() - cpu0
+    print(f"wall {wall:.1f}s  cpu {cpu:.1f}s  = {cpu / wall:.2f} cores (budget {args.cpu_cores})")
+    print(json.dumps(s.stats(), indent=1))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Spool throughput: append (encrypt + write) and drain (read + decrypt) in events/s and MB/s.
+
+    python benchmarks/bench_spool.py --events 50000 --batch-size 200
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from cryptography.fernet import Fernet
+from shared.transport.spool import EventSpool
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=50000)
+    ap.add_argument("--batch-size", type=int, default=200)
+    ap.add_argument("--fsync", action="store_true", help="fsync after every appended batch")
+    args = ap.parse_args()
+    event = {"device_id": "dev-bench", "event_type": "file_created", "file_name": "report.pdf", "sha256": "ab" * 32, "file_path": "/home/user/Downloads/report.pdf"}
+    raw_mb = len(json.dumps(event)) * args.events / 1e6
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = EventSpool(Path(tmp), max_bytes=1 << 40, fsync=args.fsync, key=Fernet.generate_key())
+        batch = [event] * args.batch_size
+        t0 = time.perf_counter()
+        for _ in range(args.events // args.batch_size):
+            spool.append(batch)
+        t_append = time.perf_counter() - t0
+        disk_mb = spool.total_bytes() / 1e6
+        t0 = time.perf_counter()
+        drained = spool.drain(lambda evs: None, batch_size=args.batch_size)
+        t_drain = time.perf_counter() - t0
+        spool.close()
+    print(f"append: {args.events / t_append:10.0f} events/s {raw_mb / t_append:8.1f} MB/s (json), {disk_mb:.1f} MB on disk")
+    print(f"drain:  {drained / t_drain:10.0f} events/s {raw_mb / t_drain:8.1f} MB/s (json)")
+
+if __name__ == "__main__":
+    main()
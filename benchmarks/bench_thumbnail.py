@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Thumbnail generation: legacy full decode + convert + PNG(optimize) vs make_thumbnail presets,
+with per-stage timings. Uses a synthetic photo-sized JPEG and PNG unless --image is given.
+
+    python benchmarks/bench_thumbnail.py --repeat 5
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from PIL import Image
+from shared.processing.thumbnail import THUMBNAIL_PRESETS, make_thumbnail
+
+def legacy(src, dst, size=(512, 512)):
+    img = Image.open(src)
+    img = img.convert("RGB")
+    img.thumbnail(size)
+    img.save(dst, format="PNG", optimize=True)
+
+def sample_images(tmp):
+    img = Image.radial_gradient("L").resize((4032, 3024)).convert("RGB")
+    jpg, png = tmp / "photo.jpg", tmp / "screenshot.png"
+    img.save(jpg, quality=90)
+    img.save(png)
+    return [jpg, png]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--image", type=Path, action="append")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        images = args.image or sample_images(tmp)
+        for src in images:
+            print(f"== {src.name} ({Image.open(src).size[0]}x{Image.open(src).size[1]})")
+            t0 = time.perf_counter()
+            for _ in range(args.repeat):
+                legacy(src, tmp / "legacy.png")
+            print(f"  {'legacy':10} {(time.perf_counter() - t0) / args.repeat * 1000:8.1f} ms")
+            for codec, preset in THUMBNAIL_PRESETS.items():
+                timings = {}
+                t0 = time.perf_counter()
+                for _ in range(args.repeat):
+                    make_thumbnail(src, tmp / f"thumb{preset['ext']}", codec=codec, timings=timings)
+                total = (time.perf_counter() - t0) / args.repeat * 1000
+                stages = " ".join(f"{k}={v / args.repeat * 1000:.1f}" for k, v in timings.items())
+                print(f"  {codec:10} {total:8.1f} ms  [{stages}]")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Peak RSS of the collector's upload path vs upload size.
+Each (mode, size) runs in a fresh interpreter so ru_maxrss is not polluted by earlier runs.
+"buffered" reproduces the old read-everything behaviour, "streaming" is storage.save_upload_async.
+
+    python benchmarks/bench_upload_stream.py --sizes-mb 16 64 256
+"""
+import argparse
+import asyncio
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend" / "fastapi"))
+
+class FakeUpload:
+    """Async read(n) over a generated stream, like starlette's UploadFile."""
+    def __init__(self, size):
+        self.remaining = size
+        self.block = b"x" * (1024 * 1024)
+
+    async def read(self, n=-1):
+        if n < 0:
+            n = self.remaining
+        n = min(n, self.remaining)
+        self.remaining -= n
+        if n <= len(self.block):
+            return self.block[:n]
+        return self.block * (n // len(self.block)) + self.block[:n % len(self.block)]
+
+async def buffered(upload, out_path):
+    import aiofiles
+    async with aiofiles.open(out_path, "wb") as f:
+        content = await upload.read()
+        await f.write(content)
+
+def child(mode, size_mb):
+    from app import storage
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / "upload.bin"
+        upload = FakeUpload(size_mb * 1024 * 1024)
+        if mode == "buffered":
+            asyncio.run(buffered(upload, out))
+        else:
+            asyncio.run(storage.save_upload_async(upload, out))
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes-mb", type=int, nargs="+", default=[16, 64, 256])
+    ap.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        child(args.child[0], int(args.child[1]))
+        return
+    print(f"{'size MB':>8} {'buffered RSS MB':>16} {'streaming RSS MB':>17}")
+    for size in args.sizes_mb:
+        row = []
+        for mode in ("buffered", "streaming"):
+            out = subprocess.run([sys.executable, __file__, "--child", mode, str(size)], capture_output=True, text=True, check=True)
+            row.append(int(out.stdout.strip()) / 1024)  # ru_maxrss is KiB on Linux
+        print(f"{size:>8} {row[0]:>16.1f} {row[1]:>17.1f}")
+
+if __name__ == "__main__":
+    main()
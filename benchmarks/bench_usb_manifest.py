@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+USB bulk copy: per-file events vs one incremental manifest scan.
+Creates --files small files in a temporary "volume", then times
+- per-file: sha256 + one JSON event per file (what handle_file_event sends)
+- manifest: first scan, an unchanged rescan, and a rescan after touching --changed files
+and reports the encoded payload size of each.
+
+    python benchmarks/bench_usb_manifest.py --files 50000 --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from shared.processing.usb_manifest import ManifestScanner, manifest_events
+from shared.processing.hasher import sha256_of_file
+
+def make_volume(root: Path, n: int, size: int):
+    per_dir = 500
+    for i in range(n):
+        d = root / f"dir{i // per_dir:04d}"
+        if i % per_dir == 0:
+            d.mkdir(parents=True, exist_ok=True)
+        (d / f"file{i:06d}.dat").write_bytes(os.urandom(size))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=50000)
+    ap.add_argument("--size", type=int, default=4096)
+    ap.add_argument("--changed", type=int, default=100)
+    ap.add_argument("--workers", type=int, default=4)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        vol, store = Path(tmp) / "vol", Path(tmp) / "store"
+        make_volume(vol, args.files, args.size)
+
+        t0 = time.perf_counter()
+        payload = 0
+        for dirpath, _, names in os.walk(vol):
+            for name in names:
+                p = Path(dirpath) / name
+                ev = {"event_type": "usb_copy", "file_path": str(p), "file_name": name, "size": p.stat().st_size, "sha256": sha256_of_file(p), "destination": "usb"}
+                payload += len(json.dumps(ev))
+        print(f"per-file events   {time.perf_counter() - t0:7.2f}s  {args.files} events, {payload / 1e6:.1f} MB")
+
+        scanner = ManifestScanner(store, workers=args.workers)
+        for label in ("manifest first", "manifest rescan"):
+            scan = scanner.scan(str(vol), "BENCH")
+            events = manifest_events(scan)
+            size = sum(len(json.dumps(e)) for e in events)
+            print(f"{label:17s} {scan['seconds']:7.2f}s  {len(events)} events, {size / 1e6:.1f} MB, {scan['hashed']} hashed")
+        files = sorted(vol.rglob("*.dat"))
+        for p in files[:args.changed]:
+            with p.open("ab") as f:
+                f.write(b"x")
+        scan = scanner.scan(str(vol), "BENCH")
+        events = manifest_events(scan)
+        size = sum(len(json.dumps(e)) for e in events)
+        print(f"{'manifest changed':17s} {scan['seconds']:7.2f}s  {len(events)} events, {size / 1e6:.3f} MB, {scan['hashed']} hashed")
+
+if __name__ == "__main__":
+    main()
@@ -19,11 +19,11 @@ from pathlib import Path
 
 # repo root path insert if running from repo
 ROOT = Path(__file__).resolve().parents[2]
-import os, sys
+import sys
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from shared.utils.crypto import encrypt_json, ensure_key
+from shared.utils.config_manager import ConfigManager
 
 # default server (change to your production URL)
 SERVER = "http://127.0.0.1:8443"
@@ -46,13 +46,8 @@ def get_paths():
 def save_encrypted_config(cfg: dict):
     cfg_dir, cfg_file = get_paths()
     cfg_dir.mkdir(parents=True, exist_ok=True)
-    enc = encrypt_json(cfg)
-    cfg_file.write_bytes(enc)
-    try:
-        if not platform.system().lower().startswith("windows"):
-            os.chmod(str(cfg_file), 0o600)
-    except Exception:
-        pass
+    # atomic write so a running agent never reads a half-written file
+    ConfigManager(cfg_file).save(cfg)
 
 class OnboardingWizard:
     def __init__(self):
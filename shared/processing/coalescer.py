@@ -0,0 +1,171 @@
+"""
+Debounce/coalesce stage between the file watchers and handle_file_event.
+- Callbacks for the same path within `quiet` seconds are merged into one event; a path
+  that keeps changing is still flushed `max_delay` seconds after its first callback
+- Moves re-key the pending entry, so create tmp -> write -> rename becomes one event
+  for the final name, with "renamed_from" set to the first real name in the chain
+- Temp/lock files (.part, .crdownload, ~$x, .~lock.x#, ...) are dropped on arrival
+- Deletes cancel the pending entry instead of producing an event
+- The pending map is bounded; on overflow the oldest entry is flushed early
+
+Watcher events are dicts with "file_path" and optionally "event"
+(created/modified/moved/deleted) and "src_path"/"dest_path" for moves.
+"""
+
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable
+
+logger = logging.getLogger("coalescer")
+
+TEMP_SUFFIXES = (".part", ".partial", ".crdownload", ".download", ".tmp", ".temp", ".swp", ".swx", ".swo", "~")
+TEMP_PREFIXES = ("~$", ".~lock.", ".#")
+
+class EventCoalescer:
+    def __init__(self, handler: Callable[[dict], None], quiet: float = 0.5, max_delay: float = 5.0,
+                 max_pending: int = 10000, temp_suffixes: Iterable[str] = TEMP_SUFFIXES,
+                 temp_prefixes: Iterable[str] = TEMP_PREFIXES):
+        self.handler = handler
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.temp_suffixes = tuple(s.lower() for s in temp_suffixes)
+        self.temp_prefixes = tuple(p.lower() for p in temp_prefixes)
+        self._pending = OrderedDict()  # path -> [event, first_seen, last_seen, count]; insertion = first_seen order
+        self._heap = []                # (deadline, seq, path); stale entries skipped on pop
+        self._ready = []               # flushed early on overflow
+        self._seq = 0
+        self._cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.stats = {"received": 0, "forwarded": 0, "merged": 0, "temp_dropped": 0, "cancelled": 0, "overflow": 0}
+
+    def is_temp(self, path) -> bool:
+        name = os.path.basename(str(path)).lower()
+        return name.endswith(self.temp_suffixes) or name.startswith(self.temp_prefixes)
+
+    def _deadline(self, entry):
+        return min(entry[2] + self.quiet, entry[1] + self.max_delay)
+
+    def _schedule(self, path, entry):
+        self._seq += 1
+        heapq.heappush(self._heap, (self._deadline(entry), self._seq, path))
+
+    def submit(self, ev: dict):
+        now = time.monotonic()
+        kind = ev.get("event")
+        src = ev.get("src_path")
+        path = ev.get("dest_path") or ev.get("file_path")
+        if path is None:
+            return
+        path = str(path)
+        with self._cond:
+            self.stats["received"] += 1
+            if kind == "deleted":
+                if self._pending.pop(path, None) is not None:
+                    self.stats["cancelled"] += 1
+                return
+            prev = None
+            renamed_from = None
+            if src is not None and str(src) != path:
+                src = str(src)
+                prev = self._pending.pop(src, None)
+                if prev is not None:
+                    renamed_from = prev[0].get("renamed_from")
+                if renamed_from is None and not self.is_temp(src):
+                    renamed_from = src
+            if self.is_temp(path):
+                self.stats["temp_dropped"] += 1
+                return
+            entry = self._pending.get(path) or prev
+            if entry is not None:
+                self.stats["merged"] += 1
+                merged = dict(entry[0])
+                merged.update(ev)
+                entry = [merged, entry[1], now, entry[3] + 1]
+            else:
+                entry = [dict(ev), now, now, 1]
+            entry[0]["file_path"] = path
+            entry[0].pop("src_path", None)
+            entry[0].pop("dest_path", None)
+            if renamed_from is not None:
+                entry[0]["renamed_from"] = renamed_from
+            if path not in self._pending and len(self._pending) >= self.max_pending:
+                old_path, old = self._pending.popitem(last=False)
+                self._ready.append(self._finish(old))
+                self.stats["overflow"] += 1
+            self._pending[path] = entry
+            self._schedule(path, entry)
+            self._cond.notify()
+
+    def _finish(self, entry):
+        ev = entry[0]
+        if entry[3] > 1:
+            ev["coalesced"] = entry[3]
+        return ev
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def _take_due(self):
+        """Block until something is due; return the events to hand over."""
+        with self._cond:
+            while self.running:
+                if self._ready:
+                    break
+                now = time.monotonic()
+                while self._heap:
+                    deadline, _, path = self._heap[0]
+                    entry = self._pending.get(path)
+                    if entry is None or self._deadline(entry) != deadline:
+                        heapq.heappop(self._heap)  # superseded by a later callback
+                        continue
+                    break
+                if self._heap and self._heap[0][0] <= now:
+                    break
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+            out, self._ready = self._ready, []
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, path = heapq.heappop(self._heap)
+                entry = self._pending.get(path)
+                if entry is not None and self._deadline(entry) == deadline:
+                    del self._pending[path]
+                    out.append(self._finish(entry))
+            return out
+
+    def _deliver(self, events):
+        for ev in events:
+            self.stats["forwarded"] += 1
+            try:
+                self.handler(ev)
+            except Exception:
+                logger.exception("coalesced event handler failed")
+
+    def _run(self):
+        while self.running:
+            self._deliver(self._take_due())
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="event-coalescer", daemon=True)
+        self.thread.start()
+
+    def stop(self, flush: bool = True, timeout: float = 5.0):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+        if flush:
+            with self._cond:
+                events = self._ready + [self._finish(e) for e in self._pending.values()]
+                self._ready, self._pending, self._heap = [], OrderedDict(), []
+            self._deliver(events)
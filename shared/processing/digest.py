@@ -0,0 +1,89 @@
+"""
+Single-pass digest pipeline.
+- Reads each file once (mmap above MMAP_THRESHOLD) and feeds every requested hashlib
+  digest plus an optional ssdeep fuzzy hash from the same buffer
+- Images are decoded once and used for both the phash and the thumbnail
+- FilePipeline.handle_file_event calls it on the scheduler lanes for files below the
+  full-hash threshold; larger ones take the deferred, rate-limited sha256_of_file path
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+from PIL import Image
+
+from shared.processing import hash_cache
+from shared.processing.phash import phash_from_image
+from shared.processing.thumbnail import thumbnail_from_image
+
+try:
+    import ssdeep
+except ImportError:  # optional: fuzzy hashing only when the extension is installed
+    ssdeep = None
+
+logger = logging.getLogger("digest")
+
+MMAP_THRESHOLD = 16 * 1024 * 1024
+CHUNK_SIZE = 4 * 1024 * 1024
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".bmp", ".gif", ".webp", ".tif", ".tiff"}
+
+def _feed(hashers, fuzzy, block):
+    for h in hashers.values():
+        h.update(block)
+    if fuzzy is not None:
+        fuzzy.update(bytes(block))
+
+def _image_digests(fp, result, thumbnail_dst, thumbnail_size, thumbnail_codec):
+    try:
+        img = Image.open(fp)
+        img.load()
+        result["phash"] = phash_from_image(img)
+        if thumbnail_dst is not None:
+            result["thumbnail_path"] = str(thumbnail_from_image(img, Path(thumbnail_dst), thumbnail_size, codec=thumbnail_codec))
+    except Exception:
+        logger.exception("image decode failed")
+
+def digest_file(path: Path, algorithms: Iterable[str] = ("sha256",), image: Optional[bool] = None, thumbnail_dst: Optional[Path] = None, thumbnail_size=(512, 512), thumbnail_codec: str = "png") -> dict:
+    """Return {"size", <algorithm>: hexdigest..., ["ssdeep"], ["phash"], ["thumbnail_path"]}."""
+    path = Path(path)
+    algorithms = list(algorithms)
+    hashers = {a: hashlib.new(a) for a in algorithms if a != "ssdeep"}
+    fuzzy = ssdeep.Hash() if "ssdeep" in algorithms and ssdeep is not None else None
+    if image is None:
+        image = path.suffix.lower() in IMAGE_EXTS
+    with path.open("rb") as f:
+        st = os.fstat(f.fileno())
+        result = {"size": st.st_size}
+        if st.st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for off in range(0, st.st_size, CHUNK_SIZE):
+                        _feed(hashers, fuzzy, view[off:off + CHUNK_SIZE])
+                finally:
+                    view.release()
+                if image:
+                    mm.seek(0)
+                    _image_digests(mm, result, thumbnail_dst, thumbnail_size, thumbnail_codec)
+        else:
+            data = f.read()
+            _feed(hashers, fuzzy, data)
+            if image:
+                f.seek(0)
+                _image_digests(f, result, thumbnail_dst, thumbnail_size, thumbnail_codec)
+    for name, h in hashers.items():
+        result[name] = h.hexdigest()
+    if fuzzy is not None:
+        result["ssdeep"] = fuzzy.digest()
+    cache = hash_cache.default_cache()
+    if cache is not None:
+        after = os.stat(path)
+        if (after.st_ino, after.st_size, after.st_mtime_ns) == (st.st_ino, st.st_size, st.st_mtime_ns):
+            for kind in ("sha256", "phash"):
+                if result.get(kind):
+                    cache.put(st, kind, result[kind])
+    return result
@@ -0,0 +1,101 @@
+"""
+Persistent LRU cache of per-file digests (sha256, phash, ...) in a local SQLite table.
+A row is keyed by (device, inode, kind) and is only served while the file's size and
+mtime_ns still match, so unchanged files are never re-read. A hit only rewrites last_used
+once it is TOUCH_INTERVAL old: eviction order is that coarse, and a hit is a read, not a write.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+TOUCH_INTERVAL = 3600
+
+class HashCache:
+    def __init__(self, db_path: Path, max_entries: int = 200000):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " dev INTEGER, ino INTEGER, kind TEXT, size INTEGER, mtime_ns INTEGER,"
+            " value TEXT, last_used REAL, PRIMARY KEY (dev, ino, kind))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_hashes_last_used ON hashes(last_used)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def get(self, st: os.stat_result, kind: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, last_used FROM hashes WHERE dev=? AND ino=? AND kind=? AND size=? AND mtime_ns=?",
+                (st.st_dev, st.st_ino, kind, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            now = time.time()
+            if now - (row[1] or 0) >= TOUCH_INTERVAL:
+                self._conn.execute("UPDATE hashes SET last_used=? WHERE dev=? AND ino=? AND kind=?", (now, st.st_dev, st.st_ino, kind))
+            return row[0]
+
+    def put(self, st: os.stat_result, kind: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hashes (dev, ino, kind, size, mtime_ns, value, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, kind, st.st_size, st.st_mtime_ns, value, time.time()),
+            )
+            # replaced rows over-count; recount only once we might be over the limit
+            self._count += 1
+            if self._count > self.max_entries:
+                self._count = self._conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+                if self._count > self.max_entries:
+                    self._evict()
+
+    def _evict(self):
+        # evict ~10% at a time so the delete cost is amortised over many inserts
+        n = max(self._count - self.max_entries, self.max_entries // 10, 1)
+        cur = self._conn.execute("DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY last_used LIMIT ?)", (n,))
+        self._count -= cur.rowcount
+        self.stats["evictions"] += cur.rowcount
+
+    def get_or_compute(self, path: Path, kind: str, compute: Callable[[Path], Optional[str]]) -> Optional[str]:
+        st = os.stat(path)
+        value = self.get(st, kind)
+        if value is not None:
+            return value
+        value = compute(path)
+        if value is None:
+            return None
+        after = os.stat(path)
+        # don't cache a digest of a file that changed while we were reading it
+        if (after.st_ino, after.st_size, after.st_mtime_ns) == (st.st_ino, st.st_size, st.st_mtime_ns):
+            self.put(st, kind, value)
+        return value
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_default = None
+
+def configure(db_path: Path, max_entries: int = 200000) -> HashCache:
+    """Install the process-wide cache used by sha256_of_file / compute_phash."""
+    global _default
+    _default = HashCache(db_path, max_entries=max_entries)
+    return _default
+
+def default_cache() -> Optional[HashCache]:
+    return _default
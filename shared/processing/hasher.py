@@ -1,12 +1,152 @@
+"""
+File hashing for events.
+- sha256_of_file: full SHA-256 through the hash cache, optionally rate-limited
+- sampled_fingerprint: cheap identity for very large files (size + head, tail and
+  strided blocks), computed in a few ms regardless of file size
+- deferred_full_hash(): inside this context sha256_of_file skips files at or above
+  the threshold and records them instead, so an event can be built immediately and
+  its full SHA-256 computed later by a throttled background job
+- Reads go through readinto() on one reusable buffer per thread (or mmap), with
+  O_NOATIME and a sequential-access hint where the OS supports them; hash_files()
+  hashes a list of files on a thread pool, one buffer per worker
+"""
+
 import hashlib
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from shared.processing import hash_cache
+
+SAMPLE_BLOCK = 128 * 1024
+SAMPLE_BLOCKS = 32
+FINGERPRINT_PREFIX = "sfp1:"
+
+CHUNK_SIZE = 4 * 1024 * 1024
+# readinto is the default: mmap is faster on large files but a file truncated while mapped
+# (USB stick pulled, download restarted) raises SIGBUS instead of a catchable error
+HASH_METHODS = ("readinto", "mmap", "read")
 
-def sha256_of_file(path: Path, chunk_size: int = 4 * 1024 * 1024) -> str:
+_local = threading.local()
+_noatime = getattr(os, "O_NOATIME", 0)
+
+def _open(path: Path):
+    """Unbuffered read-only file with O_NOATIME (owner only, else retried without) and a sequential hint."""
+    flags = os.O_RDONLY | getattr(os, "O_BINARY", 0)
+    try:
+        fd = os.open(path, flags | _noatime)
+    except PermissionError:
+        if not _noatime:
+            raise
+        fd = os.open(path, flags)
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+    return os.fdopen(fd, "rb", buffering=0)
+
+def _buffer(size: int) -> memoryview:
+    """This thread's reusable read buffer."""
+    buf = getattr(_local, "buf", None)
+    if buf is None or len(buf) != size:
+        buf = _local.buf = memoryview(bytearray(size))
+    return buf
+
+def _sha256(path: Path, chunk_size: int, bytes_per_sec: Optional[float] = None, method: str = "readinto") -> str:
     h = hashlib.sha256()
-    with path.open("rb") as f:
+    start = time.monotonic()
+    done = 0
+    with _open(path) as f:
+        if method == "mmap" and not bytes_per_sec:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if hasattr(mm, "madvise"):
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    view = memoryview(mm)
+                    try:
+                        for off in range(0, size, chunk_size):
+                            h.update(view[off:off + chunk_size])
+                    finally:
+                        view.release()
+            return h.hexdigest()
+        buf = _buffer(chunk_size) if method != "read" else None
         while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
+            if buf is None:
+                chunk = f.read(chunk_size)
+                n = len(chunk)
+            else:
+                n = f.readinto(buf)
+                chunk = buf[:n]
+            if not n:
                 break
             h.update(chunk)
+            if bytes_per_sec:
+                done += n
+                ahead = done / bytes_per_sec - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
     return h.hexdigest()
+
+def sha256_of_file(path: Path, chunk_size: int = CHUNK_SIZE, cache: Optional[hash_cache.HashCache] = None, bytes_per_sec: Optional[float] = None, method: str = "readinto") -> Optional[str]:
+    path = Path(path)
+    deferred = getattr(_local, "deferred", None)
+    if deferred is not None and path.stat().st_size >= deferred["threshold"]:
+        deferred["paths"].append(path)
+        return None
+    cache = cache or hash_cache.default_cache()
+    if cache is None:
+        return _sha256(path, chunk_size, bytes_per_sec, method)
+    return cache.get_or_compute(path, "sha256", lambda p: _sha256(p, chunk_size, bytes_per_sec, method))
+
+def hash_files(paths: Iterable[Path], workers: int = 4, chunk_size: int = CHUNK_SIZE, method: str = "readinto") -> Dict[str, Optional[str]]:
+    """{path: sha256 or None if unreadable}; each worker thread reuses one read buffer."""
+    paths = [Path(p) for p in paths]
+
+    def one(p):
+        try:
+            return sha256_of_file(p, chunk_size=chunk_size, method=method)
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hasher") as pool:
+        return {str(p): digest for p, digest in zip(paths, pool.map(one, paths))}
+
+def _fingerprint(path: Path, block: int, blocks: int) -> str:
+    h = hashlib.sha256()
+    with _open(path) as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(size.to_bytes(8, "little"))
+        if size <= block * (blocks + 2):
+            h.update(f.read())
+        else:
+            # head, `blocks` evenly spaced interior blocks, tail
+            stride = (size - block) // (blocks + 1)
+            for i in range(blocks + 2):
+                f.seek(size - block if i == blocks + 1 else i * stride)
+                h.update(f.read(block))
+    return FINGERPRINT_PREFIX + h.hexdigest()
+
+def sampled_fingerprint(path: Path, block: int = SAMPLE_BLOCK, blocks: int = SAMPLE_BLOCKS, cache: Optional[hash_cache.HashCache] = None) -> str:
+    """Not a content hash: equal fingerprints mean "very likely the same file", nothing more."""
+    path = Path(path)
+    cache = cache or hash_cache.default_cache()
+    if cache is None:
+        return _fingerprint(path, block, blocks)
+    return cache.get_or_compute(path, "sfp", lambda p: _fingerprint(p, block, blocks))
+
+@contextmanager
+def deferred_full_hash(threshold: int):
+    """Yields the list of paths whose full hash was skipped in this thread."""
+    prev = getattr(_local, "deferred", None)
+    _local.deferred = {"threshold": threshold, "paths": []}
+    try:
+        yield _local.deferred["paths"]
+    finally:
+        _local.deferred = prev
@@ -1,15 +1,26 @@
 from PIL import Image
 import imagehash
 from pathlib import Path
+from typing import Optional
 import logging
 
+from shared.processing import hash_cache
+
 logger = logging.getLogger("phash")
 
-def compute_phash(path: Path):
+def phash_from_image(img: Image.Image) -> str:
+    return str(imagehash.phash(img.convert("RGB")))
+
+def _phash(path: Path):
     try:
-        img = Image.open(path).convert("RGB")
-        ph = imagehash.phash(img)
-        return str(ph)
+        return phash_from_image(Image.open(path))
     except Exception:
         logger.exception("compute_phash failed")
         return None
+
+def compute_phash(path: Path, cache: Optional[hash_cache.HashCache] = None):
+    path = Path(path)
+    cache = cache or hash_cache.default_cache()
+    if cache is None:
+        return _phash(path)
+    return cache.get_or_compute(path, "phash", _phash)
@@ -0,0 +1,193 @@
+"""
+File-event pipeline shared by the Linux and Windows agents.
+- tagged(source) is the watcher callback: events are marked with their source and fed
+  to the EventCoalescer
+- each settled change is dispatched to its EventScheduler lane (usb, screenshot, files);
+  files of a mass copy to a removable volume are absorbed by the BulkCopyDetector and
+  covered by one ManifestScanner run instead
+- handle_file_event reads the file once through digest_file (sha256, and the phash of an
+  image from the same decode) and builds the event on the warm hash cache, applies the
+  compiled policy and queues it; very large files go out with a sampled fingerprint and
+  complete_full_hash sends the full sha256 later from the deferred lane
+- the thumbnail of an image comes from that same decode and is uploaded from the deferred
+  lane once the event has reached the collector (/thumbnail_ref when the collector already
+  has it, else /thumbnail)
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+from shared.processing.coalescer import EventCoalescer
+from shared.processing.digest import digest_file
+from shared.processing.hasher import deferred_full_hash, sampled_fingerprint, sha256_of_file
+from shared.processing.metadata import build_event_for_file
+from shared.processing.thumbnail import THUMBNAIL_PRESETS
+from shared.processing.usb_manifest import BulkCopyDetector, ManifestScanner, manifest_events
+
+logger = logging.getLogger("pipeline")
+
+# coalesced file events -> scheduler lane; anything untagged is a plain watcher event
+SOURCE_LANES = {"usb": "usb", "screenshot": "screenshot"}
+FULL_HASH_RETRIES = 5
+THUMBNAIL_RETRIES = 5
+# seconds before the first thumbnail upload; the event goes out through the EventQueue first
+THUMBNAIL_DELAY = 10
+
+class FilePipeline:
+    def __init__(self, cfg: dict, load_config: Callable[[], dict], policy_index, scheduler, event_queue, sender,
+                 manifest_dir: Path, thumbnail_dir: Optional[Path] = None, foreground: Callable[[], object] = lambda: None):
+        self.load_config = load_config
+        self.policy_index = policy_index
+        self.scheduler = scheduler
+        self.event_queue = event_queue
+        self.sender = sender
+        self.foreground = foreground
+        self.thumbnail_dir = thumbnail_dir
+        self.stats = {"full_hash_dropped": 0, "thumbnails_uploaded": 0, "thumbnails_dropped": 0}
+        self.manifest_scanner = ManifestScanner(manifest_dir, workers=cfg.get("usb_manifest_workers", 4))
+        self.usb_bulk = BulkCopyDetector(lambda root, serial: scheduler.submit("usb", self.run_usb_manifest, root, serial), threshold=cfg.get("usb_bulk_threshold", 200), window=cfg.get("usb_bulk_window_seconds", 10.0), settle=cfg.get("usb_bulk_settle_seconds", 5.0))
+        self.coalescer = EventCoalescer(self.dispatch_file_event, quiet=cfg.get("coalesce_quiet_seconds", 0.5), max_delay=cfg.get("coalesce_max_delay_seconds", 5.0), max_pending=cfg.get("coalesce_max_pending", 10000))
+
+    def start(self):
+        if self.thumbnail_dir is not None and self.thumbnail_dir.exists():
+            # left over from before a restart; their upload timers are gone
+            for f in self.thumbnail_dir.iterdir():
+                f.unlink(missing_ok=True)
+        self.usb_bulk.start()
+        self.coalescer.start()
+
+    def stop(self):
+        self.coalescer.stop()
+        self.usb_bulk.stop()
+
+    def tagged(self, source):
+        """Watcher callback that marks its events with the source they came from."""
+        return lambda ev: self.coalescer.submit({**ev, "source": source})
+
+    def dispatch_file_event(self, ev):
+        lane = SOURCE_LANES.get(ev.get("source"), "files")
+        # files of a mass copy to a removable volume are covered by one manifest scan instead
+        if lane == "usb" and self.usb_bulk.observe(ev):
+            return
+        if not self.scheduler.submit(lane, self.handle_file_event, ev):
+            logger.warning("%s lane full, dropped event for %s", lane, ev.get("file_path"))
+
+    def handle_file_event(self, ev):
+        try:
+            cfg = self.load_config()
+            p = Path(ev.get("file_path"))
+            if not p.exists():
+                return
+            threshold = cfg.get("full_hash_threshold_mb", 256) * 1024 * 1024
+            digest = {}
+            if p.stat().st_size < threshold:
+                # one read for every hash; digest_file puts sha256/phash into the hash cache, so
+                # build_event_for_file's sha256_of_file/compute_phash calls are cache hits
+                digest = digest_file(p, thumbnail_dst=self.thumbnail_path(cfg), thumbnail_codec=cfg.get("thumbnail_codec", "png"))
+            # files at or above full_hash_threshold_mb are sent with a sampled fingerprint; the full sha256 follows
+            with deferred_full_hash(threshold) as deferred:
+                event = build_event_for_file(p, device_id=cfg.get("device_id"), user_email=cfg.get("employee_email"), app=ev.get("app", "unknown"), destination=ev.get("destination"))
+            for k in ("sha256", "phash"):
+                if digest.get(k):
+                    event[k] = digest[k]
+            if deferred or digest.get("thumbnail_path"):
+                event["event_id"] = event.get("event_id") or f"evt-{uuid.uuid4().hex[:12]}"
+            if deferred:
+                event["sampled_fingerprint"] = sampled_fingerprint(p)
+                event["sha256_pending"] = True
+                self.queue_full_hash(event["event_id"], p, event["sampled_fingerprint"])
+            event["foreground_process"] = self.foreground()
+            # set by the coalescer when several watcher callbacks collapsed into this event
+            for k in ("renamed_from", "coalesced"):
+                if k in ev:
+                    event[k] = ev[k]
+            event["policy_decision"] = self.policy_index.current.decide(p, scan=True)
+            logger.info("File event: %s", event.get("file_name"))
+            self.event_queue.submit(event)
+            if digest.get("thumbnail_path"):
+                threading.Timer(THUMBNAIL_DELAY, self.queue_thumbnail, args=(event["event_id"], Path(digest["thumbnail_path"]))).start()
+        except Exception:
+            logger.exception("handle_file_event failed")
+
+    def thumbnail_path(self, cfg) -> Optional[Path]:
+        """Where digest_file writes the thumbnail of an image, None when thumbnails are off."""
+        if self.thumbnail_dir is None or not cfg.get("upload_thumbnails", True):
+            return None
+        return self.thumbnail_dir / f"{uuid.uuid4().hex}{THUMBNAIL_PRESETS[cfg.get('thumbnail_codec', 'png')]['ext']}"
+
+    def queue_full_hash(self, event_id, path, fingerprint, attempt=0):
+        """Put complete_full_hash on the deferred lane; a full lane is retried later, not dropped silently."""
+        if self.scheduler.submit("deferred", self.complete_full_hash, event_id, path, fingerprint, attempt):
+            return
+        if attempt < FULL_HASH_RETRIES:
+            threading.Timer(60 * (attempt + 1), self.queue_full_hash, args=(event_id, path, fingerprint, attempt + 1)).start()
+        else:
+            # the collector keeps this event sha256_pending
+            self.stats["full_hash_dropped"] += 1
+            logger.warning("deferred lane full, gave up on the full hash of %s (%s)", path, event_id)
+
+    def complete_full_hash(self, event_id, path, fingerprint, attempt=0):
+        try:
+            cfg = self.load_config()
+            if not path.exists() or sampled_fingerprint(path) != fingerprint:
+                return
+            rate = cfg.get("full_hash_mb_per_sec", 50)
+            sha256 = sha256_of_file(path, bytes_per_sec=rate * 1024 * 1024 if rate else None)
+            if self.sender.complete_event_hash(event_id, sha256, fingerprint):
+                return
+            # the event itself has not reached the collector yet; the hash is cached, so a retry is cheap
+            if attempt < FULL_HASH_RETRIES:
+                threading.Timer(60 * (attempt + 1), self.queue_full_hash, args=(event_id, path, fingerprint, attempt + 1)).start()
+        except Exception:
+            logger.exception("complete_full_hash failed")
+
+    def queue_thumbnail(self, event_id, path, attempt=0):
+        if self.scheduler.submit("deferred", self.upload_thumbnail, event_id, path, attempt):
+            return
+        if attempt < THUMBNAIL_RETRIES:
+            threading.Timer(60 * (attempt + 1), self.queue_thumbnail, args=(event_id, path, attempt + 1)).start()
+        else:
+            self.drop_thumbnail(event_id, path)
+
+    def upload_thumbnail(self, event_id, path, attempt=0):
+        try:
+            if self.sender.upload_thumbnail(event_id, str(path)) is not None:
+                self.stats["thumbnails_uploaded"] += 1
+                path.unlink(missing_ok=True)
+                return
+        except Exception:
+            logger.exception("upload_thumbnail failed")
+        # the event has not reached the collector yet, or the collector is unreachable
+        if attempt < THUMBNAIL_RETRIES:
+            threading.Timer(60 * (attempt + 1), self.queue_thumbnail, args=(event_id, path, attempt + 1)).start()
+        else:
+            self.drop_thumbnail(event_id, path)
+
+    def drop_thumbnail(self, event_id, path):
+        self.stats["thumbnails_dropped"] += 1
+        logger.warning("gave up on the thumbnail of %s", event_id)
+        path.unlink(missing_ok=True)
+
+    def run_usb_manifest(self, root, serial):
+        try:
+            cfg = self.load_config()
+            scan = self.manifest_scanner.scan(root, serial)
+            events = manifest_events(scan, device_id=cfg.get("device_id"), user_email=cfg.get("employee_email"), chunk=cfg.get("usb_manifest_chunk", 5000))
+            for event in events:
+                self.event_queue.submit(event)
+            logger.info("USB manifest %s: %d files, %d added, %d changed, %d removed, %d hashed in %.1fs", serial, len(scan["files"]), len(scan["added"]), len(scan["changed"]), len(scan["removed"]), scan["hashed"], scan["seconds"])
+        except Exception:
+            logger.exception("run_usb_manifest failed")
+
+    def log_stats(self, interval=300):
+        while True:
+            time.sleep(interval)
+            logger.info("scheduler stats: %s", json.dumps(self.scheduler.stats()))
+            logger.info("coalescer stats: %s", json.dumps(self.coalescer.stats))
+            logger.info("usb bulk stats: %s", json.dumps(self.usb_bulk.stats))
+            logger.info("pipeline stats: %s", json.dumps(self.stats))
@@ -0,0 +1,86 @@
+"""
+Agent-side compiled policy.
+The JSON from /api/v1/policy is compiled once into frozensets, a path-prefix trie and a
+ContentScanner; PolicyIndex.swap() replaces the whole compiled object in a single reference
+assignment, so event threads always see either the old or the new policy, never a mix.
+"""
+
+import os
+from pathlib import Path
+from typing import Optional
+
+from shared.processing.scanner import ContentScanner
+
+_CASE_INSENSITIVE = os.name == "nt"
+
+def _parts(path) -> tuple:
+    s = os.path.expanduser(str(path))
+    if _CASE_INSENSITIVE:
+        s = s.lower()
+    return Path(s).parts
+
+class PrefixTrie:
+    """Longest-prefix match over path components."""
+    def __init__(self, prefixes: dict):
+        self._root = {}
+        for prefix, value in prefixes.items():
+            node = self._root
+            for part in _parts(prefix):
+                node = node.setdefault(part, {})
+            node[None] = value
+
+    def longest(self, path) -> Optional[str]:
+        node = self._root
+        found = node.get(None)
+        for part in _parts(path):
+            node = node.get(part)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+class CompiledPolicy:
+    __slots__ = ("version", "allowed_ext", "blocked_ext", "paths", "scanner")
+
+    def __init__(self, policy: dict, version=None):
+        self.version = version if version is not None else policy.get("version")
+        self.allowed_ext = frozenset(e.lower() for e in policy.get("allowed_extensions", []))
+        self.blocked_ext = frozenset(e.lower() for e in policy.get("blocked_extensions", []))
+        prefixes = {p: "block" for p in policy.get("blocked_path_prefixes", [])}
+        prefixes.update({p: "allow" for p in policy.get("allowed_path_prefixes", [])})
+        self.paths = PrefixTrie(prefixes)
+        self.scanner = ContentScanner.from_policy(policy) if policy.get("sensitive_patterns") else None
+
+    def decide(self, path, scan: bool = False) -> dict:
+        """Return {"decision": "allow"|"block"|"monitor", "reason": ...}."""
+        ext = os.path.splitext(str(path))[1].lower()
+        if ext in self.blocked_ext:
+            return {"decision": "block", "reason": "blocked_extension"}
+        rule = self.paths.longest(path)
+        if rule == "block":
+            return {"decision": "block", "reason": "blocked_path"}
+        if scan and self.scanner is not None:
+            try:
+                res = self.scanner.scan_file(Path(path))
+            except OSError:
+                res = None
+            if res and res["matches"]:
+                return {"decision": "block", "reason": "sensitive_content", "pattern": res["matches"][0]["pattern"]}
+        if rule == "allow":
+            return {"decision": "allow", "reason": "allowed_path"}
+        if ext in self.allowed_ext:
+            return {"decision": "allow", "reason": "allowed_extension"}
+        return {"decision": "monitor", "reason": "default"}
+
+class PolicyIndex:
+    def __init__(self, policy: Optional[dict] = None):
+        self._current = CompiledPolicy(policy or {})
+
+    @property
+    def current(self) -> CompiledPolicy:
+        return self._current
+
+    def swap(self, policy: dict, version=None) -> CompiledPolicy:
+        compiled = CompiledPolicy(policy, version)
+        self._current = compiled
+        return compiled
@@ -0,0 +1,208 @@
+"""
+Agent-side event processing scheduler.
+- A fixed pool of worker threads (hashing, phash and thumbnailing release the GIL in
+  hashlib/PIL, so threads are enough)
+- Named lanes with a priority, a bounded queue and a concurrency cap, so one slow lane
+  (a multi-GB hash off a USB stick) can never occupy every worker; workers for the
+  unthrottled (interactive) lanes are held in reserve
+- A CPU budget: once the agent process has used more than cpu_share of the machine
+  over the last window, throttled lanes wait; unthrottled lanes (interactive events)
+  always run. An optional disk IO budget works the same way via psutil
+- stats() reports queue depth, running tasks and wait/run latency per lane
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger("scheduler")
+
+# lower priority value runs first
+DEFAULT_LANES = {
+    "interactive": {"priority": 0, "concurrency": 2, "max_queue": 1000, "throttle": False},
+    "screenshot": {"priority": 1, "concurrency": 1, "max_queue": 1000},
+    "usb": {"priority": 2, "concurrency": 2, "max_queue": 20000},
+    "files": {"priority": 3, "concurrency": 2, "max_queue": 20000},
+    # full hashes of very large files, deferred behind everything else
+    "deferred": {"priority": 4, "concurrency": 1, "max_queue": 10000},
+}
+LATENCY_SAMPLES = 1024
+
+class Lane:
+    __slots__ = ("name", "priority", "concurrency", "max_queue", "throttle", "queue", "running",
+                 "submitted", "completed", "failed", "dropped", "waits", "runs")
+
+    def __init__(self, name: str, priority: int = 10, concurrency: int = 1, max_queue: int = 10000, throttle: bool = True):
+        self.name = name
+        self.priority = priority
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.throttle = throttle
+        self.queue = deque()
+        self.running = 0
+        self.submitted = self.completed = self.failed = self.dropped = 0
+        self.waits = deque(maxlen=LATENCY_SAMPLES)
+        self.runs = deque(maxlen=LATENCY_SAMPLES)
+
+def _pct(samples, q):
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+class _Budget:
+    """Average rate of a monotonically increasing counter over a rolling window."""
+    def __init__(self, read: Callable[[], float], limit: float, window: float):
+        self.read = read
+        self.limit = limit
+        self.window = window
+        self._t = time.monotonic()
+        self._v = read()
+
+    def delay(self) -> float:
+        """Seconds to wait until the window average is back under the limit (0 = go)."""
+        now = time.monotonic()
+        v = self.read()
+        used, elapsed = v - self._v, now - self._t
+        if elapsed >= self.window:
+            self._t, self._v = now, v
+        return max(0.0, used / self.limit - elapsed)
+
+def _io_bytes(proc):
+    c = proc.io_counters()
+    return float(c.read_bytes + c.write_bytes)
+
+class EventScheduler:
+    def __init__(self, lanes: Optional[Dict[str, dict]] = None, workers: int = 4, cpu_share: float = 0.25,
+                 io_bytes_per_sec: Optional[float] = None, budget_window: float = 1.0):
+        self.lanes = {name: Lane(name, **opts) for name, opts in (lanes or DEFAULT_LANES).items()}
+        self._order = sorted(self.lanes.values(), key=lambda l: l.priority)
+        self.workers = workers
+        # workers held back for unthrottled lanes, so bulk lanes can never occupy all of them
+        self.reserve = min(workers - 1, sum(l.concurrency for l in self._order if not l.throttle))
+        self._bulk_running = 0
+        self._budgets = []
+        if cpu_share:
+            # process_time() counts every thread of the agent, not just scheduler tasks
+            self._budgets.append(_Budget(time.process_time, cpu_share * (os.cpu_count() or 1), budget_window))
+        if io_bytes_per_sec:
+            try:
+                proc = psutil.Process()
+                proc.io_counters()
+                self._budgets.append(_Budget(lambda: _io_bytes(proc), io_bytes_per_sec, budget_window))
+            except Exception:
+                logger.warning("io budget unavailable (psutil missing or no io_counters on this platform)")
+        self._cond = threading.Condition()
+        self._threads = []
+        self.running = False
+        self._drain = False
+        self.throttled = 0
+
+    def submit(self, lane: str, fn: Callable, *args, **kwargs) -> bool:
+        """Queue fn(*args, **kwargs) on a lane. Returns False (and counts a drop) if the lane is full."""
+        l = self.lanes[lane]
+        with self._cond:
+            if len(l.queue) >= l.max_queue:
+                l.dropped += 1
+                return False
+            l.queue.append((time.monotonic(), fn, args, kwargs))
+            l.submitted += 1
+            self._cond.notify()
+        return True
+
+    def _budget_delay(self) -> float:
+        return max((b.delay() for b in self._budgets), default=0.0)
+
+    def _pick(self):
+        """(lane, None) to run, or (None, seconds to wait / None for indefinitely)."""
+        delay = None
+        for lane in self._order:
+            if not lane.queue or lane.running >= lane.concurrency:
+                continue
+            if lane.throttle:
+                if self._bulk_running >= self.workers - self.reserve:
+                    continue
+                if delay is None:
+                    delay = self._budget_delay()
+                if delay > 0:
+                    continue
+            return lane, None
+        return None, (min(max(delay, 0.01), 1.0) if delay else None)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                lane = None
+                while self.running or self._drain:
+                    lane, wait = self._pick()
+                    if lane is not None:
+                        break
+                    if self._drain and not any(l.queue for l in self._order):
+                        return
+                    if wait:
+                        self.throttled += 1
+                    self._cond.wait(wait)
+                if lane is None:
+                    return
+                queued_at, fn, args, kwargs = lane.queue.popleft()
+                lane.running += 1
+                self._bulk_running += lane.throttle
+            start = time.monotonic()
+            ok = True
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                ok = False
+                logger.exception("task on lane %s failed", lane.name)
+            end = time.monotonic()
+            with self._cond:
+                lane.running -= 1
+                self._bulk_running -= lane.throttle
+                lane.completed += 1
+                lane.failed += 0 if ok else 1
+                lane.waits.append(start - queued_at)
+                lane.runs.append(end - start)
+                self._cond.notify_all()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"event-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, drain: bool = True, timeout: float = 30.0):
+        """Stop the workers; with drain, queued tasks still run first (budgets still apply)."""
+        with self._cond:
+            self._drain = drain
+            self.running = False
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+        with self._cond:
+            self._drain = False
+
+    def depth(self) -> int:
+        with self._cond:
+            return sum(len(l.queue) for l in self._order)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"throttled_waits": self.throttled, "lanes": {l.name: {
+                "queued": len(l.queue), "running": l.running, "submitted": l.submitted,
+                "completed": l.completed, "failed": l.failed, "dropped": l.dropped,
+                "wait_p50_ms": round(_pct(l.waits, 0.5) * 1e3, 1), "wait_p95_ms": round(_pct(l.waits, 0.95) * 1e3, 1),
+                "run_p50_ms": round(_pct(l.runs, 0.5) * 1e3, 1), "run_p95_ms": round(_pct(l.runs, 0.95) * 1e3, 1),
+            } for l in self._order}}
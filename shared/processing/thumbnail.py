@@ -1,10 +1,50 @@
 from PIL import Image
 from pathlib import Path
+import logging
+import time
 
-def make_thumbnail(src: Path, dst: Path, size=(512,512)):
-    img = Image.open(src)
-    img = img.convert("RGB")
-    img.thumbnail(size)
+logger = logging.getLogger("thumbnail")
+
+# output codecs; "png-small" keeps the old optimize=True output for when size matters more than CPU
+THUMBNAIL_PRESETS = {
+    "png": {"format": "PNG", "ext": ".png", "params": {"compress_level": 1}},
+    "png-small": {"format": "PNG", "ext": ".png", "params": {"optimize": True}},
+    "webp": {"format": "WEBP", "ext": ".webp", "params": {"quality": 80, "method": 4}},
+    "webp-fast": {"format": "WEBP", "ext": ".webp", "params": {"quality": 75, "method": 0}},
+    "jpeg": {"format": "JPEG", "ext": ".jpg", "params": {"quality": 85}},
+    "jpeg-fast": {"format": "JPEG", "ext": ".jpg", "params": {"quality": 70}},
+}
+
+def _lap(timings, stage, t0):
+    t1 = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (t1 - t0)
+    return t1
+
+def thumbnail_from_image(img: Image.Image, dst: Path, size=(512,512), codec: str = "png", timings: dict = None):
+    """Resize (in place) then convert and encode. Stage times in seconds go into timings if given."""
+    preset = THUMBNAIL_PRESETS[codec]
+    t = time.perf_counter()
+    # palette/bilevel images can only be resized with NEAREST; convert those first,
+    # everything else is resized before the conversion so convert() only touches the small image
+    if img.mode in ("P", "PA", "1"):
+        img = img.convert("RGB")
+    img.thumbnail(size, reducing_gap=2.0)
+    t = _lap(timings, "resize", t)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    t = _lap(timings, "convert", t)
     dst.parent.mkdir(parents=True, exist_ok=True)
-    img.save(dst, format="PNG", optimize=True)
+    img.save(dst, format=preset["format"], **preset["params"])
+    _lap(timings, "encode", t)
     return dst
+
+def make_thumbnail(src: Path, dst: Path, size=(512,512), codec: str = "png", timings: dict = None):
+    t = time.perf_counter()
+    img = Image.open(src)
+    t = _lap(timings, "open", t)
+    # JPEG: let libjpeg scale down by 1/2..1/8 while decoding instead of decoding full size
+    img.draft("RGB", (size[0] * 2, size[1] * 2))
+    img.load()
+    _lap(timings, "decode", t)
+    return thumbnail_from_image(img, dst, size, codec=codec, timings=timings)
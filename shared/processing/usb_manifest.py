@@ -0,0 +1,270 @@
+"""
+Bulk-copy fast path for removable volumes.
+- BulkCopyDetector watches usb file events per volume; once more than `threshold`
+  arrive within `window` seconds the volume switches to bulk mode, further per-file
+  events are absorbed, and `on_bulk(root, serial)` fires after `settle` quiet seconds
+- ManifestScanner walks the volume with os.scandir, re-hashes (in parallel) only files
+  whose size/mtime differ from the previous manifest stored for that volume serial,
+  and saves the new manifest
+- manifest_events() turns a scan into "usb_manifest" events: new/changed files and
+  removed paths, gzip+base64 encoded, `chunk` files per event so they ride the normal
+  EventQueue batches
+"""
+
+import base64
+import gzip
+import json
+import logging
+import os
+import stat
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from shared.processing.hasher import sha256_of_file
+
+logger = logging.getLogger("usb_manifest")
+
+MANIFEST_ENCODING = "gzip+base64"
+HASH_BATCH = 256
+
+def volume_root(path) -> str:
+    """Mount point (POSIX) or drive root (Windows) containing path."""
+    p = os.path.abspath(str(path))
+    if sys.platform == "win32":
+        return os.path.splitdrive(p)[0] + "\\"
+    while not os.path.ismount(p):
+        parent = os.path.dirname(p)
+        if parent == p:
+            break
+        p = parent
+    return p
+
+def volume_serial(root: str) -> str:
+    """Filesystem serial/UUID of the volume mounted at root; falls back to st_dev."""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            serial = ctypes.c_uint32()
+            if ctypes.windll.kernel32.GetVolumeInformationW(ctypes.c_wchar_p(root), None, 0, ctypes.byref(serial), None, None, None, 0):
+                return f"{serial.value:08X}"
+        else:
+            dev = None
+            with open("/proc/self/mounts") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) > 1 and parts[1].replace("\\040", " ") == root:
+                        dev = os.path.realpath(parts[0])
+            by_uuid = "/dev/disk/by-uuid"
+            if dev and os.path.isdir(by_uuid):
+                for name in os.listdir(by_uuid):
+                    if os.path.realpath(os.path.join(by_uuid, name)) == dev:
+                        return name
+    except Exception:
+        logger.exception("volume serial lookup failed for %s", root)
+    return f"dev-{os.stat(root).st_dev:x}"
+
+class BulkCopyDetector:
+    def __init__(self, on_bulk: Callable[[str, str], None], threshold: int = 200, window: float = 10.0, settle: float = 5.0):
+        self.on_bulk = on_bulk
+        self.threshold = threshold
+        self.window = window
+        self.settle = settle
+        self._recent = {}  # root -> deque of arrival times
+        self._bulk = {}    # root -> [serial, last_seen, absorbed]
+        self._cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.stats = {"bulk_copies": 0, "absorbed": 0}
+
+    def observe(self, ev: dict) -> bool:
+        """True if the event belongs to a bulk copy and must not be handled per file."""
+        path = ev.get("file_path")
+        if path is None:
+            return False
+        root = ev.get("volume_root") or volume_root(path)
+        now = time.monotonic()
+        with self._cond:
+            entry = self._bulk.get(root)
+            if entry is not None:
+                entry[1] = now
+                entry[2] += 1
+                self.stats["absorbed"] += 1
+                return True
+            recent = self._recent.setdefault(root, deque())
+            recent.append(now)
+            while recent and recent[0] < now - self.window:
+                recent.popleft()
+            if len(recent) < self.threshold:
+                return False
+            del self._recent[root]
+        # serial lookup touches the filesystem; keep it outside the lock
+        serial = ev.get("volume_serial") or volume_serial(root)
+        with self._cond:
+            self._bulk.setdefault(root, [serial, now, 0])
+            self.stats["bulk_copies"] += 1
+            self.stats["absorbed"] += 1
+            self._cond.notify()
+        logger.info("bulk copy detected on %s (%s)", root, serial)
+        return True
+
+    def _run(self):
+        while self.running:
+            with self._cond:
+                now = time.monotonic()
+                due = [(root, e) for root, e in self._bulk.items() if now - e[1] >= self.settle]
+                for root, _ in due:
+                    del self._bulk[root]
+                if not due:
+                    waits = [self.settle - (now - e[1]) for e in self._bulk.values()]
+                    self._cond.wait(min(waits) if waits else None)
+                    continue
+            for root, (serial, _, absorbed) in due:
+                logger.info("bulk copy on %s settled after %d events", root, absorbed)
+                try:
+                    self.on_bulk(root, serial)
+                except Exception:
+                    logger.exception("bulk copy handler failed")
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="usb-bulk-detector", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+
+class ManifestScanner:
+    def __init__(self, store_dir: Path, workers: int = 4, hash_fn: Callable[[Path], str] = sha256_of_file):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = workers
+        self.hash_fn = hash_fn
+
+    def _manifest_path(self, serial: str) -> Path:
+        return self.store_dir / f"{''.join(c if c.isalnum() or c in '-_' else '_' for c in serial)}.json.gz"
+
+    def load(self, serial: str) -> dict:
+        """{relpath: [size, mtime_ns, sha256]} from the last scan of this volume, or {}."""
+        p = self._manifest_path(serial)
+        if not p.exists():
+            return {}
+        try:
+            with gzip.open(p, "rt", encoding="utf-8") as f:
+                return json.load(f)["files"]
+        except Exception:
+            logger.exception("manifest load failed for %s", serial)
+            return {}
+
+    def save(self, serial: str, root: str, files: dict):
+        p = self._manifest_path(serial)
+        tmp = p.with_suffix(".tmp")
+        data = json.dumps({"serial": serial, "root": root, "scanned_at": time.time(), "files": files}, separators=(",", ":"))
+        with gzip.open(tmp, "wb", compresslevel=3) as f:
+            f.write(data.encode("utf-8"))
+        os.replace(tmp, p)
+
+    @staticmethod
+    def walk(root: str):
+        """(relpath, size, mtime_ns) of every regular file under root; symlinks are not followed."""
+        stack = [(root, "")]
+        while stack:
+            d, prefix = stack.pop()
+            try:
+                it = os.scandir(d)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, prefix + entry.name + "/"))
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            if stat.S_ISREG(st.st_mode):
+                                yield prefix + entry.name, st.st_size, st.st_mtime_ns
+                    except OSError:
+                        continue
+
+    def _hash_batch(self, root: str, batch):
+        out = []
+        for rel, _, _ in batch:
+            try:
+                out.append(self.hash_fn(Path(root) / rel))
+            except OSError:
+                out.append(None)
+        return out
+
+    def scan(self, root: str, serial: str) -> dict:
+        """Diff the volume against its previous manifest; only new/changed files are hashed."""
+        t0 = time.monotonic()
+        previous = self.load(serial)
+        files, todo = {}, []
+        for rel, size, mtime_ns in self.walk(root):
+            old = previous.get(rel)
+            if old is not None and old[0] == size and old[1] == mtime_ns:
+                files[rel] = old
+            else:
+                todo.append((rel, size, mtime_ns))
+        added, changed, failed = [], [], 0
+        if todo:
+            # thumb drives are mostly small files: hand workers batches, not single files
+            n = max(1, min(HASH_BATCH, len(todo) // self.workers))
+            batches = [todo[i:i + n] for i in range(0, len(todo), n)]
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="usb-hash") as pool:
+                for batch, digests in zip(batches, pool.map(lambda b: self._hash_batch(root, b), batches)):
+                    for (rel, size, mtime_ns), digest in zip(batch, digests):
+                        if digest is None:
+                            # unreadable this time (locked, flaky read): keep the last known entry
+                            # so it is not reported as removed and re-added on the next scan
+                            failed += 1
+                            if rel in previous:
+                                files[rel] = previous[rel]
+                            continue
+                        files[rel] = [size, mtime_ns, digest]
+                        (changed if rel in previous else added).append(rel)
+        removed = [rel for rel in previous if rel not in files]
+        if added or changed or removed:
+            self.save(serial, root, files)
+        return {"serial": serial, "root": root, "files": files, "added": added, "changed": changed,
+                "removed": removed, "failed": failed, "hashed": len(todo), "seconds": time.monotonic() - t0}
+
+def _encode(obj) -> str:
+    return base64.b64encode(gzip.compress(json.dumps(obj, separators=(",", ":")).encode("utf-8"), compresslevel=6)).decode("ascii")
+
+def decode_manifest(data: str):
+    return json.loads(gzip.decompress(base64.b64decode(data)))
+
+def manifest_events(scan: dict, device_id=None, user_email=None, chunk: int = 5000) -> list:
+    """One "usb_manifest" event per `chunk` new/changed files; removed paths ride on the first."""
+    files = scan["files"]
+    status = [(rel, "added") for rel in scan["added"]] + [(rel, "changed") for rel in scan["changed"]]
+    parts = [status[i:i + chunk] for i in range(0, len(status), chunk)] or [[]]
+    scan_id = uuid.uuid4().hex[:12]
+    now = time.time()
+    events = []
+    for i, part in enumerate(parts):
+        body = {"files": [[rel, files[rel][0], files[rel][2], st] for rel, st in part]}
+        if i == 0:
+            body["removed"] = scan["removed"]
+        events.append({
+            "event_id": f"usbm-{scan_id}-{i}", "event_type": "usb_manifest", "device_id": device_id,
+            "user_email": user_email, "timestamp": now, "destination": "usb",
+            "volume_serial": scan["serial"], "volume_root": scan["root"], "scan_id": scan_id,
+            "part": i, "parts": len(parts), "file_count": len(files),
+            "total_bytes": sum(v[0] for v in files.values()), "added": len(scan["added"]),
+            "changed": len(scan["changed"]), "removed": len(scan["removed"]), "failed": scan["failed"],
+            "manifest_encoding": MANIFEST_ENCODING, "manifest": _encode(body),
+        })
+    return events
@@ -1,13 +1,19 @@
-import threading, time, logging
+import threading, time, logging, random
+import requests
 
 logger = logging.getLogger("transport.command_listener")
 ALLOWED_COMMANDS = {"WARN_USER", "QUARANTINE_FILE", "DISABLE_USB", "DISABLE_UPLOAD", "BLOCK_TRANSFER"}
 
 class CommandListener:
-    def __init__(self, sender, device_id: str, poll_interval=10):
+    def __init__(self, sender, device_id: str, poll_interval=10, long_poll=True, long_poll_timeout=25, long_poll_min_interval=1.0):
         self.sender = sender
         self.device_id = device_id
         self.poll_interval = poll_interval
+        # long-poll the collector; plain polling every poll_interval is the fallback
+        self.long_poll = long_poll
+        self.long_poll_timeout = long_poll_timeout
+        # first backoff after an empty long-poll that came back early; doubles up to poll_interval
+        self.long_poll_min_interval = long_poll_min_interval
         self.running = False
         self.thread = None
 
@@ -17,6 +23,19 @@ class CommandListener:
         resp.raise_for_status()
         return resp.json()
 
+    def wait_once(self):
+        url = f"{self.sender.base_url}/api/v1/agents/{self.device_id}/commands/wait"
+        resp = self.sender.session.get(url, params={"timeout": self.long_poll_timeout}, headers=self.sender._headers(), cert=self.sender.client_cert, verify=self.sender.ca_bundle or True, timeout=self.long_poll_timeout + 10)
+        resp.raise_for_status()
+        return resp.json()
+
+    def ack(self, ids):
+        # unacked commands are redelivered once their lease on the collector expires
+        url = f"{self.sender.base_url}/api/v1/agents/{self.device_id}/commands/ack"
+        resp = self.sender.session.post(url, json={"ids": list(ids)}, headers=self.sender._headers(), cert=self.sender.client_cert, verify=self.sender.ca_bundle or True, timeout=20)
+        resp.raise_for_status()
+        return resp.json()
+
     def handle_command(self, cmd: dict):
         typ = cmd.get("type")
         if typ not in ALLOWED_COMMANDS:
@@ -25,14 +44,36 @@ class CommandListener:
         logger.info("Handling command: %s", typ)
 
     def _loop(self):
+        early = 0
         while self.running:
             try:
-                cmds = self.poll_once()
+                started = time.monotonic()
+                cmds = self.wait_once() if self.long_poll else self.poll_once()
                 for c in cmds:
                     try:
                         self.handle_command(c)
                     except Exception:
                         logger.exception("command handling failed")
+                if cmds:
+                    try:
+                        self.ack([c["id"] for c in cmds])
+                    except Exception:
+                        logger.exception("command ack failed")
+                if self.long_poll:
+                    # the server held the request until there was work or it timed out; re-arm now
+                    if cmds or time.monotonic() - started >= self.long_poll_timeout / 2:
+                        early = 0
+                        continue
+                    # empty and early (proxy idle cutoff, collector restarting): back off with jitter
+                    early += 1
+                    time.sleep(min(self.poll_interval, self.long_poll_min_interval * 2 ** (early - 1)) * random.uniform(0.5, 1.0))
+                    continue
+            except requests.HTTPError as e:
+                if self.long_poll and e.response is not None and e.response.status_code == 404:
+                    logger.info("collector has no long-poll endpoint, falling back to polling")
+                    self.long_poll = False
+                else:
+                    logger.exception("command poll error")
             except Exception:
                 logger.exception("command poll error")
             time.sleep(self.poll_interval)
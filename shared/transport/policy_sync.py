@@ -0,0 +1,116 @@
+"""
+Conditional policy download for the agents.
+- Sends If-None-Match with the cached ETag; a 304 costs no body and no JSON parsing
+- Sends ?since=<version> so the collector can answer with an RFC 6902 patch
+- Verifies a patched policy against the ETag and falls back to a full download on mismatch
+- Keeps policy_cache.json as the plain policy; etag/version live in policy_cache.meta.json
+- fetch() only stages a new policy; commit() adopts and persists it once the agent has
+  applied it, so a policy the agent failed to apply is downloaded again next time
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import requests
+
+logger = logging.getLogger("transport.policy_sync")
+
+def policy_etag(policy: dict) -> str:
+    # must match backend app.policy.policy_etag
+    return hashlib.sha256(json.dumps(policy, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+def apply_patch(doc, ops):
+    """Apply add/remove/replace operations on dict paths (what the collector emits)."""
+    doc = copy.deepcopy(doc)
+    for op in ops:
+        parts = [_unescape(p) for p in op["path"].split("/")[1:]]
+        if not parts:
+            if op["op"] != "replace":
+                raise ValueError(f"unsupported root op {op['op']}")
+            doc = copy.deepcopy(op["value"])
+            continue
+        parent = doc
+        for p in parts[:-1]:
+            parent = parent[p]
+        key = parts[-1]
+        if op["op"] in ("add", "replace"):
+            parent[key] = op["value"]
+        elif op["op"] == "remove":
+            del parent[key]
+        else:
+            raise ValueError(f"unsupported op {op['op']}")
+    return doc
+
+class PolicySync:
+    def __init__(self, server_url: str, cache_path: Path, ca_bundle=None, client_cert=None):
+        self.url = f"{server_url.rstrip('/')}/api/v1/policy"
+        self.cache_path = Path(cache_path)
+        self.meta_path = self.cache_path.with_name(self.cache_path.stem + ".meta.json")
+        self.verify = ca_bundle or True
+        self.cert = client_cert
+        self.policy = None
+        self.etag = None
+        self.version = None
+        self._staged = None
+        try:
+            self.policy = json.loads(self.cache_path.read_text())
+            meta = json.loads(self.meta_path.read_text())
+            self.etag, self.version = meta.get("etag"), meta.get("version")
+        except Exception:
+            pass
+        if self.policy is not None and self.etag != policy_etag(self.policy):
+            self.etag = self.version = None
+
+    def _write(self, path: Path, obj, indent=None):
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(obj, indent=indent))
+        os.replace(tmp, path)
+
+    def fetch(self, conditional: bool = True):
+        """Return the new policy dict (staged until commit()), or None when unchanged."""
+        self._staged = None
+        headers, params = {}, {}
+        if conditional and self.etag and self.policy is not None:
+            headers["If-None-Match"] = f'"{self.etag}"'
+            if self.version is not None:
+                params["since"] = self.version
+        resp = requests.get(self.url, headers=headers, params=params, timeout=10, verify=self.verify, cert=self.cert)
+        if resp.status_code == 304:
+            return None
+        resp.raise_for_status()
+        etag = resp.headers.get("ETag", "").strip('"') or None
+        version = resp.headers.get("X-Policy-Version")
+        version = int(version) if version else None
+        if resp.headers.get("Content-Type", "").startswith("application/json-patch+json"):
+            try:
+                policy = apply_patch(self.policy, resp.json())
+            except Exception:
+                logger.exception("policy patch failed")
+                policy = None
+            if policy is None or policy_etag(policy) != etag:
+                logger.warning("policy delta did not verify, fetching full policy")
+                return self.fetch(conditional=False)
+        else:
+            policy = resp.json()
+        self._staged = (policy, etag or policy_etag(policy), version)
+        return policy
+
+    @property
+    def staged_version(self):
+        return self._staged[2] if self._staged else self.version
+
+    def commit(self):
+        """Adopt and persist the policy returned by the last fetch()."""
+        if self._staged is None:
+            return
+        self.policy, self.etag, self.version = self._staged
+        self._staged = None
+        self._write(self.cache_path, self.policy, indent=2)
+        self._write(self.meta_path, {"etag": self.etag, "version": self.version})
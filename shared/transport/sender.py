@@ -1,11 +1,20 @@
-import requests, json
+import requests, json, hashlib, mimetypes, os, uuid
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import logging
+import threading
+import time
+from collections import OrderedDict, deque
 from typing import Optional
 
 logger = logging.getLogger("transport.sender")
 
+KNOWN_THUMBNAILS_MAX = 4096
+DELIVERED = ("ok", "duplicate")
+
+class BatchNotStored(Exception):
+    """The collector answered, but some events of the batch were not stored; resend it."""
+
 class SecureSender:
     def __init__(self, base_url: str, client_cert: Optional[tuple]=None, jwt_token: Optional[str]=None, ca_bundle: Optional[str]=None):
         self.base_url = base_url.rstrip('/')
@@ -15,6 +24,7 @@ class SecureSender:
         self.client_cert = client_cert
         self.jwt_token = jwt_token
         self.ca_bundle = ca_bundle
+        self._known_thumbnails = OrderedDict()  # thumbnail sha256s the collector already has
 
     def _headers(self):
         h = {"Content-Type": "application/json"}
@@ -29,10 +39,201 @@ class SecureSender:
         resp.raise_for_status()
         return resp.json()
 
+    def send_events(self, events: list):
+        # one round-trip for many events; returns per-event statuses from the collector
+        url = f"{self.base_url}/api/v1/events:batch"
+        logger.debug("POST %s (%d events)", url, len(events))
+        resp = self.session.post(url, data=json.dumps({"events": events}), headers=self._headers(), cert=self.client_cert, verify=self.ca_bundle or True, timeout=30)
+        resp.raise_for_status()
+        return resp.json()
+
+    def complete_event_hash(self, event_id: str, sha256: str, sampled_fingerprint: Optional[str] = None) -> bool:
+        """PATCH the full sha256 onto an event sent with a sampled fingerprint.
+        False if the collector does not have the event yet (still queued or spooled)."""
+        url = f"{self.base_url}/api/v1/events/{event_id}"
+        resp = self.session.patch(url, data=json.dumps({"sha256": sha256, "sampled_fingerprint": sampled_fingerprint}), headers=self._headers(), cert=self.client_cert, verify=self.ca_bundle or True, timeout=10)
+        if resp.status_code == 404:
+            return False
+        if resp.status_code == 409:
+            logger.info("event %s changed since it was fingerprinted; full hash dropped", event_id)
+            return True
+        resp.raise_for_status()
+        return True
+
+    def thumbnail_known(self, digest: str) -> bool:
+        url = f"{self.base_url}/api/v1/thumbnails/{digest}"
+        try:
+            resp = self.session.head(url, headers=self._headers(), cert=self.client_cert, verify=self.ca_bundle or True, timeout=5)
+        except requests.RequestException:
+            return False
+        return resp.status_code == 200
+
     def upload_thumbnail(self, event_id: str, thumbnail_path: str):
-        url = f"{self.base_url}/api/v1/events/{event_id}/thumbnail"
+        """Attach a thumbnail to an event. None if the collector does not have the event yet."""
         with open(thumbnail_path, "rb") as f:
-            files = {"thumbnail": ("thumbnail.png", f, "image/png")}
-            resp = self.session.post(url, files=files, headers={}, cert=self.client_cert, verify=self.ca_bundle or True, timeout=15)
+            digest = hashlib.sha256(f.read()).hexdigest()
+            # the collector stores thumbnails by content; a known one is attached by reference
+            if digest in self._known_thumbnails or self.thumbnail_known(digest):
+                url = f"{self.base_url}/api/v1/events/{event_id}/thumbnail_ref"
+                resp = self.session.post(url, data=json.dumps({"sha256": digest}), headers=self._headers(), cert=self.client_cert, verify=self.ca_bundle or True, timeout=10)
+                if resp.status_code != 404:
+                    resp.raise_for_status()
+                    self._remember_thumbnail(digest)
+                    return resp.json()
+                self._known_thumbnails.pop(digest, None)
+            f.seek(0)
+            url = f"{self.base_url}/api/v1/events/{event_id}/thumbnail"
+            name = os.path.basename(thumbnail_path)
+            files = {"thumbnail": (name, f, mimetypes.guess_type(name)[0] or "image/png")}
+            # collector verifies the digest while streaming the upload to disk
+            resp = self.session.post(url, files=files, headers={"X-Content-SHA256": digest}, cert=self.client_cert, verify=self.ca_bundle or True, timeout=15)
+            if resp.status_code == 404:
+                return None
             resp.raise_for_status()
+            self._remember_thumbnail(digest)
             return resp.json()
+
+    def _remember_thumbnail(self, digest: str):
+        self._known_thumbnails[digest] = True
+        self._known_thumbnails.move_to_end(digest)
+        while len(self._known_thumbnails) > KNOWN_THUMBNAILS_MAX:
+            self._known_thumbnails.popitem(last=False)
+
+class EventQueue:
+    """Non-blocking front for SecureSender.
+
+    submit() only appends to a bounded in-memory buffer; a background thread
+    flushes it with send_events() once max_batch events are waiting or the
+    oldest event is max_age seconds old. When the buffer is full the oldest
+    event is dropped and counted.
+
+    With a spool (shared.transport.spool.EventSpool) failed batches are
+    persisted instead of lost, and while anything is spooled new batches go
+    behind it so delivery stays in order.
+    """
+    def __init__(self, sender: SecureSender, max_size: int = 10000, max_batch: int = 200, max_age: float = 2.0, spool=None, spool_retry: float = 30.0):
+        self.sender = sender
+        self.spool = spool
+        self.spool_retry = spool_retry
+        self.max_size = max_size
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self._buf = deque()
+        self._oldest = None
+        self._cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.stats = {"enqueued": 0, "dropped": 0, "sent": 0, "failed": 0, "batches": 0, "spooled": 0}
+
+    def submit(self, event: dict) -> bool:
+        # ids are fixed on the agent so a resent batch comes back "duplicate" instead of stored twice
+        event.setdefault("event_id", f"evt-{uuid.uuid4().hex[:12]}")
+        with self._cond:
+            dropped = False
+            if len(self._buf) >= self.max_size:
+                self._buf.popleft()
+                self.stats["dropped"] += 1
+                dropped = True
+            if not self._buf:
+                self._oldest = time.monotonic()
+            self._buf.append(event)
+            self.stats["enqueued"] += 1
+            if len(self._buf) >= self.max_batch:
+                self._cond.notify()
+        return not dropped
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._buf)
+
+    def _take_batch(self):
+        with self._cond:
+            while self.running:
+                if len(self._buf) >= self.max_batch:
+                    break
+                if self._buf:
+                    wait = self._oldest + self.max_age - time.monotonic()
+                    if wait <= 0:
+                        break
+                elif self.spool is not None and self.spool.pending():
+                    # idle but spooled events are waiting: wake up to retry the drain
+                    self._cond.wait(self.spool_retry)
+                    break
+                else:
+                    wait = None
+                self._cond.wait(wait)
+            n = min(len(self._buf), self.max_batch)
+            batch = [self._buf.popleft() for _ in range(n)]
+            self._oldest = time.monotonic() if self._buf else None
+            return batch
+
+    def _post(self, batch):
+        resp = self.sender.send_events(batch)
+        results = resp.get("results") if isinstance(resp, dict) else None
+        if results is None or len(results) != len(batch):
+            raise BatchNotStored(f"collector returned {len(results or [])} results for {len(batch)} events")
+        bad = [r for r in results if r.get("status") not in DELIVERED]
+        if bad:
+            raise BatchNotStored(f"{len(bad)} of {len(batch)} events not stored ({bad[0].get('status')})")
+        self.stats["sent"] += len(batch)
+        self.stats["batches"] += 1
+
+    def _send(self, batch):
+        if self.spool is not None and self.spool.pending():
+            self._spool(batch)
+            self._drain_spool()
+            return
+        try:
+            self._post(batch)
+        except Exception:
+            logger.exception("batch send failed (%d events)", len(batch))
+            if self.spool is not None:
+                self._spool(batch)
+            else:
+                self.stats["failed"] += len(batch)
+
+    def _spool(self, batch):
+        try:
+            self.spool.append(batch)
+            self.stats["spooled"] += len(batch)
+        except Exception:
+            logger.exception("spool append failed (%d events)", len(batch))
+            self.stats["failed"] += len(batch)
+
+    def _drain_spool(self):
+        try:
+            self.spool.drain(self._post, self.max_batch)
+        except Exception:
+            logger.exception("spool drain failed")
+
+    def _loop(self):
+        while self.running:
+            batch = self._take_batch()
+            if batch:
+                self._send(batch)
+            elif self.spool is not None and self.spool.pending():
+                self._drain_spool()
+        # drain what is left on shutdown
+        while True:
+            with self._cond:
+                n = min(len(self._buf), self.max_batch)
+                batch = [self._buf.popleft() for _ in range(n)]
+            if not batch:
+                break
+            self._send(batch)
+        if self.spool is not None:
+            self.spool.close()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=timeout)
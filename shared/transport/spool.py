@@ -0,0 +1,259 @@
+"""
+Durable on-disk spool for events that could not be delivered.
+- Append-only segment files (<seq>.seg) of length-prefixed Fernet records
+- index.json holds the read position; rewritten atomically after each drain step
+- A torn record at the tail of the last segment (crash mid-append) is truncated on open
+- Total size is capped; the oldest segments are evicted first
+- Drain failures are retried unless the collector rejected the batch outright (4xx other
+  than 408/429); a rejected batch is then sent record by record and any record rejected
+  max_rejects times is moved to quarantine.dat (same record format) so it cannot block
+  the records behind it
+"""
+
+import json
+import logging
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from shared.utils.crypto import ensure_key
+
+logger = logging.getLogger("transport.spool")
+
+_HDR = struct.Struct(">I")
+RETRYABLE_STATUS = (408, 429)
+
+def is_retryable(exc: Exception) -> bool:
+    """False only for an HTTP 4xx answer (other than 408/429): resending the same records won't help."""
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status not in RETRYABLE_STATUS)
+
+class EventSpool:
+    def __init__(self, directory: Path, max_bytes: int = 256 * 1024 * 1024, segment_bytes: int = 8 * 1024 * 1024, fsync: bool = True, key: Optional[bytes] = None, max_rejects: int = 3):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        try:
+            os.chmod(str(self.dir), 0o700)
+        except Exception:
+            pass
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.max_rejects = max_rejects
+        self._rejects = {}          # (segment, offset) of a rejected batch -> rejections so far
+        self._isolate_until = None  # send one record at a time until the read position reaches this
+        self._fernet = Fernet(key or ensure_key())
+        self._lock = threading.RLock()
+        self.index_path = self.dir / "index.json"
+        self.stats = {"appended": 0, "drained": 0, "corrupt": 0, "evicted_segments": 0, "evicted_bytes": 0, "quarantined": 0}
+        self._segments = sorted(int(p.stem) for p in self.dir.glob("*.seg") if p.stem.isdigit())
+        self._sizes = {}
+        self._read_seg, self._read_off = self._load_index()
+        if self._segments:
+            self._recover_tail(self._segments[-1])
+        for seq in self._segments:
+            self._sizes[seq] = self._seg_path(seq).stat().st_size
+        if not self._segments:
+            self._read_seg, self._read_off = 1, 0
+        elif self._read_seg not in self._sizes:
+            self._read_seg, self._read_off = self._segments[0], 0
+        else:
+            self._read_off = min(self._read_off, self._sizes[self._read_seg])
+        self._wf = None
+
+    def _seg_path(self, seq: int) -> Path:
+        return self.dir / f"{seq:012d}.seg"
+
+    def _load_index(self):
+        try:
+            idx = json.loads(self.index_path.read_text())
+            return int(idx["segment"]), int(idx["offset"])
+        except Exception:
+            return 0, 0
+
+    def _save_index(self):
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"segment": self._read_seg, "offset": self._read_off}))
+        os.replace(tmp, self.index_path)
+
+    def _recover_tail(self, seq: int):
+        path = self._seg_path(seq)
+        good = 0
+        with path.open("rb") as f:
+            while True:
+                hdr = f.read(_HDR.size)
+                if len(hdr) < _HDR.size:
+                    break
+                (n,) = _HDR.unpack(hdr)
+                body = f.read(n)
+                if len(body) < n:
+                    break
+                good = f.tell()
+        if good != path.stat().st_size:
+            logger.warning("truncating torn spool record in %s at %d", path.name, good)
+            with path.open("r+b") as f:
+                f.truncate(good)
+
+    def _writer(self):
+        if self._wf is None:
+            if not self._segments:
+                self._segments.append(max(self._read_seg, 1))
+            seq = self._segments[-1]
+            self._wf = self._seg_path(seq).open("ab")
+            self._sizes.setdefault(seq, self._wf.tell())
+        return self._wf
+
+    def _roll(self):
+        self._close_writer()
+        seq = self._segments[-1] + 1
+        self._segments.append(seq)
+        self._sizes[seq] = 0
+
+    def _close_writer(self):
+        if self._wf is not None:
+            self._wf.flush()
+            if self.fsync:
+                os.fsync(self._wf.fileno())
+            self._wf.close()
+            self._wf = None
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def pending(self) -> bool:
+        with self._lock:
+            if not self._segments:
+                return False
+            last = self._segments[-1]
+            return self._read_seg < last or self._read_off < self._sizes.get(last, 0)
+
+    def append(self, events: list):
+        with self._lock:
+            for ev in events:
+                token = self._fernet.encrypt(json.dumps(ev).encode("utf-8"))
+                f = self._writer()
+                seq = self._segments[-1]
+                f.write(_HDR.pack(len(token)))
+                f.write(token)
+                self._sizes[seq] += _HDR.size + len(token)
+                self.stats["appended"] += 1
+                if self._sizes[seq] >= self.segment_bytes:
+                    self._roll()
+            if self._wf is not None:
+                self._wf.flush()
+                if self.fsync:
+                    os.fsync(self._wf.fileno())
+            self._evict()
+
+    def _evict(self):
+        # drop whole segments, oldest first, but never the one being written
+        while len(self._segments) > 1 and sum(self._sizes.values()) > self.max_bytes:
+            seq = self._segments.pop(0)
+            size = self._sizes.pop(seq, 0)
+            try:
+                self._seg_path(seq).unlink()
+            except FileNotFoundError:
+                pass
+            self.stats["evicted_segments"] += 1
+            self.stats["evicted_bytes"] += size
+            logger.warning("spool full, evicted segment %d (%d bytes)", seq, size)
+            if self._read_seg <= seq:
+                self._read_seg, self._read_off = self._segments[0], 0
+                self._save_index()
+
+    def _read_batch(self, max_records: int):
+        """Read up to max_records from the read position. Returns (events, seg, off)."""
+        events = []
+        seg, off = self._read_seg, self._read_off
+        while len(events) < max_records and seg in self._sizes:
+            if off >= self._sizes[seg]:
+                if seg == self._segments[-1]:
+                    break
+                seg, off = self._segments[self._segments.index(seg) + 1], 0
+                continue
+            with self._seg_path(seg).open("rb") as f:
+                f.seek(off)
+                while len(events) < max_records and off < self._sizes[seg]:
+                    (n,) = _HDR.unpack(f.read(_HDR.size))
+                    token = f.read(n)
+                    off += _HDR.size + n
+                    try:
+                        events.append(json.loads(self._fernet.decrypt(token)))
+                    except (InvalidToken, ValueError):
+                        self.stats["corrupt"] += 1
+                        logger.warning("skipping unreadable spool record in segment %d", seg)
+        return events, seg, off
+
+    def _advance(self, seg: int, off: int):
+        # delete fully consumed segments except the active write segment
+        for old in [s for s in self._segments if s < seg]:
+            self._segments.remove(old)
+            self._sizes.pop(old, None)
+            try:
+                self._seg_path(old).unlink()
+            except FileNotFoundError:
+                pass
+        self._read_seg, self._read_off = seg, off
+        self._save_index()
+
+    def _quarantine(self, events: list):
+        with (self.dir / "quarantine.dat").open("ab") as f:
+            for ev in events:
+                token = self._fernet.encrypt(json.dumps(ev).encode("utf-8"))
+                f.write(_HDR.pack(len(token)))
+                f.write(token)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.stats["quarantined"] += len(events)
+
+    def drain(self, send_fn, batch_size: int = 200, retryable=is_retryable) -> int:
+        """Send spooled events in order via send_fn(list).
+
+        Stops at the first retryable failure. A non-retryable one stops the drain too until
+        the same batch has been rejected max_rejects times; then its records are retried one
+        by one and each record rejected max_rejects times is quarantined and skipped.
+        """
+        sent = 0
+        with self._lock:
+            while True:
+                pos = (self._read_seg, self._read_off)
+                if self._isolate_until is not None and pos >= self._isolate_until:
+                    self._isolate_until = None
+                events, seg, off = self._read_batch(1 if self._isolate_until is not None else batch_size)
+                if not events and (seg, off) == pos:
+                    break
+                if events:
+                    try:
+                        send_fn(events)
+                    except Exception as e:
+                        if retryable(e):
+                            logger.warning("spool drain stopped, will retry: %s", e)
+                            break
+                        rejects = self._rejects[pos] = self._rejects.get(pos, 0) + 1
+                        if rejects < self.max_rejects:
+                            logger.warning("spooled batch rejected (%d/%d), will retry: %s", rejects, self.max_rejects, e)
+                            break
+                        del self._rejects[pos]
+                        if len(events) > 1:
+                            logger.warning("spooled batch of %d rejected %d times, sending it record by record", len(events), rejects)
+                            self._isolate_until = (seg, off)
+                            continue
+                        logger.error("spooled record rejected %d times, quarantined: %s", rejects, e)
+                        self._quarantine(events)
+                        self._advance(seg, off)
+                        continue
+                    self._rejects.pop(pos, None)
+                    sent += len(events)
+                    self.stats["drained"] += len(events)
+                self._advance(seg, off)
+        return sent
+
+    def close(self):
+        with self._lock:
+            self._close_writer()
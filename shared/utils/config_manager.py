@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+In-memory cache of the encrypted agent config.
+- Decrypts agent_config.enc once and keeps the dict and the Fernet instance
+- Reloads only when the file's inode/mtime/size change, or after invalidate()
+- save() writes to a temp file and renames it over the config (atomic)
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from cryptography.fernet import Fernet
+
+from shared.utils.crypto import ensure_key
+
+logger = logging.getLogger("config_manager")
+
+class ConfigManager:
+    def __init__(self, enc_path: Path, plain_fallback: Optional[Path] = None):
+        self.enc_path = Path(enc_path)
+        self.plain_fallback = Path(plain_fallback) if plain_fallback else None
+        self._lock = threading.Lock()
+        self._fernet = None
+        self._cfg = {}
+        self._sig = None
+        self._stale = True
+
+    def _signature(self):
+        try:
+            st = os.stat(self.enc_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _get_fernet(self):
+        if self._fernet is None:
+            self._fernet = Fernet(ensure_key())
+        return self._fernet
+
+    def _load(self, sig):
+        if sig is not None:
+            try:
+                return json.loads(self._get_fernet().decrypt(self.enc_path.read_bytes()).decode("utf-8"))
+            except Exception:
+                logger.exception("decrypt failed")
+        if self.plain_fallback and self.plain_fallback.exists():
+            try:
+                return json.loads(self.plain_fallback.read_text())
+            except Exception:
+                pass
+        return {}
+
+    def get(self) -> dict:
+        """Return a shallow copy of the current config; costs one stat() when unchanged."""
+        sig = self._signature()
+        if self._stale or sig != self._sig:
+            with self._lock:
+                sig = self._signature()
+                if self._stale or sig != self._sig:
+                    self._cfg = self._load(sig)
+                    self._sig = sig
+                    self._stale = False
+        return dict(self._cfg)
+
+    def invalidate(self, reload_key: bool = False):
+        """Force a reload on the next get() (e.g. from a SIGHUP handler)."""
+        self._stale = True
+        if reload_key:
+            self._fernet = None
+
+    def save(self, cfg: dict):
+        with self._lock:
+            data = self._get_fernet().encrypt(json.dumps(cfg).encode("utf-8"))
+            self.enc_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.enc_path.with_name(self.enc_path.name + ".tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.chmod(str(tmp), 0o600)
+            except Exception:
+                pass
+            os.replace(tmp, self.enc_path)
+            self._cfg = dict(cfg)
+            self._sig = self._signature()
+            self._stale = False